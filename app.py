@@ -1,10 +1,54 @@
+import json
+import os
+import time
+from html import escape
+from pathlib import Path
+
 import streamlit as st
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
-from core.file_io import read_uploaded_file
-from core.project_state import MODULES, create_empty_project, get_module_input, has_current, save_version
-from core.diff_utils import diff_html
-from core.run_module import run_module
-from core.export_utils import export_docx_bytes
+from core.file_io import SUPPORTED_EXTS, ingest_stream
+from core.incremental import plan_incremental
+from core.jobs import apply_job, get_jobs
+from core.project_state import (
+    MODULES,
+    Project,
+    create_empty_project,
+    ensure_loaded,
+    evict_idle_projects,
+    get_module_input,
+    has_current,
+    history_chars,
+    hold_project,
+    load_project,
+    rollback_to_version,
+    save_version,
+    source_text,
+    stale_modules,
+    sync_project,
+    version_text,
+)
+from core.budget import plan_budget
+from core.prefetch import get_prefetcher
+from core.preclean import preclean
+from core.cache import get_response_cache
+from core.diff_utils import cached_diff_opcodes, render_diff_html
+from core.grounding import check_grounding
+from core.metrics import get_metrics, start_metrics_server
+from core.post_check import check_text, render_hits_html
+from core.providers import get_registry
+from core.run_module import CHUNKABLE_MODULES
+from core.scheduler import run_dag
+from core.subtitles import SUBTITLE_MODULES, cue_records, cues_from_records
+from core.export_utils import (
+    EXPORT_EXT,
+    EXPORT_FORMATS,
+    EXPORT_MIME,
+    SUBTITLE_FORMAT,
+    export_bytes,
+    export_project_archive,
+    safe_filename,
+)
 
 try:
     from dotenv import load_dotenv  # type: ignore
@@ -56,9 +100,47 @@ st.markdown("""<div style="display:flex;align-items:baseline;gap:0.75rem;margin:
 """, unsafe_allow_html=True)
 
 if "project" not in st.session_state:
-    st.session_state["project"] = create_empty_project()
+    # 刷新页面后按 URL 里的 pid 从本地数据库恢复项目（历史版本按需加载）
+    _pid = st.query_params.get("pid")
+    _loaded = load_project(_pid) if _pid else None
+    if _loaded is None:
+        _loaded = create_empty_project(persist=True)
+        st.query_params["pid"] = _loaded["meta"]["project_id"]
+    st.session_state["project"] = _loaded
+
+
+def _session_project() -> Project:
+    """
+    The session's project, reloaded if it was released while idle. Also rebinds the global
+    `project` that fragments read, so a fragment rerun picks up the reloaded project.
+    """
+    global project
+    project = ensure_loaded(st.session_state["project"])
+    ctx = get_script_run_ctx()
+    if ctx is not None:
+        session_state, held = ctx.session_state, project
+
+        def _release(stub) -> None:
+            # 闲置释放：只把本会话里的引用换成占位，项目对象本身不动（可能仍有片段或任务在用）
+            if "project" in session_state and session_state["project"] is held:
+                session_state["project"] = stub
 
-project = st.session_state["project"]
+        hold_project(project, _release)
+    return project
+
+
+project = _session_project()
+sync_project(project)
+# 长时间无人访问的会话：项目写回数据库后从内存释放，下次访问时自动重新加载
+evict_idle_projects(float(os.getenv("PODCASTSOP_IDLE_EVICT_S", "1800")))
+
+# 可选：进程内指标接口，供 Prometheus 抓取
+METRICS_PORT = int(os.getenv("PODCASTSOP_METRICS_PORT", "0") or 0)
+if METRICS_PORT:
+    try:
+        start_metrics_server(METRICS_PORT)
+    except OSError as e:
+        st.warning(f"指标接口启动失败（端口 {METRICS_PORT}）：{e}")
 
 # 项目标题、发稿用途 一行
 top_row = st.columns([2, 1])
@@ -80,15 +162,82 @@ PURPOSE_TABS = {
 }
 current_tabs = PURPOSE_TABS.get(purpose, PURPOSE_TABS["公众号深度访谈"])
 
+def _grounding_enabled(module: str) -> bool:
+    # 严格不增内容时逐句核对；D 的金句无论如何都要来自原访谈
+    return bool(project["input_raw"].strip()) and (bool(project["settings"].get("strict_no_add")) or module == "D")
+
+
+def _flash(module: str, kind: str, msg: str) -> None:
+    # 需要整页重跑（刷新侧边栏和其他标签页）的操作，把提示留到重跑后再显示
+    st.session_state.setdefault(f"{module}_flash", []).append((kind, msg))
+
+
+JOB_STATUS_LABEL = {"queued": "排队中", "running": "生成中"}
+
+
+def _apply_job_result(job) -> None:
+    module = job.module
+    if job.status == "cancelled":
+        _flash(module, "info", "已取消生成。")
+        return
+    if job.status == "failed":
+        _flash(module, "error", f"{'生成失败' if job.use_cache else '重新生成失败'}：{job.error}")
+        return
+    if not apply_job(project, job):
+        return
+    result = job.result
+    st.session_state.pop(f"{module}_editor", None)
+    if job.incremental:
+        _flash(module, "info", f"增量处理：{result['dirty']}/{result['segments']} 段重新生成，其余段落沿用上次结果。")
+    if not result["post_check_ok"]:
+        _flash(module, "warning", f"后置校验提示：{result['post_check_msg']}")
+    if _grounding_enabled(module):
+        grounding = check_grounding(source_text(project), module, result["text"])
+        if not grounding.ok:
+            _flash(module, "warning", f"原文核对：{grounding.summary()}（详见「原文核对」）")
+
+
+def _apply_finished_jobs() -> None:
+    # 后台任务（可能是上一个会话提交的）结束后，在本次渲染时把结果写回项目
+    for job in get_jobs().take_finished(project["meta"].get("project_id") or ""):
+        _apply_job_result(job)
+
+
+PREFETCH_STATE_LABEL = {
+    "running": "正在后台预先生成模块 {module}",
+    "ready": "模块 {module} 已预先生成，点击「▶ 运行本模块」即可直接使用",
+    "budget": "近 1 小时未被使用的预取已达上限，暂停预取",
+}
+
+
+@st.fragment(run_every=1.0)
+def _prefetch_watch() -> None:
+    """Starts / discards speculative runs of the next module while the page is open."""
+    global project
+    # 轮询不算用户活动：会话闲置被释放后不在这里重新载入（否则打开的标签页永远不会被释放），
+    # 只换成占位（放掉旧对象），跳过本次检查，等用户下次操作时再载入
+    project = st.session_state["project"]
+    if project.get("evicted"):
+        return
+    status = get_prefetcher().tick(project, purpose)
+    if status["state"] == "waiting":
+        st.caption(f"预取：上游再保持 {int(status['wait_s']) + 1}s 不改动，就预先生成模块 {status['module']}")
+    elif status["state"] in PREFETCH_STATE_LABEL:
+        st.caption("预取：" + PREFETCH_STATE_LABEL[status["state"]].format(module=status["module"]))
+
+
+_apply_finished_jobs()
+
+
 with st.sidebar:
     st.header("项目控制台")
 
     st.subheader("输入区")
     uploaded = st.file_uploader(
-        "上传逐字稿（docx / txt / srt）",
-        type=["docx", "txt", "srt"],
+        "上传逐字稿（docx / txt / srt / vtt）",
+        type=list(SUPPORTED_EXTS),
         accept_multiple_files=False,
-        help="拖拽文件到此处，或点击「浏览文件」选择。支持 docx、txt、srt，单文件最大 200MB。",
+        help="拖拽文件到此处，或点击「浏览文件」选择。支持 docx、txt、srt、vtt，单文件最大 200MB。",
     )
     lang = st.selectbox("语言选择", ["中文", "英文", "双语"], index=0, key="meta_lang_ui")
     speaker_rules = st.text_area(
@@ -101,14 +250,36 @@ with st.sidebar:
     st.subheader("模型设置区")
     provider = st.selectbox("模型选择", ["DeepSeek", "OpenAI", "Qwen", "本地"], index=0, key="provider_ui")
     temperature = st.slider("温度", min_value=0.0, max_value=1.0, value=project["settings"]["temperature"], step=0.05)
+    auto_max_tokens = st.toggle(
+        "自动设定最大长度",
+        value=bool(project["settings"].get("auto_max_tokens", False)),
+        help="按模块类型和输入长度预估输出，自动留出余量，避免截断或过度预留。",
+    )
     max_tokens = st.slider(
         "最大长度（tokens）",
         min_value=256,
         max_value=32768,
         value=int(project["settings"]["max_tokens"]),
         step=256,
+        disabled=auto_max_tokens,
     )
     strict_no_add = st.toggle("严格不增内容", value=bool(project["settings"]["strict_no_add"]))
+    fallback = st.toggle(
+        "失败时自动切换服务",
+        value=bool(project["settings"].get("fallback", True)),
+        help="所选服务出错或近期错误率过高时，改用其他已配置密钥的服务（按近期 p95 延迟排序）。",
+    )
+    hedge = st.toggle(
+        "慢请求对冲",
+        value=bool(project["settings"].get("hedge", False)),
+        disabled=not fallback,
+        help="非流式请求超过主服务 p95 延迟仍未返回时，向备用服务再发一次，取先完成的结果（会多耗 tokens）。",
+    )
+    prefetch = st.toggle(
+        "预取下一模块",
+        value=bool(project["settings"].get("prefetch", False)),
+        help="某模块的结果几秒内没有改动时，在后台预先生成流程中的下一模块；点击运行时直接使用。上游改动后预取结果作废（未用上的预取按小时限量，会多耗 tokens）。",
+    )
 
     project["meta"]["lang"] = {"中文": "zh", "英文": "en", "双语": "bi"}[lang]
     project["meta"]["speakers"] = [s.strip() for s in speaker_rules.splitlines() if s.strip()]
@@ -116,170 +287,620 @@ with st.sidebar:
     project["settings"]["model_provider"] = provider_map[provider]
     project["settings"]["temperature"] = float(temperature)
     project["settings"]["max_tokens"] = int(max_tokens)
+    project["settings"]["auto_max_tokens"] = bool(auto_max_tokens)
     project["settings"]["strict_no_add"] = bool(strict_no_add)
+    project["settings"]["fallback"] = bool(fallback)
+    project["settings"]["hedge"] = bool(fallback and hedge)
+    project["settings"]["prefetch"] = bool(prefetch)
+
+    provider_health = get_registry().health()
+    health_lines = []
+    for name, snap in provider_health.items():
+        if not snap["samples"]:
+            continue
+        p50 = f"{snap['p50']:.1f}s" if snap["p50"] is not None else "—"
+        p95 = f"{snap['p95']:.1f}s" if snap["p95"] is not None else "—"
+        flag = "（冷却中）" if snap["cooling"] else ""
+        health_lines.append(
+            f"{get_registry().config(name).label}{flag}：p50 {p50} · p95 {p95} · 错误率 {snap['error_rate']:.0%}（{snap['samples']} 次）"
+        )
+    if health_lines:
+        st.caption("服务状态（近 10 分钟）\n\n" + "\n\n".join(health_lines))
 
     if uploaded is not None:
-        try:
-            raw_text, _ext = read_uploaded_file(uploaded.name, uploaded.getvalue())
-            project["input_raw"] = raw_text
+        # 同一个上传文件只解析一次；直接读上传流，不再 getvalue() 复制整份字节
+        if st.session_state.get("ingested_file_id") != uploaded.file_id:
+            try:
+                uploaded.seek(0)
+                ingested = ingest_stream(uploaded.name, uploaded)
+                project["input_raw"] = ingested.text
+                project["input_cues"] = cue_records(ingested.cues)
+                st.session_state["ingested_file_id"] = uploaded.file_id
+                st.session_state["ingest_stats"] = ingested
+            except Exception as e:
+                st.session_state.pop("ingest_stats", None)
+                st.error(f"读取文件失败：{e}")
+        ingest_stats = st.session_state.get("ingest_stats")
+        if ingest_stats is not None:
             st.success("已读取并写入逐字稿。")
-        except Exception as e:
-            st.error(f"读取文件失败：{e}")
+            st.caption(
+                f"{ingest_stats.bytes_read / 1024 / 1024:.1f} MB，用时 {ingest_stats.seconds:.2f}s"
+                f"（{ingest_stats.mb_per_s:.1f} MB/s）"
+                + (f"，编码 {ingest_stats.encoding}" if ingest_stats.encoding else "")
+                + (f"，保留 {len(ingest_stats.cues):,} 条字幕时间轴" if ingest_stats.cues else "")
+            )
+
+    st.subheader("一键生成")
+    dag_purposes = st.multiselect(
+        "发稿用途（可多选）",
+        options=list(PURPOSE_TABS),
+        default=[purpose],
+        key="dag_purposes_ui",
+        help="多个用途共用的模块只跑一次；互不依赖的模块（如 C 与 E）同时生成。",
+    )
+    dag_skip_done = st.checkbox("跳过已有结果的模块", value=True, key="dag_skip_done_ui")
+    if st.button("⚡ 并行生成全部模块", disabled=not (dag_purposes and project["input_raw"].strip())):
+        dag_targets = {m for p in dag_purposes for m, _ in PURPOSE_TABS[p]}
+        if dag_skip_done:
+            # 已过期（上游改过）的模块不算“已有结果”
+            dag_stale = {m for p in dag_purposes for m in stale_modules(project, p)}
+            dag_targets = {m for m in dag_targets if not has_current(project, m) or m in dag_stale}
+        if not dag_targets:
+            st.info("所选用途的模块都已有结果。")
+        else:
+            with st.status("正在按依赖并行生成…", expanded=True) as dag_status:
+
+                def _on_dag_done(module: str, outcome: dict) -> None:
+                    label = {"ok": "完成", "reused": "沿用已有结果", "failed": "失败", "skipped": "跳过"}[outcome["status"]]
+                    line = f"模块 {module}：{label}"
+                    if outcome.get("error"):
+                        line += f"（{outcome['error']}）"
+                    elif outcome.get("post_check_ok") is False:
+                        line += f"（后置校验：{outcome['post_check_msg']}）"
+                    if outcome["status"] == "ok" and _grounding_enabled(module):
+                        grounding = check_grounding(source_text(project), module, outcome["text"])
+                        if not grounding.ok:
+                            line += f"（原文核对：{grounding.summary()}）"
+                    dag_status.write(line)
+                    if outcome["status"] == "ok":
+                        st.session_state.pop(f"{module}_editor", None)
+
+                dag_outcomes = run_dag(
+                    project,
+                    dag_targets,
+                    purposes=dag_purposes,
+                    settings=dict(project["settings"]),
+                    on_done=_on_dag_done,
+                )
+                dag_failed = [m for m, o in dag_outcomes.items() if o["status"] in ("failed", "skipped")]
+                dag_status.update(
+                    label="部分模块生成失败" if dag_failed else "全部模块已生成",
+                    state="error" if dag_failed else "complete",
+                )
 
     st.subheader("项目状态")
     st.caption(f"逐字稿：{len(project['input_raw'])} 字")
     workflow_modules = [m for m, _ in current_tabs]
-    st.caption(" | ".join(f"{m} {'✓' if has_current(project, m) else '○'}" for m in workflow_modules))
+    _stale = set(stale_modules(project, purpose))
+    st.caption(
+        " | ".join(
+            f"{m} {'⚠' if m in _stale else '✓' if has_current(project, m) else '○'}" for m in workflow_modules
+        )
+    )
+    _running = [
+        j.snapshot()
+        for j in get_jobs().for_project(project["meta"].get("project_id") or "")
+        if j.active and not j.speculative
+    ]
+    if _running:
+        st.caption(
+            "后台任务："
+            + "，".join(f"{j['module']} {JOB_STATUS_LABEL.get(j['status'], j['status'])}" for j in _running)
+        )
+    if project["settings"].get("prefetch"):
+        _prefetch_watch()
+    else:
+        # 关闭预取后，尚未认领的预取任务立即作废
+        get_prefetcher().discard_stale(project, purpose)
+    if project["meta"].get("project_id"):
+        st.caption(f"项目已保存到本地（pid={project['meta']['project_id'][:8]}），历史版本按需加载")
+    else:
+        st.caption(f"历史版本占用：{history_chars(project) / 10000:.1f} 万字（增量存储）")
+    _cache_stats = get_response_cache().stats()
+    st.caption(
+        f"结果缓存：命中 {_cache_stats['hits']} / 未命中 {_cache_stats['misses']}"
+        f"（{_cache_stats['entries']} 条，{_cache_stats['bytes'] / 1024 / 1024:.1f} MB）"
+    )
+
+    with st.expander("📊 运行统计", expanded=False):
+        _metrics = get_metrics()
+        _snap = _metrics.snapshot()
+        if _snap["modules"]:
+            st.dataframe(
+                [
+                    {
+                        "模块": row["module"],
+                        "模型": row["model"],
+                        "次数": row["runs"],
+                        "平均用时(s)": row["avg_total_s"],
+                        "输入 tokens": row["tokens"]["prompt_tokens"],
+                        "输出 tokens": row["tokens"]["completion_tokens"],
+                        "前缀缓存命中率": f"{row['cache_hit_rate']:.0%}",
+                        "费用(¥)": row["cost"],
+                    }
+                    for row in _snap["modules"]
+                ],
+                hide_index=True,
+            )
+            _span_totals = {
+                k: sum(r["spans_s"][k] for r in _snap["modules"])
+                for k in ("queue_s", "network_s", "generation_s", "post_check_s")
+            }
+            st.caption(
+                f"排队 {_span_totals['queue_s']:.1f}s · 网络 {_span_totals['network_s']:.1f}s"
+                f" · 生成 {_span_totals['generation_s']:.1f}s · 后置校验 {_span_totals['post_check_s']:.2f}s"
+            )
+            _dl_cols = st.columns(2)
+            with _dl_cols[0]:
+                st.download_button(
+                    "JSON",
+                    data=json.dumps(_snap, ensure_ascii=False, indent=2),
+                    file_name="podcastsop_metrics.json",
+                    mime="application/json",
+                    key="metrics_json_dl",
+                )
+            with _dl_cols[1]:
+                st.download_button(
+                    "Prometheus",
+                    data=_metrics.prometheus(),
+                    file_name="podcastsop_metrics.prom",
+                    mime="text/plain",
+                    key="metrics_prom_dl",
+                )
+        else:
+            st.caption("本进程还没有运行过模块。")
+        _gov = _snap["governor"]
+        _limits = " · ".join(
+            label
+            for label, on in (
+                (f"{_gov['rpm']:g} 次/分", _gov["rpm"]),
+                (f"{_gov['tpm']:g} tokens/分", _gov["tpm"]),
+                (f"并发 {_gov['max_inflight']}", _gov["max_inflight"]),
+            )
+            if on
+        )
+        st.caption(
+            f"限流（{_limits or '不限'}）：排队 {_gov['queue_depth']}"
+            f"（交互 {_gov['queue_by_priority']['interactive']} / 批量 {_gov['queue_by_priority']['batch']}）"
+            f" · 在途 {_gov['inflight']} · 平均等待 {_gov['wait_avg_s']:.1f}s · p95 {_gov['wait_p95_s']:.1f}s"
+            f" · 合并相同请求 {_gov['coalesced']} 次"
+        )
+        _pf = get_prefetcher().stats()
+        if _pf["claimed"] or _pf["discarded"] or project["settings"].get("prefetch"):
+            st.caption(
+                f"预取：命中 {_pf['claimed']} 次 · 作废 {_pf['discarded']} 次"
+                f" · 近 1 小时浪费 {_pf['wasted_tokens']:,} / {_pf['max_waste']:,} tokens"
+            )
+        if METRICS_PORT:
+            st.caption(f"指标接口：http://127.0.0.1:{METRICS_PORT}/metrics（JSON：/metrics.json）")
+
+
+def _stream_preview(text: str) -> str:
+    return (
+        "<div class='ds-preview' style='height:560px; overflow-y:auto; white-space:pre-wrap;'>"
+        f"{escape(text)}▌</div>"
+    )
 
-tabs = st.tabs([f"{m} {name}" for m, name in current_tabs])
 
+def _show_flash(module: str) -> None:
+    for kind, msg in st.session_state.pop(f"{module}_flash", []):
+        getattr(st, kind)(msg)
+
+
+@st.fragment(run_every=1.0)
+def _job_panel(job_id: str) -> None:
+    """Polls a background run: progress, streamed partial output and a cancel button."""
+    job = get_jobs().get(job_id)
+    if job is None or not job.active:
+        # 任务结束：整页重跑，由 _apply_finished_jobs 写回结果并刷新下游状态
+        st.rerun()
+        return
+    snap = job.snapshot()
+    label = "正在取消…" if snap["cancel_requested"] else JOB_STATUS_LABEL.get(snap["status"], snap["status"])
+    cols = st.columns([4, 1])
+    with cols[0]:
+        if snap["progress"]:
+            done, total = snap["progress"]
+            st.progress(done / max(total, 1), text=f"{label} · 分块进度：{done}/{total} · {snap['elapsed_s']:.0f}s")
+        else:
+            st.caption(f"{label} · {snap['elapsed_s']:.0f}s · 可切换标签页或刷新页面，完成后自动写入")
+    with cols[1]:
+        if st.button("⏹ 取消", key=f"job_cancel_{job_id}", disabled=snap["cancel_requested"]):
+            get_jobs().cancel(job_id)
+    if snap["partial"]:
+        st.markdown(_stream_preview(snap["partial"]), unsafe_allow_html=True)
+
+
+# 校验命中列表最多逐条列出的条数，其余只在高亮视图里显示
+CHECK_LIST_LIMIT = 50
+DIFF_GRANULARITY = {"按行": "line", "按词": "word", "按字": "char"}
+# 差异视图分页渲染，避免超长文本一次性生成巨型 HTML
+DIFF_PAGE_OPS = 400
+
+
+@st.fragment
+def _diff_panel(module: str) -> None:
+    # 片段重跑不经过脚本顶部：会话闲置被释放后，用户在片段内的第一次操作在这里重新载入项目
+    _session_project()
+    # 只在打开时计算；结果按 (输入哈希, 输出哈希, 粒度) 缓存
+    if not st.toggle("📊 差异对比", value=False, key=f"{module}_diff_open"):
+        return
+    with st.container(border=True):
+        original = get_module_input(project, module, purpose)
+        output = project[module]["current"]
+        gran = st.radio(
+            "对比粒度",
+            options=["按行", "按词", "按字"],
+            horizontal=True,
+            key=f"{module}_diff_gran",
+            help="按词：中文逐字、英文按单词对比；按行时被修改的行内会再高亮具体改动的字。",
+        )
+        diff_result = cached_diff_opcodes(original, output, granularity=DIFF_GRANULARITY[gran])
+        n_pages = max(1, -(-len(diff_result.opcodes) // DIFF_PAGE_OPS))
+        diff_page = 1
+        if n_pages > 1:
+            diff_page = int(st.number_input("页码", min_value=1, max_value=n_pages, value=1, key=f"{module}_diff_page"))
+        st.caption(f"共 {diff_result.changes} 处改动" + (f"，第 {diff_page}/{n_pages} 页" if n_pages > 1 else ""))
+        st.components.v1.html(
+            render_diff_html(diff_result, start=(diff_page - 1) * DIFF_PAGE_OPS, limit=DIFF_PAGE_OPS),
+            height=300,
+            scrolling=True,
+        )
+
+
+def _metrics_caption(m: dict) -> str:
+    if m.get("requests", 0) == 0 and m.get("cache_hits"):
+        return f"生成：命中结果缓存 · 用时 {m['total_s']:.1f}s"
+    if m.get("requests", 0) == 0 and m.get("coalesced"):
+        return f"生成：与其他会话的相同请求合并，共用同一结果 · 用时 {m['total_s']:.1f}s"
+    cached = (
+        f"（前缀缓存命中 {m['cached_tokens']:,}，{m['cached_tokens'] / m['prompt_tokens']:.0%}）"
+        if m.get("cached_tokens") and m.get("prompt_tokens")
+        else ""
+    )
+    return (
+        f"生成：用时 {m['total_s']:.1f}s（网络 {m['network_s']:.1f}s · 生成 {m['generation_s']:.1f}s"
+        f" · 排队 {m['queue_s']:.1f}s · 校验 {m['post_check_s']:.2f}s）"
+        f" · 输入 {m['prompt_tokens']:,}{cached} / 输出 {m['completion_tokens']:,} tokens"
+        f" · ¥{m['cost']:.4f}" + (f" · {m['provider']}" if m.get("provider") else "")
+    )
+
+
+@st.fragment
+def _history_panel(module: str) -> None:
+    # 片段重跑不经过脚本顶部：会话闲置被释放后，用户在片段内的第一次操作在这里重新载入项目
+    _session_project()
+    history = project[module]["history"]
+    with st.expander("📜 历史版本", expanded=False):
+        if history:
+            options = [f"{h['version_id']}  ({h['time']})" for h in reversed(history)]
+            selected = st.selectbox("回滚到", options=options, key=f"{module}_rollback_select")
+            selected_item = next((h for h in history if h["version_id"] == selected.split()[0]), None)
+            if selected_item is not None and selected_item.get("metrics"):
+                st.caption(_metrics_caption(selected_item["metrics"]))
+            if st.button("回滚", key=f"{module}_rollback_btn"):
+                version_id = selected.split()[0]
+                if rollback_to_version(project, module, version_id) is not None:
+                    # 编辑器状态要一起重置，否则会把旧编辑内容写回 current
+                    st.session_state.pop(f"{module}_editor", None)
+                    _flash(module, "success", f"已回滚到 {version_id}")
+                    st.rerun()
+        else:
+            st.caption("暂无历史版本。")
+
+
+def _incremental_plan(settings: dict) -> tuple:
+    # 逐字稿、分段记录、设置都没变时复用上次的分段结果，不在每次交互时重新切分哈希
+    cached = st.session_state.get("incremental_plan")
+    fingerprint = tuple(settings.get(k) for k in ("model_provider", "model_name", "temperature", "max_tokens", "preclean"))
+    fingerprint += tuple(project["meta"].get("speakers", []))
+    if (
+        cached is not None
+        and cached[0] is project["input_raw"]
+        and cached[1] is project.get("a_segments")
+        and cached[2] == fingerprint
+    ):
+        return cached[3]
+    plan = plan_incremental(project, settings)
+    st.session_state["incremental_plan"] = (project["input_raw"], project.get("a_segments"), fingerprint, plan)
+    return plan
+
+
+@st.fragment
+def _module_tab(module: str) -> None:
+    """
+    One module tab. Runs as a fragment: typing or clicking inside the tab reruns only this function,
+    not the sidebar or the other tabs. Actions that change other modules trigger a full rerun.
+    """
+    # 片段重跑不经过脚本顶部：会话闲置被释放后，用户在片段内的第一次操作在这里重新载入项目
+    _session_project()
+    st.subheader(f"模块 {module}")
+    _show_flash(module)
+    if module == "A":
+        use_preclean = st.toggle(
+            "本地预清洗",
+            value=bool(project["settings"].get("preclean", False)),
+            key=f"{module}_preclean",
+            help="发送前在本地删除口头禅和口吃式重复、合并相邻重复行、按词典统一术语（AI、3D、B端等）和说话人标签，减少输入输出 tokens。词典见 core/preclean_rules.json。",
+        )
+        project["settings"]["preclean"] = bool(use_preclean)
+    module_input = get_module_input(project, module, purpose)
+    if module == "A" and project["settings"].get("preclean") and project["input_raw"].strip():
+        report = preclean(project["input_raw"], project["meta"].get("speakers"))
+        c = report.counts
+        st.caption(
+            f"预清洗：删去 {report.chars_saved:,} 字（约 {report.tokens_saved:,} tokens）"
+            f" · 口头禅 {c['fillers']} 处 · 重复 {c['stutters']} 处 · 重复行 {c['duplicate_lines']} 行"
+            f" · 术语 {c['terms']} 处 · 说话人标签 {c['speakers']} 处"
+        )
+
+    if module in CHUNKABLE_MODULES:
+        chunked = st.toggle(
+            "分块并行（长逐字稿）",
+            value=bool(project["settings"].get("chunked", False)),
+            key=f"{module}_chunked",
+            help="按说话人切分逐字稿，多块同时生成后按顺序合并，并去除重叠处的重复句。",
+        )
+        project["settings"]["chunked"] = bool(chunked)
+        incremental = st.toggle(
+            "增量处理（仅重跑改动段落）",
+            value=bool(project["settings"].get("incremental", False)),
+            key=f"{module}_incremental",
+            help="逐字稿按段落哈希记录每段的清洗结果；修改逐字稿后只重新发送有变化的段落并拼回全文。开启后按段并行生成。",
+        )
+        project["settings"]["incremental"] = bool(incremental)
+        if incremental and project.get("a_segments") and project["input_raw"].strip():
+            _segs, _hashes, _dirty = _incremental_plan(project["settings"])
+            if _dirty:
+                st.caption(f"逐字稿有改动：{len(_dirty)}/{len(_segs)} 段需要重新生成。")
+
+    if module_input.strip():
+        plan = plan_budget(module, module_input, project["settings"])
+        st.caption(
+            f"预计输入 {plan.prompt_tokens:,} tokens · 输出约 {plan.expected_output_tokens:,} tokens"
+            f" · max_tokens {plan.max_tokens:,}{'（自动）' if project['settings'].get('auto_max_tokens') else ''}"
+            + (f" · {plan.requests} 个请求" if plan.requests > 1 else "")
+            + f" · 约 {plan.seconds:.0f}s · 约 ¥{plan.cost:.3f}"
+            + (f"（命中前缀缓存重跑约 ¥{plan.rerun_cost:.3f}）" if plan.rerun_cost < plan.cost else "")
+        )
+        for warning in plan.warnings:
+            st.warning(warning)
+
+    last_run = project.get("run_metrics", {}).get(module)
+    if last_run:
+        st.caption(_metrics_caption(last_run))
+
+    if module in stale_modules(project, purpose):
+        st.warning("上游内容已变更，本模块结果可能已过期，建议重新运行。")
+
+    # 工具栏：运行、重新生成、保存、下一步
+    pending_run = None
+    active_job = get_jobs().active(project["meta"].get("project_id") or "", module)
+    btn_cols = st.columns([1, 1, 1, 2])
+    with btn_cols[0]:
+        can_run = bool(module_input.strip()) and active_job is None
+        if st.button("▶ 运行本模块", key=f"{module}_run", disabled=not can_run):
+            pending_run = True
+    with btn_cols[1]:
+        can_regen = bool(project[module]["current"].strip()) and can_run
+        if st.button("🔄 重新生成", key=f"{module}_regen", disabled=not can_regen):
+            save_version(project, module, project[module]["current"], settings_snapshot=dict(project["settings"]))
+            # 重新生成必须绕过结果缓存，否则会原样拿回同一份输出
+            pending_run = False
+    with btn_cols[2]:
+        if st.button("💾 保存为版本", key=f"{module}_save_version"):
+            edited = st.session_state.get(f"{module}_editor", project[module]["current"]) or project[module]["current"]
+            if (edited or "").strip():
+                save_version(project, module, edited, settings_snapshot=dict(project["settings"]))
+                st.success("已保存为新版本。")
+            else:
+                st.warning("内容为空，未保存。")
+    with btn_cols[3]:
+        can_next = bool(project[module]["current"].strip())
+        if st.button("下一步 →", key=f"{module}_next", disabled=not can_next):
+            st.success("已确认当前版本，可进入下一模块。")
+
+    # 输入和设置都没变时直接认领预取结果：已完成的立即写入，进行中的转为本模块的任务继续显示
+    if pending_run:
+        prefetched = get_prefetcher().claim(project, module, module_input)
+        if prefetched is not None:
+            if not prefetched.active:
+                _apply_job_result(prefetched)
+                _flash(module, "success", "已使用预取结果。")
+            st.rerun()
+    elif pending_run is False:
+        # 重新生成要的是一份新结果，同输入的预取一并作废
+        get_prefetcher().drop(project, module)
+    # 生成交给后台任务：脚本不阻塞，重跑、切换标签页、刷新页面都不会中断生成
+    if pending_run is not None:
+        try:
+            get_jobs().submit(project, module, module_input, use_cache=pending_run)
+            # 整页重跑：按钮置灰、侧边栏显示后台任务
+            st.rerun()
+        except ValueError as e:
+            st.warning(str(e))
+    # 进行中的任务在编辑区位置轮询显示，流式输出直接显示在编辑器所在处
+    if active_job is not None:
+        _job_panel(active_job.id)
+
+    # 大型主编辑器（通过 session_state 初始化，避免与 value 冲突）
+    if f"{module}_editor" not in st.session_state:
+        st.session_state[f"{module}_editor"] = project[module]["current"]
+    edited_content = st.text_area(
+        "主编辑区",
+        height=560,
+        key=f"{module}_editor",
+        label_visibility="collapsed",
+        placeholder="运行本模块后将在此显示生成结果，可直接编辑…",
+    )
+    # 同步编辑内容到 current（用于导出、保存为版本等）
+    project[module]["current"] = edited_content
+
+    if edited_content.strip():
+        report = check_text(edited_content, project["meta"].get("lang"))
+        if not report.ok:
+            with st.expander(f"🚩 校验命中 {len(report.hits)} 处", expanded=False):
+                for hit in report.hits[:CHECK_LIST_LIMIT]:
+                    line_no = edited_content.count("\n", 0, hit.start) + 1
+                    context = edited_content[max(0, hit.start - 20) : hit.end + 20].replace("\n", " ")
+                    st.caption(f"第 {line_no} 行 · {hit.rule.message}「{hit.text}」 … {context} …")
+                if len(report.hits) > CHECK_LIST_LIMIT:
+                    st.caption(f"另有 {len(report.hits) - CHECK_LIST_LIMIT} 处未列出，见下方高亮。")
+                st.components.v1.html(render_hits_html(edited_content, report.hits), height=300, scrolling=True)
+        if _grounding_enabled(module):
+            grounding = check_grounding(source_text(project), module, edited_content)
+            if not grounding.ok:
+                with st.expander(f"🔎 原文核对：{grounding.summary()}", expanded=False):
+                    for sent in grounding.unsupported[:CHECK_LIST_LIMIT]:
+                        st.caption(f"无依据（覆盖 {sent.coverage:.0%}）：{sent.text}")
+                    for quote in grounding.bad_quotes[:CHECK_LIST_LIMIT]:
+                        st.caption(f"非原话（覆盖 {quote.coverage:.0%}）：「{quote.text}」")
+
+    opt_col1, opt_col2 = st.columns(2)
+    with opt_col1:
+        _diff_panel(module)
+    with opt_col2:
+        _history_panel(module)
+    # 片段重跑不会走到脚本末尾，这里也写回一次
+    sync_project(project)
+
+
+tabs = st.tabs([f"{m} {name}" for m, name in current_tabs])
 for tab, (module, _) in zip(tabs, current_tabs, strict=True):
     with tab:
-        st.subheader(f"模块 {module}")
-        module_input = get_module_input(project, module, purpose)
-
-        # 工具栏：运行、重新生成、保存、下一步
-        btn_cols = st.columns([1, 1, 1, 2])
-        with btn_cols[0]:
-            can_run = bool(module_input.strip())
-            if st.button("▶ 运行本模块", key=f"{module}_run", disabled=not can_run):
-                with st.spinner("正在调用模型生成..."):
-                    try:
-                        result = run_module(
-                            module_name=module,
-                            input_text=module_input,
-                            settings=dict(project["settings"]),
-                        )
-                        project[module]["current"] = result["text"]
-                        if f"{module}_editor" in st.session_state:
-                            del st.session_state[f"{module}_editor"]
-                        if not result["post_check_ok"]:
-                            st.warning(f"后置校验提示：{result['post_check_msg']}")
-                    except Exception as e:
-                        st.error(f"生成失败：{e}")
-        with btn_cols[1]:
-            can_regen = bool(project[module]["current"].strip()) and can_run
-            if st.button("🔄 重新生成", key=f"{module}_regen", disabled=not can_regen):
-                save_version(project, module, project[module]["current"], settings_snapshot=dict(project["settings"]))
-                with st.spinner("正在重新生成..."):
-                    try:
-                        result = run_module(
-                            module_name=module,
-                            input_text=module_input,
-                            settings=dict(project["settings"]),
-                        )
-                        project[module]["current"] = result["text"]
-                        if f"{module}_editor" in st.session_state:
-                            del st.session_state[f"{module}_editor"]
-                        if not result["post_check_ok"]:
-                            st.warning(f"后置校验提示：{result['post_check_msg']}")
-                    except Exception as e:
-                        st.error(f"重新生成失败：{e}")
-        with btn_cols[2]:
-            if st.button("💾 保存为版本", key=f"{module}_save_version"):
-                edited = st.session_state.get(f"{module}_editor", project[module]["current"]) or project[module]["current"]
-                if (edited or "").strip():
-                    save_version(project, module, edited, settings_snapshot=dict(project["settings"]))
-                    st.success("已保存为新版本。")
-                else:
-                    st.warning("内容为空，未保存。")
-        with btn_cols[3]:
-            can_next = bool(project[module]["current"].strip())
-            if st.button("下一步 →", key=f"{module}_next", disabled=not can_next):
-                st.success("已确认当前版本，可进入下一模块。")
-
-        # 大型主编辑器（通过 session_state 初始化，避免与 value 冲突）
-        if f"{module}_editor" not in st.session_state:
-            st.session_state[f"{module}_editor"] = project[module]["current"]
-        edited_content = st.text_area(
-            "主编辑区",
-            height=560,
-            key=f"{module}_editor",
-            label_visibility="collapsed",
-            placeholder="运行本模块后将在此显示生成结果，可直接编辑…",
-        )
-        # 同步编辑内容到 current（用于导出、保存为版本等）
-        project[module]["current"] = edited_content
-
-        opt_col1, opt_col2 = st.columns(2)
-        with opt_col1:
-            with st.expander("📊 差异对比", expanded=False):
-                original = module_input
-                output = project[module]["current"]
-                gran = st.radio(
-                    "对比粒度",
-                    options=["按行", "按词"],
-                    horizontal=True,
-                    key=f"{module}_diff_gran",
-                )
-                st.components.v1.html(
-                    diff_html(original, output, granularity="word" if gran.startswith("按词") else "line"),
-                    height=300,
-                    scrolling=True,
-                )
-        with opt_col2:
-            history = project[module]["history"]
-            with st.expander("📜 历史版本", expanded=False):
-                if history:
-                    options = [f"{h['version_id']}  ({h['time']})" for h in reversed(history)]
-                    selected = st.selectbox("回滚到", options=options, key=f"{module}_rollback_select")
-                    if st.button("回滚", key=f"{module}_rollback_btn"):
-                        version_id = selected.split()[0]
-                        for h in reversed(history):
-                            if h["version_id"] == version_id:
-                                project[module]["current"] = h["text"]
-                                st.success(f"已回滚到 {version_id}")
-                                st.rerun()
-                                break
-                else:
-                    st.caption("暂无历史版本。")
+        _module_tab(module)
 
 st.divider()
 st.markdown("### 📤 导出")
 export_col1, export_col2, export_col3 = st.columns([1, 1, 2])
+purpose_to_module = {
+    "公众号深度访谈": "C",
+    "播客口播": "E",
+    "社媒素材": "D",
+    "清洗稿（模块A）": "A",
+}
+input_cues = project.get("input_cues") or []
 with export_col1:
-    export_purpose = st.selectbox("发稿用途（导出源）", ["公众号深度访谈", "播客口播", "社媒素材"], index=0)
+    export_purpose = st.selectbox("发稿用途（导出源）", list(purpose_to_module), index=0)
+    export_module = purpose_to_module[export_purpose]
 with export_col2:
-    export_format = st.selectbox("导出格式", ["markdown", "txt", "docx"], index=0)
+    # SRT：把模块A/E输出对齐回上传字幕的时间轴，只在上传了 srt/vtt 时可选
+    format_options = list(EXPORT_FORMATS)
+    if input_cues and export_module in SUBTITLE_MODULES:
+        format_options.append(SUBTITLE_FORMAT)
+    export_format = st.selectbox("导出格式", format_options, index=0)
 with export_col3:
-    purpose_to_module = {
-        "公众号深度访谈": "C",
-        "播客口播": "E",
-        "社媒素材": "D",
-    }
-    export_module = purpose_to_module[export_purpose]
     versions = project[export_module]["history"]
     version_options = ["current"] + [h["version_id"] for h in reversed(versions)]
     chosen_version = st.selectbox("选择版本", options=version_options, index=0)
-    if chosen_version == "current":
-        export_text = project[export_module]["current"].strip()
-    else:
-        export_text = ""
-        for h in reversed(versions):
-            if h["version_id"] == chosen_version:
-                export_text = (h["text"] or "").strip()
-                break
+    export_title = project["meta"].get("title") or None
 
     filename_base = project["meta"].get("title") or f"module-{export_module}"
-    filename_base = filename_base.strip() or f"module-{export_module}"
+    filename_base = safe_filename(filename_base.strip(), default=f"module-{export_module}")
+    download_label = f"下载 {EXPORT_EXT[export_format].upper()}（模块 {export_module} / {chosen_version}）"
 
-    if export_format == "docx":
-        try:
-            docx_bytes = export_docx_bytes(text=export_text, title=project["meta"].get("title") or None)
+    if chosen_version == "current" and export_format in ("markdown", "txt"):
+        export_text = project[export_module]["current"].strip()
+        st.download_button(
+            download_label,
+            data=export_text,
+            file_name=f"{filename_base}.{EXPORT_EXT[export_format]}",
+            disabled=not bool(export_text),
+        )
+    else:
+        # docx / srt / 历史版本：点击后才生成（按内容哈希记忆），无关的交互不再重复构建
+        export_key = (export_module, chosen_version, export_format, export_title)
+        source = project[export_module]["current"] if chosen_version == "current" else None
+        prepared = st.session_state.get("export_prepared")
+        fresh = prepared is not None and prepared["key"] == export_key and prepared["source"] == source
+        if not fresh and st.button(
+            "生成导出文件",
+            key="export_prepare_btn",
+            disabled=chosen_version == "current" and not project[export_module]["current"].strip(),
+        ):
+            if chosen_version == "current":
+                export_text = project[export_module]["current"].strip()
+            else:
+                export_text = (version_text(project, export_module, chosen_version) or "").strip()
+            try:
+                prepared = {
+                    "key": export_key,
+                    "source": source,
+                    "data": export_bytes(
+                        text=export_text,
+                        fmt=export_format,
+                        title=export_title,
+                        cues=cues_from_records(input_cues) if export_format == SUBTITLE_FORMAT else None,
+                    ),
+                    "empty": not export_text,
+                }
+                st.session_state["export_prepared"] = prepared
+                fresh = True
+            except Exception as e:
+                st.error(f"{export_format.upper()} 导出不可用：{e}")
+        if fresh:
             st.download_button(
-                f"下载 DOCX（模块 {export_module} / {chosen_version}）",
-                data=docx_bytes,
-                file_name=f"{filename_base}.docx",
-                mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-                disabled=not bool(export_text),
+                download_label,
+                data=prepared["data"],
+                file_name=f"{filename_base}.{EXPORT_EXT[export_format]}",
+                mime=EXPORT_MIME[export_format],
+                disabled=prepared["empty"],
             )
+
+with st.expander("📦 打包导出全部模块与历史版本（ZIP）", expanded=False):
+    zip_options = list(EXPORT_FORMATS) + ([SUBTITLE_FORMAT] if input_cues else [])
+    zip_formats = st.multiselect(
+        "包含格式",
+        options=zip_options,
+        default=list(EXPORT_FORMATS),
+        key="zip_formats_ui",
+        help="srt 仅对模块A/E生成，按上传字幕的时间轴对齐。",
+    )
+    if st.button("打包", key="zip_build_btn", disabled=not zip_formats):
+        try:
+            with st.spinner("正在打包…"):
+                started = time.monotonic()
+                archive_path = export_project_archive(project, formats=zip_formats)
+                previous = st.session_state.get("export_zip")
+                if previous is not None:
+                    Path(previous["path"]).unlink(missing_ok=True)
+                # 会话里只记路径：ZIP 留在磁盘上，点下载时才读出来
+                st.session_state["export_zip"] = {
+                    "path": str(archive_path),
+                    "size": archive_path.stat().st_size,
+                    "built": time.strftime("%H:%M:%S"),
+                    "seconds": time.monotonic() - started,
+                }
         except Exception as e:
-            st.error(f"DOCX 导出不可用：{e}")
-    else:
-        ext = "md" if export_format == "markdown" else "txt"
+            st.error(f"打包失败：{e}")
+    export_zip = st.session_state.get("export_zip")
+    if export_zip is not None and not Path(export_zip["path"]).exists():
+        # 超过保留期已被清理
+        st.session_state.pop("export_zip", None)
+        st.caption("之前的打包已过期，请重新打包")
+        export_zip = None
+    if export_zip is not None:
+        st.caption(
+            f"打包于 {export_zip['built']}，用时 {export_zip['seconds']:.1f}s，"
+            f"{export_zip['size'] / 1024 / 1024:.1f} MB（之后的修改需重新打包）"
+        )
         st.download_button(
-            f"下载（模块 {export_module} / {chosen_version}）",
-            data=export_text,
-            file_name=f"{filename_base}.{ext}",
-            disabled=not bool(export_text),
+            "下载 ZIP",
+            data=lambda path=export_zip["path"]: Path(path).read_bytes(),
+            file_name=f"{safe_filename((project['meta'].get('title') or '').strip(), default='project')}.zip",
+            mime="application/zip",
+            key="zip_download_btn",
         )
+
+# 本轮交互结束：把有变化的字段（标题、设置、逐字稿、各模块当前稿）写回数据库
+sync_project(project)
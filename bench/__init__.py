@@ -0,0 +1,8 @@
+"""
+Offline benchmarks: synthetic transcripts, a local mock chat-completions server and timing runs
+for ingestion, diff, export, subtitle alignment, version history and end-to-end module workflows.
+
+    python -m bench --out bench/results
+    python -m bench --quick --only ingest,diff
+    python -m bench --compare bench/results/old.json bench/results/new.json
+"""
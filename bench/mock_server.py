@@ -0,0 +1,232 @@
+"""
+Local OpenAI-compatible chat-completions server for benchmarks (any POST path is accepted).
+
+    python -m bench.mock_server --port 8765 --latency 0.5 --tokens-per-s 200 --error-rate 0.05
+
+Point the app at it with DEEPSEEK_BASE_URL=http://127.0.0.1:8765 DEEPSEEK_API_KEY=x.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+from core.tokens import estimate_tokens
+
+_FILLER_RE = re.compile(r"(?:嗯|呃|那个|就是说|对对对|然后)，")
+_HEADING_RE = re.compile(r"【(模块[A-E])")
+# 每个流式事件携带的字符数
+_STREAM_CHARS = 16
+
+
+def fake_completion(messages: Any, max_tokens: int) -> str:
+    """
+    Deterministic stand-in for a module output: the module heading plus the transcript part of the
+    prompt with fillers removed, capped at ~max_tokens (one CJK char ≈ one token).
+    """
+    content = ""
+    for msg in messages or []:
+        if msg.get("role") == "user":
+            content = str(msg.get("content", ""))
+    m = _HEADING_RE.search(content)
+    heading = f"《{m.group(1)} 输出》\n" if m else ""
+    if "<<<输入开始>>>\n" in content:
+        # 输入在前、指令在后的布局
+        body = content.split("<<<输入开始>>>\n", 1)[1].split("\n<<<输入结束>>>", 1)[0]
+    else:
+        # 旧模板以“……如下：”结尾，之后是输入正文
+        body = content.rsplit("如下：\n", 1)[-1]
+    return (heading + _FILLER_RE.sub("", body))[: max(1, int(max_tokens))]
+
+
+def _prompt_text(messages: Any) -> str:
+    return "\n".join(str(m.get("content", "")) for m in messages or [])
+
+
+class PrefixCache:
+    """
+    Simulated provider-side prefix cache: the cached part of a prompt is its longest common prefix
+    with a recent prompt, counted in whole blocks of `block_tokens` (as DeepSeek does).
+    """
+
+    def __init__(self, *, block_tokens: int = 64, capacity: int = 256) -> None:
+        self.block_tokens = block_tokens
+        self._recent: "deque[str]" = deque(maxlen=capacity)
+        self._lock = threading.Lock()
+
+    def lookup(self, prompt: str) -> int:
+        with self._lock:
+            recent = list(self._recent)
+            self._recent.append(prompt)
+        best = max((len(os.path.commonprefix([prompt, p])) for p in recent), default=0)
+        tokens = estimate_tokens(prompt[:best]) if best else 0
+        return tokens // self.block_tokens * self.block_tokens
+
+
+def fake_usage(messages: Any, text: str, cached_tokens: int = 0) -> Dict[str, int]:
+    prompt = estimate_tokens(_prompt_text(messages))
+    completion = estimate_tokens(text)
+    return {
+        "prompt_tokens": prompt,
+        "completion_tokens": completion,
+        "total_tokens": prompt + completion,
+        "prompt_cache_hit_tokens": min(prompt, cached_tokens),
+        "prompt_cache_miss_tokens": max(0, prompt - cached_tokens),
+    }
+
+
+class MockLLMServer:
+    """
+    Threaded mock server. latency_s: delay before the response starts; tokens_per_s > 0 paces
+    streamed output (0 = send at once); error_rate: share of requests answered with error_status.
+    Use as a context manager or call start()/stop().
+    """
+
+    def __init__(
+        self,
+        *,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency_s: float = 0.0,
+        tokens_per_s: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: int = 0,
+    ) -> None:
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self.prefix_cache = PrefixCache()
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockLLMServer":
+        return self.start()
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            fail = self.error_rate > 0 and self._rng.random() < self.error_rate
+            if fail:
+                self.errors += 1
+            return fail
+
+    def _handler(self) -> type:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                req = json.loads(self.rfile.read(length) or b"{}")
+                if server.latency_s:
+                    time.sleep(server.latency_s)
+                if server._should_fail():
+                    self._send_json(server.error_status, {"error": {"message": "injected error"}})
+                    return
+                text = fake_completion(req.get("messages"), int(req.get("max_tokens") or 4096))
+                usage = fake_usage(
+                    req.get("messages"), text, server.prefix_cache.lookup(_prompt_text(req.get("messages")))
+                )
+                if not req.get("stream"):
+                    if server.tokens_per_s > 0:
+                        time.sleep(len(text) / server.tokens_per_s)
+                    self._send_json(
+                        200,
+                        {
+                            "choices": [{"message": {"role": "assistant", "content": text}}],
+                            "usage": usage,
+                        },
+                    )
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for i in range(0, len(text), _STREAM_CHARS):
+                    piece = text[i : i + _STREAM_CHARS]
+                    if server.tokens_per_s > 0:
+                        time.sleep(len(piece) / server.tokens_per_s)
+                    event = {"choices": [{"delta": {"content": piece}}]}
+                    self.wfile.write(f"data: {json.dumps(event, ensure_ascii=False)}\n\n".encode("utf-8"))
+                if (req.get("stream_options") or {}).get("include_usage"):
+                    event = {"choices": [], "usage": usage}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def main(argv: Optional[list] = None) -> int:
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible chat-completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response starts")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="output pacing (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args(argv)
+    server = MockLLMServer(
+        host=args.host,
+        port=args.port,
+        latency_s=args.latency,
+        tokens_per_s=args.tokens_per_s,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    print(f"mock LLM server on {server.url}", flush=True)
+    try:
+        server.start()
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
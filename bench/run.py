@@ -0,0 +1,316 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bench.mock_server import MockLLMServer
+from bench.synth import edit_text, synth_turns, to_txt, transcript_bytes
+from core.metrics import get_metrics
+
+BENCHES = ("ingest", "diff", "export", "align", "versions", "workflow")
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+QUICK_SIZES = (10_000, 100_000)
+# 逐词/逐字差异在超长文本上按 O(ND) 增长，只跑到该规模
+_FINE_DIFF_MAX_CHARS = 200_000
+# 与界面一致：差异只渲染一页
+_DIFF_PAGE_OPS = 400
+_VERSIONS_PER_RUN = 20
+# 端到端流程只在不超过该规模的逐字稿上跑（模型输出按 max_tokens 截断，超长输入没有意义）
+_WORKFLOW_MAX_CHARS = 100_000
+
+Result = Dict[str, Any]
+
+
+def _label(chars: int) -> str:
+    return f"{chars // 1_000_000}M" if chars >= 1_000_000 else f"{chars // 1000}k"
+
+
+def measure(fn: Callable[[], Any], *, repeat: int, setup: Optional[Callable[[], None]] = None) -> Dict[str, float]:
+    """Wall time of `fn` over `repeat` runs (setup, if given, runs untimed before each)."""
+    times: List[float] = []
+    for _ in range(max(1, repeat)):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {
+        "min_s": round(min(times), 6),
+        "median_s": round(statistics.median(times), 6),
+        "mean_s": round(statistics.fmean(times), 6),
+        "repeat": len(times),
+    }
+
+
+def _result(bench: str, case: str, params: Dict[str, Any], timing: Dict[str, float], **extra: Any) -> Result:
+    return {"bench": bench, "case": case, "params": params, **timing, **extra}
+
+
+def bench_ingest(sizes: Tuple[int, ...], repeat: int) -> List[Result]:
+    from core.file_io import read_uploaded_file
+
+    out: List[Result] = []
+    for chars in sizes:
+        for fmt in ("txt", "srt", "docx"):
+            data = transcript_bytes(chars, fmt)  # type: ignore[arg-type]
+            timing = measure(lambda: read_uploaded_file(f"bench.{fmt}", data), repeat=repeat)
+            out.append(
+                _result(
+                    "ingest",
+                    f"{fmt}-{_label(chars)}",
+                    {"chars": chars, "format": fmt, "bytes": len(data)},
+                    timing,
+                    mb_per_s=round(len(data) / 1024 / 1024 / timing["median_s"], 2),
+                )
+            )
+    return out
+
+
+def bench_diff(sizes: Tuple[int, ...], repeat: int) -> List[Result]:
+    from core.diff_utils import diff_html
+
+    out: List[Result] = []
+    for chars in sizes:
+        a = to_txt(synth_turns(chars))
+        b = edit_text(a)
+        for granularity in ("line", "word", "char"):
+            if granularity != "line" and chars > _FINE_DIFF_MAX_CHARS:
+                continue
+            timing = measure(lambda: diff_html(a, b, granularity=granularity, max_ops=_DIFF_PAGE_OPS), repeat=repeat)
+            out.append(
+                _result("diff", f"{granularity}-{_label(chars)}", {"chars": chars, "granularity": granularity}, timing)
+            )
+    return out
+
+
+def bench_export(sizes: Tuple[int, ...], repeat: int) -> List[Result]:
+    from core.export_utils import export_docx_bytes
+
+    out: List[Result] = []
+    for chars in sizes:
+        text = to_txt(synth_turns(chars))
+        timing = measure(lambda: export_docx_bytes(text=text, title="bench"), repeat=repeat)
+        out.append(_result("export", f"docx-{_label(chars)}", {"chars": chars}, timing))
+    return out
+
+
+def bench_align(sizes: Tuple[int, ...], repeat: int) -> List[Result]:
+    """Aligning a lightly edited transcript back onto its SRT timeline (~40 characters per cue)."""
+    from core.file_io import ingest_stream
+    from core.subtitles import align_to_cues
+
+    out: List[Result] = []
+    for chars in sizes:
+        ingested = ingest_stream("bench.srt", io.BytesIO(transcript_bytes(chars, "srt")))
+        edited = edit_text(ingested.text)
+        timing = measure(lambda: align_to_cues(ingested.cues, edited), repeat=repeat)
+        out.append(_result("align", f"srt-{_label(chars)}", {"chars": chars, "cues": len(ingested.cues)}, timing))
+    return out
+
+
+def bench_versions(sizes: Tuple[int, ...], repeat: int) -> List[Result]:
+    """save_version of lightly edited revisions, in memory and persisted to a throwaway SQLite DB."""
+    from core.project_state import create_empty_project, save_version
+
+    out: List[Result] = []
+    for chars in sizes:
+        revisions = [to_txt(synth_turns(chars))]
+        for i in range(1, _VERSIONS_PER_RUN):
+            revisions.append(edit_text(revisions[-1], ratio=0.01, seed=i))
+        for persist in (False, True):
+
+            def _run() -> None:
+                project = create_empty_project(persist=persist)
+                for text in revisions:
+                    save_version(project, "A", text, {})
+
+            timing = measure(_run, repeat=repeat)
+            out.append(
+                _result(
+                    "versions",
+                    f"{'sqlite' if persist else 'memory'}-{_label(chars)}",
+                    {"chars": chars, "versions": len(revisions), "persist": persist},
+                    timing,
+                    per_version_ms=round(timing["median_s"] / len(revisions) * 1000, 3),
+                )
+            )
+    return out
+
+
+def bench_workflow(sizes: Tuple[int, ...], repeat: int, server: MockLLMServer) -> List[Result]:
+    """
+    End-to-end module runs against the mock server: the 播客口播 DAG (A → B → E) cold and from the
+    response cache, streaming module A, and chunked module A.
+    """
+    from core.cache import get_response_cache
+    from core.project_state import create_empty_project
+    from core.run_module import run_module, run_module_stream
+    from core.scheduler import run_dag
+
+    cache = get_response_cache()
+    base = {
+        "model_provider": "deepseek",
+        "model_name": "deepseek-chat",
+        "temperature": 0.2,
+        "max_tokens": 8192,
+        "auto_max_tokens": True,
+        "fallback": False,
+        "chunk_tokens": 6000,
+        "chunk_workers": 4,
+    }
+    out: List[Result] = []
+    for chars in (c for c in sizes if c <= _WORKFLOW_MAX_CHARS):
+        text = to_txt(synth_turns(chars))
+        params = {"chars": chars, "latency_s": server.latency_s, "tokens_per_s": server.tokens_per_s}
+
+        def _dag() -> None:
+            project = create_empty_project()
+            project["input_raw"] = text
+            outcomes = run_dag(project, ["A", "B", "E"], purposes=["播客口播"], settings=base)
+            failed = [m for m, o in outcomes.items() if o["status"] != "ok"]
+            if failed:
+                raise RuntimeError(f"workflow failed: {failed}")
+
+        cold = measure(_dag, repeat=repeat, setup=cache.clear)
+        out.append(_result("workflow", f"dag-cold-{_label(chars)}", params, cold))
+        out.append(_result("workflow", f"dag-cached-{_label(chars)}", params, measure(_dag, repeat=repeat)))
+
+        def _stream() -> None:
+            for _ in run_module_stream(module_name="A", input_text=text, settings=base, use_cache=False):
+                pass
+
+        out.append(_result("workflow", f"stream-A-{_label(chars)}", params, measure(_stream, repeat=repeat)))
+
+        chunked = {**base, "chunked": True}
+        timing = measure(
+            lambda: run_module(module_name="A", input_text=text, settings=chunked, use_cache=False), repeat=repeat
+        )
+        out.append(_result("workflow", f"chunked-A-{_label(chars)}", params, timing))
+    return out
+
+
+_SIMPLE_BENCHES: Dict[str, Callable[[Tuple[int, ...], int], List[Result]]] = {
+    "ingest": bench_ingest,
+    "diff": bench_diff,
+    "export": bench_export,
+    "align": bench_align,
+    "versions": bench_versions,
+}
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True, timeout=10
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run(
+    benches: Tuple[str, ...],
+    sizes: Tuple[int, ...],
+    repeat: int,
+    *,
+    latency_s: float = 0.05,
+    tokens_per_s: float = 0.0,
+) -> Dict[str, Any]:
+    # 持久化、响应缓存、模型服务都指向临时目录和本地 mock，不碰真实数据
+    workdir = tempfile.mkdtemp(prefix="podcastsop-bench-")
+    server = MockLLMServer(latency_s=latency_s, tokens_per_s=tokens_per_s).start()
+    os.environ.update(
+        {
+            "PODCASTSOP_DB": str(Path(workdir) / "projects.sqlite3"),
+            "PODCASTSOP_CACHE_DIR": str(Path(workdir) / "cache"),
+            "DEEPSEEK_BASE_URL": server.url,
+            "DEEPSEEK_API_KEY": "bench",
+            "LLM_MAX_RETRIES": "0",
+        }
+    )
+    started = time.time()
+    results: List[Result] = []
+    try:
+        for name in benches:
+            print(f"[bench] {name} …", file=sys.stderr, flush=True)
+            if name == "workflow":
+                results += bench_workflow(sizes, repeat, server)
+            else:
+                results += _SIMPLE_BENCHES[name](sizes, repeat)
+    finally:
+        server.stop()
+    return {
+        "meta": {
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started)),
+            "seconds": round(time.time() - started, 2),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": list(sizes),
+            "repeat": repeat,
+            "mock_server": {"latency_s": latency_s, "tokens_per_s": tokens_per_s, "requests": server.requests},
+        },
+        # 端到端流程的分阶段耗时与 tokens（core.metrics 的进程内汇总）
+        "module_metrics": get_metrics().snapshot()["modules"],
+        "results": results,
+    }
+
+
+def compare(old_path: Path, new_path: Path) -> List[Tuple[str, float, float, float]]:
+    """(bench/case, old median, new median, new/old) for every case present in both runs."""
+    old = {(r["bench"], r["case"]): r for r in json.loads(old_path.read_text(encoding="utf-8"))["results"]}
+    rows = []
+    for r in json.loads(new_path.read_text(encoding="utf-8"))["results"]:
+        prev = old.get((r["bench"], r["case"]))
+        if prev is None:
+            continue
+        ratio = r["median_s"] / prev["median_s"] if prev["median_s"] else float("inf")
+        rows.append((f"{r['bench']}/{r['case']}", prev["median_s"], r["median_s"], ratio))
+    return rows
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="PodcastSOP benchmarks")
+    parser.add_argument("--out", type=Path, default=Path("bench/results"), help="directory for the JSON result")
+    parser.add_argument("--only", default=",".join(BENCHES), help=f"comma-separated subset of {','.join(BENCHES)}")
+    parser.add_argument("--sizes", default=None, help="comma-separated transcript sizes in characters")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--quick", action="store_true", help="small sizes, one repetition")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock server latency (s)")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="mock server output pacing (0 = instant)")
+    parser.add_argument("--compare", nargs=2, type=Path, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        for case, old_s, new_s, ratio in compare(*args.compare):
+            flag = "  ← slower" if ratio > 1.1 else ("  ← faster" if ratio < 0.9 else "")
+            print(f"{case:32s} {old_s:10.4f}s → {new_s:10.4f}s  ×{ratio:.2f}{flag}")
+        return 0
+
+    benches = tuple(b.strip() for b in args.only.split(",") if b.strip())
+    unknown = [b for b in benches if b not in BENCHES]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    if args.sizes:
+        sizes = tuple(int(s) for s in args.sizes.split(","))
+    else:
+        sizes = QUICK_SIZES if args.quick else DEFAULT_SIZES
+    repeat = 1 if args.quick else args.repeat
+
+    report = run(benches, sizes, repeat, latency_s=args.latency, tokens_per_s=args.tokens_per_s)
+    args.out.mkdir(parents=True, exist_ok=True)
+    path = args.out / f"bench-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    path.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    for r in report["results"]:
+        print(f"{r['bench'] + '/' + r['case']:32s} median {r['median_s']:.4f}s")
+    print(f"[bench] wrote {path}", file=sys.stderr)
+    return 0
@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import io
+import random
+from typing import List, Literal, Tuple
+
+TranscriptFormat = Literal["txt", "srt", "docx"]
+Turn = Tuple[str, str]
+
+SPEAKERS = ("主持人", "嘉宾")
+
+# 访谈常见句式；固定种子下生成结果可复现
+_ZH_SENTENCES = (
+    "我们今天聊一聊创业早期怎么找到第一批用户",
+    "其实一开始我们并没有想清楚商业模式",
+    "这个阶段最重要的是把产品做到足够好用",
+    "团队里每个人都要对结果负责",
+    "融资环境这两年变化非常大",
+    "我觉得做内容和做产品的逻辑其实是相通的",
+    "用户反馈会告诉你哪些功能是真正被需要的",
+    "很多决定在当时看来都是不得已的选择",
+    "回头看那段时间压力确实很大",
+    "我们花了大概半年时间重新梳理了定价",
+    "B端客户和C端用户的需求完全不一样",
+    "AI 工具让小团队也能做以前做不了的事情",
+)
+_EN_SENTENCES = (
+    "product-market fit is not a single moment",
+    "we shipped the first version in about three weeks",
+    "retention matters more than acquisition at this stage",
+    "the 3D pipeline was rebuilt twice",
+)
+_FILLERS = ("嗯，", "那个，", "就是说，", "呃，", "对对对，", "然后，")
+_QUESTIONS = ("你怎么看这个问题？", "当时为什么这么决定？", "能具体讲讲吗？", "后来呢？")
+
+_CUE_CHARS = 40
+_CUE_SECONDS = 3.0
+
+
+def synth_turns(chars: int, *, seed: int = 0, english_ratio: float = 0.15) -> List[Turn]:
+    """Speaker-tagged turns of roughly `chars` characters: CJK with English phrases, fillers and repeats."""
+    rng = random.Random(seed)
+    turns: List[Turn] = []
+    total = 0
+    i = 0
+    while total < chars:
+        speaker = SPEAKERS[i % 2]
+        parts: List[str] = []
+        n = 1 if speaker == "主持人" else rng.randint(2, 6)
+        for _ in range(n):
+            if rng.random() < 0.3:
+                parts.append(rng.choice(_FILLERS))
+            pool = _EN_SENTENCES if rng.random() < english_ratio else _ZH_SENTENCES
+            sentence = rng.choice(pool)
+            # 口语里的重复表达
+            if rng.random() < 0.1:
+                sentence = sentence[:4] + "，" + sentence
+            parts.append(sentence + rng.choice(("。", "，", "。", "！")))
+        if speaker == "主持人":
+            parts.append(rng.choice(_QUESTIONS))
+        text = "".join(parts)
+        turns.append((speaker, text))
+        total += len(speaker) + 1 + len(text) + 1
+        i += 1
+    return turns
+
+
+def to_txt(turns: List[Turn]) -> str:
+    return "\n".join(f"{speaker}：{text}" for speaker, text in turns)
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(seconds * 1000))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def to_srt(turns: List[Turn]) -> str:
+    """One cue per ~40 characters; the speaker tag starts each turn's first cue."""
+    blocks: List[str] = []
+    t = 0.0
+    for speaker, text in turns:
+        line = f"{speaker}：{text}"
+        for start in range(0, len(line), _CUE_CHARS):
+            blocks.append(
+                f"{len(blocks) + 1}\n{_srt_time(t)} --> {_srt_time(t + _CUE_SECONDS)}\n{line[start : start + _CUE_CHARS]}\n"
+            )
+            t += _CUE_SECONDS
+    return "\n".join(blocks)
+
+
+def to_docx(turns: List[Turn]) -> bytes:
+    try:
+        from docx import Document  # type: ignore
+    except Exception as e:
+        raise RuntimeError("Missing dependency python-docx. Please install: pip install python-docx") from e
+    doc = Document()
+    for speaker, text in turns:
+        doc.add_paragraph(f"{speaker}：{text}")
+    bio = io.BytesIO()
+    doc.save(bio)
+    return bio.getvalue()
+
+
+def transcript_bytes(chars: int, fmt: TranscriptFormat, *, seed: int = 0) -> bytes:
+    turns = synth_turns(chars, seed=seed)
+    if fmt == "txt":
+        return to_txt(turns).encode("utf-8")
+    if fmt == "srt":
+        return to_srt(turns).encode("utf-8")
+    if fmt == "docx":
+        return to_docx(turns)
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def edit_text(text: str, *, ratio: float = 0.02, seed: int = 0) -> str:
+    """A lightly edited copy (some lines dropped, changed or added), like one round of manual review."""
+    rng = random.Random(seed)
+    out: List[str] = []
+    for line in text.split("\n"):
+        r = rng.random()
+        if r < ratio / 3:
+            continue
+        if r < ratio * 2 / 3:
+            line = line.replace("，", "。", 1) + "（已修改）"
+        out.append(line)
+        if r > 1 - ratio / 3:
+            out.append("嘉宾：补充一句。")
+    return "\n".join(out)
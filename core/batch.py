@@ -0,0 +1,232 @@
+"""
+Headless batch runner: run a whole purpose workflow (WORKFLOW_PREV) over a directory of transcripts.
+
+    python -m core.batch ./transcripts --purpose 播客口播 --purpose 公众号深度访谈 --out ./out --concurrency 8
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from core.export_utils import SUBTITLE_FORMAT, export_bytes, export_docx_bytes
+from core.file_io import SUPPORTED_EXTS, ingest_stream
+from core.llm_client import set_max_inflight
+from core.metrics import get_metrics
+from core.preclean import preclean
+from core.project_state import WORKFLOW_PREV, Project, create_empty_project, save_version
+from core.scheduler import run_dag
+from core.subtitles import SUBTITLE_MODULES, cue_records
+
+
+_print_lock = threading.Lock()
+
+
+def _log(msg: str) -> None:
+    with _print_lock:
+        print(msg, file=sys.stderr, flush=True)
+
+
+def workflow_modules(purpose: str) -> List[str]:
+    # WORKFLOW_PREV 的插入顺序即依赖顺序（A -> B -> ...）
+    if purpose not in WORKFLOW_PREV:
+        raise ValueError(f"Unknown purpose: {purpose}")
+    return list(WORKFLOW_PREV[purpose])
+
+
+def process_transcript(
+    path: Path,
+    *,
+    purposes: List[str],
+    settings: Dict[str, Any],
+    out_dir: Path,
+    max_workers: int = 4,
+) -> Dict[str, Any]:
+    """
+    Run the union of the purpose chains for one transcript and write every module output to out_dir/<file name>/.
+    Independent branches (e.g. C and E after B) run concurrently; a failing module only stops its descendants.
+    Returns a summary dict.
+    """
+    started = time.monotonic()
+    summary: Dict[str, Any] = {"file": str(path), "purposes": purposes, "modules": {}, "ok": False}
+    project: Project = create_empty_project()
+    project["meta"]["title"] = path.stem
+    project["meta"]["purpose"] = purposes[0]
+    project["settings"].update(settings)
+
+    try:
+        with path.open("rb") as f:
+            ingested = ingest_stream(path.name, f)
+        project["input_raw"] = ingested.text
+        project["input_cues"] = cue_records(ingested.cues)
+        summary["ingest"] = {"encoding": ingested.encoding, "bytes": ingested.bytes_read, "seconds": round(ingested.seconds, 3)}
+    except Exception as e:
+        summary["error"] = f"read failed: {e}"
+        return summary
+
+    if project["settings"].get("preclean"):
+        summary["preclean"] = preclean(project["input_raw"], project["meta"].get("speakers")).to_dict()
+
+    # 目录名带扩展名：同名的 ep1.txt 与 ep1.srt 不会互相覆盖
+    target_dir = out_dir / path.name
+    target_dir.mkdir(parents=True, exist_ok=True)
+
+    def _write_srt(target: Path, module: str, text: str) -> None:
+        # 字幕上传时，模块A/E输出按原时间轴对齐另存一份 .srt
+        if ingested.cues and module in SUBTITLE_MODULES:
+            target.write_bytes(export_bytes(text=text, fmt=SUBTITLE_FORMAT, cues=ingested.cues))
+
+    def _on_done(module: str, outcome: Dict[str, Any]) -> None:
+        if outcome["status"] == "ok":
+            save_version(project, module, outcome["text"], settings_snapshot=dict(project["settings"]))
+            (target_dir / f"{module}.md").write_text(outcome["text"], encoding="utf-8")
+            _write_srt(target_dir / f"{module}.srt", module, outcome["text"])
+            _log(f"[batch] {path.name}: module {module} done ({outcome['seconds']}s)")
+        else:
+            _log(f"[batch] {path.name}: module {module} {outcome['status']}: {outcome.get('error', '')}")
+        summary["modules"][module] = {k: v for k, v in outcome.items() if k != "text"}
+
+    targets = {m for p in purposes for m in workflow_modules(p)}
+    outcomes = run_dag(
+        project,
+        targets,
+        purposes=purposes,
+        # 批量请求在限流队列里让行给界面上的交互请求，各逐字稿之间轮转
+        settings={**project["settings"], "priority": "batch", "session_key": f"batch:{path.name}"},
+        max_workers=max_workers,
+        reuse_existing=False,
+        on_done=_on_done,
+    )
+
+    summary["ok"] = True
+    for purpose in purposes:
+        final = workflow_modules(purpose)[-1]
+        if outcomes.get(final, {}).get("status") != "ok":
+            summary["ok"] = False
+            summary.setdefault("error", f"{purpose}: module {final} {outcomes.get(final, {}).get('status')}")
+            continue
+        text = project[final]["current"].strip()
+        stem = f"{path.stem}.{final}" if len(purposes) > 1 else path.stem
+        (target_dir / f"{stem}.txt").write_text(text, encoding="utf-8")
+        (target_dir / f"{stem}.md").write_text(text, encoding="utf-8")
+        (target_dir / f"{stem}.docx").write_bytes(export_docx_bytes(text=text, title=path.stem))
+        _write_srt(target_dir / f"{stem}.srt", final, text)
+
+    (target_dir / "project.json").write_text(json.dumps(project, ensure_ascii=False, indent=2), encoding="utf-8")
+    summary["seconds"] = round(time.monotonic() - started, 2)
+    return summary
+
+
+def find_transcripts(input_dir: Path) -> List[Path]:
+    return sorted(p for p in input_dir.iterdir() if p.is_file() and p.suffix.lower().lstrip(".") in SUPPORTED_EXTS)
+
+
+def run_batch(
+    input_dir: Path,
+    *,
+    purposes: List[str],
+    out_dir: Path,
+    settings: Dict[str, Any],
+    concurrency: int = 8,
+    max_files: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Process every transcript in input_dir in parallel.
+    `concurrency` caps in-flight LLM requests process-wide (chunked module A included);
+    `max_files` caps transcripts open at once (defaults to concurrency).
+    """
+    for purpose in purposes:
+        workflow_modules(purpose)
+    files = find_transcripts(input_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    set_max_inflight(concurrency)
+
+    results: List[Dict[str, Any]] = []
+    with ThreadPoolExecutor(max_workers=max(1, max_files or concurrency), thread_name_prefix="batch") as pool:
+        futures = {
+            pool.submit(process_transcript, path, purposes=purposes, settings=settings, out_dir=out_dir): path
+            for path in files
+        }
+        for fut in as_completed(futures):
+            try:
+                summary = fut.result()
+            except Exception as e:
+                summary = {"file": str(futures[fut]), "purposes": purposes, "ok": False, "error": str(e)}
+            results.append(summary)
+            _log(f"[batch] {len(results)}/{len(files)} {Path(summary['file']).name}: {'ok' if summary['ok'] else 'FAILED'}")
+
+    results.sort(key=lambda r: r["file"])
+    (out_dir / "batch_summary.json").write_text(json.dumps(results, ensure_ascii=False, indent=2), encoding="utf-8")
+    # 按模块/模型汇总的耗时与 tokens（JSON + Prometheus 文本，可直接喂给 node_exporter textfile）
+    metrics = get_metrics()
+    (out_dir / "batch_metrics.json").write_text(
+        json.dumps(metrics.snapshot(), ensure_ascii=False, indent=2), encoding="utf-8"
+    )
+    (out_dir / "batch_metrics.prom").write_text(metrics.prometheus(), encoding="utf-8")
+    return results
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run a podcast SOP workflow over a directory of transcripts.")
+    parser.add_argument("input_dir", type=Path, help="directory with .docx / .txt / .srt / .vtt transcripts")
+    parser.add_argument(
+        "--purpose",
+        required=True,
+        action="append",
+        choices=list(WORKFLOW_PREV),
+        help="发稿用途；可重复指定，多用途共用的模块只跑一次，独立分支并行",
+    )
+    parser.add_argument("--out", type=Path, default=Path("batch_output"), help="output directory")
+    parser.add_argument("--concurrency", type=int, default=8, help="max in-flight LLM requests")
+    parser.add_argument("--max-files", type=int, default=None, help="max transcripts processed at once")
+    parser.add_argument("--provider", default="deepseek", help="deepseek / openai / qwen / local, or one from LLM_PROVIDERS_FILE")
+    parser.add_argument("--no-fallback", action="store_true", help="never switch to another provider on failure")
+    parser.add_argument("--hedge", action="store_true", help="send a backup request when the primary is slower than its p95")
+    parser.add_argument("--model", default="deepseek-chat")
+    parser.add_argument("--temperature", type=float, default=0.2)
+    parser.add_argument("--max-tokens", type=int, default=None, help="fixed max_tokens (default: chosen per request)")
+    parser.add_argument("--chunked", action="store_true", help="chunked, parallel module A for long transcripts")
+    parser.add_argument("--no-preclean", action="store_true", help="send the raw transcript to module A (no local pre-cleaning)")
+    args = parser.parse_args(argv)
+
+    try:
+        from dotenv import load_dotenv  # type: ignore
+
+        load_dotenv()
+    except Exception:
+        pass
+
+    if not args.input_dir.is_dir():
+        parser.error(f"not a directory: {args.input_dir}")
+
+    settings = {
+        "model_provider": args.provider,
+        "model_name": args.model,
+        "temperature": args.temperature,
+        "max_tokens": args.max_tokens or 4096,
+        "auto_max_tokens": args.max_tokens is None,
+        "chunked": args.chunked,
+        "preclean": not args.no_preclean,
+        "fallback": not args.no_fallback,
+        "hedge": args.hedge,
+    }
+    results = run_batch(
+        args.input_dir,
+        purposes=list(dict.fromkeys(args.purpose)),
+        out_dir=args.out,
+        settings=settings,
+        concurrency=args.concurrency,
+        max_files=args.max_files,
+    )
+    failed = [r for r in results if not r["ok"]]
+    _log(f"[batch] done: {len(results) - len(failed)} ok, {len(failed)} failed -> {args.out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+import math
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+from core.project_state import text_hash
+from core.prompts import MODULE_INSTRUCTIONS, SYSTEM_PROMPT, build_user_prompt
+from core.tokens import estimate_tokens
+
+
+@dataclass(frozen=True)
+class ModelProfile:
+    context_tokens: int
+    max_output_tokens: int
+    # 元 / 百万 tokens（官网标价量级，仅用于估算）
+    price_in: float
+    price_out: float
+    # 输出速度与首字延迟，用于粗估耗时
+    tokens_per_s: float
+    first_token_s: float
+    # 命中服务端前缀缓存的输入 tokens 单价
+    price_in_cached: float = 0.5
+
+
+MODEL_PROFILES: Dict[str, ModelProfile] = {
+    "deepseek-chat": ModelProfile(128_000, 8_192, 2.0, 3.0, 40.0, 1.5, 0.2),
+    "deepseek-reasoner": ModelProfile(128_000, 65_536, 2.0, 3.0, 30.0, 8.0, 0.2),
+}
+_DEFAULT_PROFILE = ModelProfile(64_000, 8_192, 2.0, 8.0, 30.0, 2.0)
+
+# 各模块输出 ≈ 输入 × 比例（至少 floor tokens）：A/B 基本保留全文，C/E 改写压缩，D 是短素材
+OUTPUT_RATIO: Dict[str, Tuple[float, int]] = {
+    "A": (0.95, 512),
+    "B": (0.95, 512),
+    "C": (0.7, 1024),
+    "D": (0.25, 1024),
+    "E": (0.8, 1024),
+}
+# 预测偏差的余量：宁可多留一些，也不要输出被截断后整段重跑
+_OUTPUT_MARGIN = 1.3
+_MAX_TOKENS_STEP = 256
+
+
+@dataclass
+class BudgetPlan:
+    prompt_tokens: int
+    expected_output_tokens: int
+    max_tokens: int
+    requests: int
+    context_tokens: int
+    seconds: float
+    cost: float
+    warnings: List[str] = field(default_factory=list)
+    # 重新生成（或同输入的兄弟模块）时系统提示 + 输入正文命中前缀缓存的费用
+    rerun_cost: float = 0.0
+
+    @property
+    def fits(self) -> bool:
+        return not self.warnings
+
+
+def model_profile(model_name: str) -> ModelProfile:
+    return MODEL_PROFILES.get(model_name, _DEFAULT_PROFILE)
+
+
+_TOKEN_CACHE: "OrderedDict[Tuple[int, str], int]" = OrderedDict()
+_TOKEN_CACHE_SIZE = 64
+_TOKEN_CACHE_LOCK = threading.Lock()
+
+
+def _cached_tokens(text: str) -> int:
+    # 界面每次重跑都会对内容相同的输入重新估算；按（长度, 内容哈希）记忆，缓存里不保留逐字稿全文
+    key = (len(text), text_hash(text))
+    with _TOKEN_CACHE_LOCK:
+        tokens = _TOKEN_CACHE.get(key)
+        if tokens is not None:
+            _TOKEN_CACHE.move_to_end(key)
+            return tokens
+    tokens = estimate_tokens(text)
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[key] = tokens
+        while len(_TOKEN_CACHE) > _TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+    return tokens
+
+
+@lru_cache(maxsize=None)
+def _template_tokens(module_name: str) -> int:
+    return estimate_tokens(SYSTEM_PROMPT) + estimate_tokens(build_user_prompt(module_name, ""))
+
+
+@lru_cache(maxsize=None)
+def _instruction_tokens(module_name: str) -> int:
+    return estimate_tokens(MODULE_INSTRUCTIONS[module_name])
+
+
+def expected_output_tokens(module_name: str, input_tokens: int) -> int:
+    ratio, floor = OUTPUT_RATIO.get(module_name, (1.0, 512))
+    return max(floor, int(input_tokens * ratio))
+
+
+def choose_max_tokens(module_name: str, input_tokens: int, profile: ModelProfile) -> int:
+    """max_tokens for one request: expected output plus margin, rounded up, capped by the model and context."""
+    want = expected_output_tokens(module_name, input_tokens) * _OUTPUT_MARGIN
+    want = int(math.ceil(want / _MAX_TOKENS_STEP) * _MAX_TOKENS_STEP)
+    room = profile.context_tokens - _template_tokens(module_name) - input_tokens
+    return max(_MAX_TOKENS_STEP, min(want, profile.max_output_tokens, room))
+
+
+def request_max_tokens(module_name: str, input_text: str, settings: Dict[str, Any]) -> int:
+    """max_tokens actually sent: automatic when settings["auto_max_tokens"], else the slider value."""
+    if not settings.get("auto_max_tokens"):
+        return int(settings.get("max_tokens", 4096))
+    profile = model_profile(str(settings.get("model_name", "deepseek-chat")))
+    return choose_max_tokens(module_name, _cached_tokens(input_text), profile)
+
+
+def plan_budget(module_name: str, input_text: str, settings: Dict[str, Any]) -> BudgetPlan:
+    """
+    Estimate one module run before sending it: prompt size (SYSTEM_PROMPT + template + input),
+    expected output, the max_tokens that will be used, request count, latency and cost.
+    Chunked / incremental runs of module A are planned per chunk (chunk_tokens / segment_tokens)
+    and run chunk_workers at a time.
+    """
+    profile = model_profile(str(settings.get("model_name", "deepseek-chat")))
+    input_tokens = _cached_tokens(input_text)
+    template = _template_tokens(module_name)
+
+    requests = 1
+    per_request_input = input_tokens
+    if module_name == "A" and (settings.get("chunked") or settings.get("incremental")):
+        if settings.get("incremental"):
+            chunk = int(settings.get("segment_tokens", 1500))
+        else:
+            chunk = int(settings.get("chunk_tokens", 6000))
+        requests = max(1, math.ceil(input_tokens / chunk))
+        per_request_input = min(input_tokens, chunk)
+
+    if settings.get("auto_max_tokens"):
+        max_tokens = choose_max_tokens(module_name, per_request_input, profile)
+    else:
+        max_tokens = int(settings.get("max_tokens", 4096))
+    expected = expected_output_tokens(module_name, per_request_input)
+
+    warnings: List[str] = []
+    hint = "，建议开启分块并行" if module_name == "A" and requests == 1 else ""
+    prompt_per_request = template + per_request_input
+    if prompt_per_request + max_tokens > profile.context_tokens:
+        warnings.append(
+            f"输入约 {prompt_per_request} tokens，加上输出上限 {max_tokens} 超出模型上下文 {profile.context_tokens}{hint}"
+        )
+    if expected > max_tokens:
+        warnings.append(f"预计输出约 {expected} tokens，超过最大长度 {max_tokens}，结果可能被截断{hint}")
+
+    waves = math.ceil(requests / max(1, int(settings.get("chunk_workers", 4)))) if requests > 1 else 1
+    out_per_request = min(expected, max_tokens)
+    seconds = waves * (profile.first_token_s + out_per_request / profile.tokens_per_s)
+    total_prompt = template * requests + input_tokens
+    out_cost = out_per_request * requests * profile.price_out
+    cost = (total_prompt * profile.price_in + out_cost) / 1_000_000
+    # 指令在末尾，不随输入变化的前缀之外只剩模块指令需要重新计算
+    uncached = min(total_prompt, _instruction_tokens(module_name) * requests)
+    rerun_cost = ((total_prompt - uncached) * profile.price_in_cached + uncached * profile.price_in + out_cost) / 1_000_000
+    return BudgetPlan(
+        prompt_tokens=total_prompt,
+        expected_output_tokens=out_per_request * requests,
+        max_tokens=max_tokens,
+        requests=requests,
+        context_tokens=profile.context_tokens,
+        seconds=round(seconds, 1),
+        cost=round(cost, 4),
+        warnings=warnings,
+        rerun_cost=round(rerun_cost, 4),
+    )
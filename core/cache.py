@@ -0,0 +1,171 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+_DEFAULT_DIR = Path(__file__).resolve().parent.parent / ".cache" / "llm_responses"
+
+
+def request_key(module_name: str, request: Dict[str, Any]) -> str:
+    """
+    Content address for one chat request: module + full messages (SYSTEM_PROMPT and the rendered prompt)
+    + model + temperature + max_tokens.
+    """
+    material = json.dumps(
+        {
+            "module": module_name,
+            "messages": request.get("messages"),
+            "model": request.get("model"),
+            "temperature": request.get("temperature"),
+            "max_tokens": request.get("max_tokens"),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Size-bounded on-disk LRU for module outputs, one JSON file per key.
+    Recency is the file mtime (touched on every hit), so LRU order survives restarts
+    and is shared by every session in the process.
+    """
+
+    def __init__(self, root: Optional[Path] = None, max_bytes: int = 256 * 1024 * 1024) -> None:
+        self.root = Path(root) if root else _DEFAULT_DIR
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._index: Optional[Dict[str, list]] = None  # key -> [size, mtime]
+        self._total = 0
+
+    def _path(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def _load_index(self) -> Dict[str, list]:
+        if self._index is None:
+            index: Dict[str, list] = {}
+            if self.root.exists():
+                for p in self.root.glob("*/*.json"):
+                    try:
+                        st = p.stat()
+                    except OSError:
+                        continue
+                    index[p.stem] = [st.st_size, st.st_mtime]
+            self._index = index
+            self._total = sum(v[0] for v in index.values())
+        return self._index
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = json.load(f)["text"]
+        except (OSError, ValueError, KeyError):
+            with self._lock:
+                self.misses += 1
+            return None
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            self.hits += 1
+            entry = self._load_index().get(key)
+            if entry is not None:
+                entry[1] = now
+        return text
+
+    def put(self, key: str, text: str) -> None:
+        path = self._path(key)
+        data = json.dumps({"text": text, "time": time.time()}, ensure_ascii=False).encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # 先写临时文件再原子替换，避免并发读到半截 JSON
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except OSError:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            index = self._load_index()
+            old = index.get(key)
+            if old is not None:
+                self._total -= old[0]
+            index[key] = [len(data), time.time()]
+            self._total += len(data)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        if self._total <= self.max_bytes:
+            return
+        index = self._load_index()
+        for key, (size, _mtime) in sorted(index.items(), key=lambda kv: kv[1][1]):
+            if self._total <= self.max_bytes:
+                break
+            try:
+                self._path(key).unlink()
+            except OSError:
+                pass
+            del index[key]
+            self._total -= size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            for key in list(self._load_index()):
+                try:
+                    self._path(key).unlink()
+                except OSError:
+                    pass
+            self._index = {}
+            self._total = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            index = self._load_index()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(index),
+                "bytes": self._total,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_CACHE: Optional[ResponseCache] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """
+    Process-wide cache. Env: PODCASTSOP_CACHE_DIR, PODCASTSOP_CACHE_MAX_MB (default 256).
+    """
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            root = os.getenv("PODCASTSOP_CACHE_DIR") or None
+            try:
+                max_mb = float(os.getenv("PODCASTSOP_CACHE_MAX_MB", "") or 256)
+            except ValueError:
+                max_mb = 256
+            _CACHE = ResponseCache(Path(root) if root else None, max_bytes=int(max_mb * 1024 * 1024))
+        return _CACHE
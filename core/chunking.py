@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import re
+from typing import List
+
+from core.tokens import estimate_tokens
+
+# 说话人行首：「主持人：」「嘉宾A:」「Host:」等（标签不超过 16 字、不含空白）
+_SPEAKER_RE = re.compile(r"^\s*[^\s：:，,。.]{1,16}\s*[：:]")
+_SENTENCE_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*\n?|\n")
+_NORM_RE = re.compile(r"[\s，,。.！!？?；;：:、“”\"'‘’（）()《》…—-]+")
+_HEADER_RE = re.compile(r"^\s*《模块[A-E][^》]*》\s*\n?")
+
+
+def split_turns(text: str) -> List[str]:
+    """
+    Split a transcript into speaker turns.
+    A turn starts at a line with a speaker label; without labels, fall back to blank-line paragraphs.
+    """
+    lines = (text or "").replace("\r\n", "\n").split("\n")
+    if not any(_SPEAKER_RE.match(line) for line in lines):
+        return [p.strip("\n") for p in re.split(r"\n\s*\n", text or "") if p.strip()]
+
+    turns: List[str] = []
+    buf: List[str] = []
+    for line in lines:
+        if _SPEAKER_RE.match(line) and buf:
+            turns.append("\n".join(buf).strip("\n"))
+            buf = []
+        buf.append(line)
+    if buf:
+        turns.append("\n".join(buf).strip("\n"))
+    return [t for t in turns if t.strip()]
+
+
+def _split_long_turn(turn: str, max_tokens: int) -> List[str]:
+    # 单个发言超预算时按句切开，避免一块超出上下文
+    parts: List[str] = []
+    buf = ""
+    for sent in _SENTENCE_RE.findall(turn):
+        if buf and estimate_tokens(buf + sent) > max_tokens:
+            parts.append(buf)
+            buf = ""
+        buf += sent
+    if buf.strip():
+        parts.append(buf)
+    return parts or [turn]
+
+
+def split_units(text: str, max_tokens: int) -> List[str]:
+    """Speaker turns, with any turn larger than max_tokens split at sentence boundaries."""
+    units: List[str] = []
+    for turn in split_turns(text):
+        if estimate_tokens(turn) > max_tokens:
+            units.extend(_split_long_turn(turn, max_tokens))
+        else:
+            units.append(turn)
+    return units
+
+
+def split_transcript(text: str, *, max_tokens: int = 6000, overlap_turns: int = 1) -> List[str]:
+    """
+    Pack speaker turns into chunks of at most ~max_tokens.
+    Each chunk after the first repeats the last `overlap_turns` turns of the previous one,
+    so the model keeps speaker context; duplicates are removed in merge_chunk_outputs.
+    """
+    units = split_units(text, max_tokens)
+
+    chunks: List[List[str]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for unit in units:
+        t = estimate_tokens(unit)
+        if cur and cur_tokens + t > max_tokens:
+            chunks.append(cur)
+            carry = cur[-overlap_turns:] if overlap_turns > 0 else []
+            # 重叠部分不能把下一块撑爆
+            if sum(estimate_tokens(u) for u in carry) + t > max_tokens:
+                carry = []
+            cur = list(carry)
+            cur_tokens = sum(estimate_tokens(u) for u in cur)
+        cur.append(unit)
+        cur_tokens += t
+    if cur:
+        chunks.append(cur)
+    return ["\n".join(c) for c in chunks]
+
+
+def _sentences(text: str) -> List[str]:
+    return [s for s in _SENTENCE_RE.findall(text) if s.strip()]
+
+
+def _norm(sentence: str) -> str:
+    return _NORM_RE.sub("", sentence).lower()
+
+
+def merge_chunk_outputs(outputs: List[str], *, lookback: int = 40, dedupe: bool = True) -> str:
+    """
+    Merge per-chunk module outputs in order.
+    Drops repeated module headers and (with dedupe) sentences already emitted near the end of the previous
+    chunk (the overlap region), keeping the first occurrence. Pass dedupe=False for non-overlapping chunks.
+    """
+    merged: List[str] = []
+    header = ""
+    prev_tail: set[str] = set()
+    for idx, out in enumerate(outputs):
+        text = (out or "").replace("\r\n", "\n")
+        m = _HEADER_RE.match(text)
+        if m:
+            header = header or m.group(0).strip()
+            text = text[m.end():]
+        sents = _sentences(text)
+        kept: List[str] = []
+        for pos, sent in enumerate(sents):
+            key = _norm(sent)
+            # 只在块首的重叠区里去重，正文中的合法重复保持原样
+            if dedupe and idx > 0 and pos < lookback and key and key in prev_tail:
+                continue
+            kept.append(sent)
+        body = "".join(kept).strip("\n")
+        if body:
+            merged.append(body)
+        prev_tail = {_norm(s) for s in sents[-lookback:]}
+    text = "\n".join(merged)
+    return f"{header}\n{text}" if header else text
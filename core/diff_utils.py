@@ -1,53 +1,420 @@
 from __future__ import annotations
 
-import difflib
+import bisect
+import hashlib
+import re
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
 from html import escape
-from typing import Literal
+from typing import Dict, Hashable, List, Literal, Optional, Sequence, Tuple
 
+from core.tokens import CJK_CLASS
 
-def diff_html(a: str, b: str, *, granularity: Literal["line", "word"] = "line") -> str:
+Granularity = Literal["line", "word", "char"]
+Opcode = Tuple[str, int, int, int, int]
+
+# 词粒度：拉丁词/数字整体成词，CJK 逐字成词，空白与标点各自成词
+_WORD_TOKEN_RE = re.compile(rf"[A-Za-z0-9_]+(?:['’\-][A-Za-z0-9_]+)*|[{CJK_CLASS}]|\s+|.", re.S)
+
+# 单个区间的最大编辑距离搜索步数；超出后把该区间视为整体替换，避免病态输入拖死页面
+_MAX_EDIT_STEPS = 1000
+# 行内字符级高亮只对不太长的替换行做
+_INLINE_MAX_LINE = 2000
+_INLINE_MAX_PAIRS = 200
+# 已算好的 diff 按 (输入哈希, 输出哈希, 粒度) 记忆，界面重跑时直接复用
+_DIFF_CACHE_SIZE = 16
+
+
+def tokenize(text: str, granularity: Granularity = "line") -> List[str]:
+    if granularity == "line":
+        return text.splitlines()
+    if granularity == "char":
+        return list(text)
+    return _WORD_TOKEN_RE.findall(text)
+
+
+def _common_prefix(a: Sequence[int], b: Sequence[int], a0: int, a1: int, b0: int, b1: int) -> int:
+    n = 0
+    limit = min(a1 - a0, b1 - b0)
+    while n < limit and a[a0 + n] == b[b0 + n]:
+        n += 1
+    return n
+
+
+def _common_suffix(a: Sequence[int], b: Sequence[int], a0: int, a1: int, b0: int, b1: int) -> int:
+    n = 0
+    limit = min(a1 - a0, b1 - b0)
+    while n < limit and a[a1 - 1 - n] == b[b1 - 1 - n]:
+        n += 1
+    return n
+
+
+def _lis_pairs(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    # pairs 按 a 下标有序；在 b 下标上求最长递增子序列（patience sorting）
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    prev: List[int] = [-1] * len(pairs)
+    for idx, (_i, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(idx)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = idx
+        prev[idx] = tail_idx[pos - 1] if pos > 0 else -1
+    out: List[Tuple[int, int]] = []
+    k = tail_idx[-1] if tail_idx else -1
+    while k != -1:
+        out.append(pairs[k])
+        k = prev[k]
+    out.reverse()
+    return out
+
+
+def _patience_anchors(a: Sequence[int], b: Sequence[int], a0: int, a1: int, b0: int, b1: int) -> List[Tuple[int, int]]:
+    ca = Counter(a[a0:a1])
+    cb = Counter(b[b0:b1])
+    b_pos: Dict[int, int] = {}
+    for j in range(b0, b1):
+        tok = b[j]
+        if cb[tok] == 1 and ca.get(tok) == 1:
+            b_pos[tok] = j
+    if not b_pos:
+        return []
+    pairs = [(i, b_pos[a[i]]) for i in range(a0, a1) if a[i] in b_pos]
+    return _lis_pairs(pairs)
+
+
+def _bisect(
+    a: Sequence[int], b: Sequence[int], a0: int, a1: int, b0: int, b1: int, max_steps: int
+) -> Optional[Tuple[int, int]]:
     """
-    Returns a simple HTML diff view.
-    - line: compare by lines
-    - word: compare by whitespace-delimited tokens (MVP)
-    """
-    if granularity == "word":
-        a_seq = a.split()
-        b_seq = b.split()
-    else:
-        a_seq = a.splitlines()
-        b_seq = b.splitlines()
-
-    sm = difflib.SequenceMatcher(a=a_seq, b=b_seq)
-
-    out = [
-        "<div style='font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, \"Liberation Mono\", \"Courier New\", monospace; font-size: 13px; line-height: 1.5;'>"
-    ]
-    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+    Myers' O(ND) middle-snake search in linear space (forward and reverse paths meet in the middle).
+    Returns a split point (x, y) in absolute indices, or None when there is no overlap within max_steps.
+    """
+    n = a1 - a0
+    m = b1 - b0
+    max_d = (n + m + 1) // 2
+    v_offset = max_d
+    v_length = 2 * max_d + 2
+    v1 = [-1] * v_length
+    v2 = [-1] * v_length
+    v1[v_offset + 1] = 0
+    v2[v_offset + 1] = 0
+    delta = n - m
+    front = delta % 2 != 0
+    k1start = k1end = k2start = k2end = 0
+    for d in range(min(max_d, max_steps)):
+        for k1 in range(-d + k1start, d + 1 - k1end, 2):
+            k1_offset = v_offset + k1
+            if k1 == -d or (k1 != d and v1[k1_offset - 1] < v1[k1_offset + 1]):
+                x1 = v1[k1_offset + 1]
+            else:
+                x1 = v1[k1_offset - 1] + 1
+            y1 = x1 - k1
+            while x1 < n and y1 < m and a[a0 + x1] == b[b0 + y1]:
+                x1 += 1
+                y1 += 1
+            v1[k1_offset] = x1
+            if x1 > n:
+                k1end += 2
+            elif y1 > m:
+                k1start += 2
+            elif front:
+                k2_offset = v_offset + delta - k1
+                if 0 <= k2_offset < v_length and v2[k2_offset] != -1:
+                    if x1 >= n - v2[k2_offset]:
+                        return a0 + x1, b0 + y1
+        for k2 in range(-d + k2start, d + 1 - k2end, 2):
+            k2_offset = v_offset + k2
+            if k2 == -d or (k2 != d and v2[k2_offset - 1] < v2[k2_offset + 1]):
+                x2 = v2[k2_offset + 1]
+            else:
+                x2 = v2[k2_offset - 1] + 1
+            y2 = x2 - k2
+            while x2 < n and y2 < m and a[a1 - 1 - x2] == b[b1 - 1 - y2]:
+                x2 += 1
+                y2 += 1
+            v2[k2_offset] = x2
+            if x2 > n:
+                k2end += 2
+            elif y2 > m:
+                k2start += 2
+            elif not front:
+                k1_offset = v_offset + delta - k2
+                if 0 <= k1_offset < v_length and v1[k1_offset] != -1:
+                    x1 = v1[k1_offset]
+                    y1 = v_offset + x1 - k1_offset
+                    if x1 >= n - x2:
+                        return a0 + x1, b0 + y1
+    return None
+
+
+def _matching_blocks(a: Sequence[int], b: Sequence[int], max_steps: int) -> List[Tuple[int, int, int]]:
+    """
+    Matching blocks (i, j, size) in order, like difflib's get_matching_blocks (without the sentinel).
+    Trims common prefix/suffix, anchors on tokens unique to both sides (patience), and falls back to
+    Myers bisection for the rest. Uses an explicit stack, so deep recursion is never an issue.
+    """
+    blocks: List[Tuple[int, int, int]] = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a0, a1, b0, b1 = stack.pop()
+        p = _common_prefix(a, b, a0, a1, b0, b1)
+        if p:
+            blocks.append((a0, b0, p))
+            a0 += p
+            b0 += p
+        s = _common_suffix(a, b, a0, a1, b0, b1)
+        if s:
+            blocks.append((a1 - s, b1 - s, s))
+            a1 -= s
+            b1 -= s
+        if a0 == a1 or b0 == b1:
+            continue
+
+        anchors = _patience_anchors(a, b, a0, a1, b0, b1)
+        if anchors:
+            pa, pb = a0, b0
+            for i, j in anchors:
+                stack.append((pa, i, pb, j))
+                blocks.append((i, j, 1))
+                pa, pb = i + 1, j + 1
+            stack.append((pa, a1, pb, b1))
+            continue
+
+        split = _bisect(a, b, a0, a1, b0, b1, max_steps)
+        if split is None:
+            continue  # 无公共部分（或超出预算）：整段替换
+        x, y = split
+        stack.append((a0, x, b0, y))
+        stack.append((x, a1, y, b1))
+
+    blocks.sort()
+    merged: List[Tuple[int, int, int]] = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            pi, pj, ps = merged[-1]
+            merged[-1] = (pi, pj, ps + size)
+        else:
+            merged.append((i, j, size))
+    return merged
+
+
+def _intern(a_seq: Sequence[Hashable], b_seq: Sequence[Hashable]) -> Tuple[List[int], List[int]]:
+    ids: Dict[Hashable, int] = {}
+    a = [ids.setdefault(t, len(ids)) for t in a_seq]
+    b = [ids.setdefault(t, len(ids)) for t in b_seq]
+    return a, b
+
+
+def sequence_opcodes(
+    a_seq: Sequence[Hashable], b_seq: Sequence[Hashable], *, max_steps: int = _MAX_EDIT_STEPS
+) -> List[Opcode]:
+    """
+    difflib-compatible opcodes ("equal" / "replace" / "delete" / "insert", i1, i2, j1, j2)
+    for two token sequences.
+    """
+    a, b = _intern(a_seq, b_seq)
+    ops: List[Opcode] = []
+    i = j = 0
+    for bi, bj, size in _matching_blocks(a, b, max_steps) + [(len(a), len(b), 0)]:
+        if i < bi and j < bj:
+            ops.append(("replace", i, bi, j, bj))
+        elif i < bi:
+            ops.append(("delete", i, bi, j, j))
+        elif j < bj:
+            ops.append(("insert", i, i, j, bj))
+        if size:
+            ops.append(("equal", bi, bi + size, bj, bj + size))
+        i, j = bi + size, bj + size
+    return ops
+
+
+@dataclass(frozen=True)
+class DiffResult:
+    granularity: Granularity
+    a_seq: List[str]
+    b_seq: List[str]
+    opcodes: List[Opcode]
+
+    @property
+    def changes(self) -> int:
+        return sum(1 for op in self.opcodes if op[0] != "equal")
+
+
+def diff_opcodes(a: str, b: str, *, granularity: Granularity = "line") -> DiffResult:
+    """
+    Structured diff of two texts. Rendering is separate (render_diff_html), so callers can page
+    through large diffs instead of building one huge HTML string.
+
+    word/char diffs run line-first: unchanged lines become one equal run and only the changed
+    line regions are diffed token by token, so cost follows the size of the edits, not the text.
+    """
+    if granularity == "line":
+        a_seq = tokenize(a, "line")
+        b_seq = tokenize(b, "line")
+        return DiffResult(granularity, a_seq, b_seq, sequence_opcodes(a_seq, b_seq))
+
+    a_lines = a.splitlines(keepends=True)
+    b_lines = b.splitlines(keepends=True)
+    a_out: List[str] = []
+    b_out: List[str] = []
+    ops: List[Opcode] = []
+
+    def _emit(tag: str, a_toks: List[str], b_toks: List[str]) -> None:
+        i1, j1 = len(a_out), len(b_out)
+        a_out.extend(a_toks)
+        b_out.extend(b_toks)
+        i2, j2 = len(a_out), len(b_out)
+        if ops and ops[-1][0] == tag:
+            ops[-1] = (tag, ops[-1][1], i2, ops[-1][3], j2)
+        else:
+            ops.append((tag, i1, i2, j1, j2))
+
+    for tag, i1, i2, j1, j2 in sequence_opcodes(a_lines, b_lines):
+        if tag == "replace" and i2 - i1 == j2 - j1:
+            # 行数相同的替换块（逐行润色最常见）：逐行配对比较，代价只和每行长度有关
+            pairs = [([a_lines[i]], [b_lines[j]]) for i, j in zip(range(i1, i2), range(j1, j2))]
+        else:
+            pairs = [(a_lines[i1:i2], b_lines[j1:j2])]
+        for a_part, b_part in pairs:
+            a_toks = tokenize("".join(a_part), granularity)
+            b_toks = tokenize("".join(b_part), granularity)
+            if tag != "replace":
+                _emit(tag, a_toks, b_toks)
+                continue
+            for sub, si1, si2, sj1, sj2 in sequence_opcodes(a_toks, b_toks):
+                _emit(sub, a_toks[si1:si2], b_toks[sj1:sj2])
+    return DiffResult(granularity, a_out, b_out, ops)
+
+
+_DIFF_CACHE: "OrderedDict[Tuple[str, str, str], DiffResult]" = OrderedDict()
+_DIFF_LOCK = threading.Lock()
+
+
+def _text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cached_diff_opcodes(a: str, b: str, *, granularity: Granularity = "line") -> DiffResult:
+    """diff_opcodes() memoized by (input hash, output hash, granularity); results are shared, treat as read-only."""
+    key = (_text_digest(a), _text_digest(b), granularity)
+    with _DIFF_LOCK:
+        hit = _DIFF_CACHE.get(key)
+        if hit is not None:
+            _DIFF_CACHE.move_to_end(key)
+            return hit
+    result = diff_opcodes(a, b, granularity=granularity)
+    with _DIFF_LOCK:
+        _DIFF_CACHE[key] = result
+        while len(_DIFF_CACHE) > _DIFF_CACHE_SIZE:
+            _DIFF_CACHE.popitem(last=False)
+    return result
+
+
+_STYLE_WRAPPER = (
+    "<div style='font-family: ui-monospace, SFMono-Regular, Menlo, Monaco, Consolas, \"Liberation Mono\", "
+    "\"Courier New\", monospace; font-size: 13px; line-height: 1.5;'>"
+)
+_DEL_STYLE = "color:#991B1B;background:#FECACA;text-decoration:line-through;"
+_INS_STYLE = "color:#065F46;background:#A7F3D0;"
+
+
+def _inline_pair(old: str, new: str) -> Tuple[str, str]:
+    # 被替换的一行内部再做字符级对比，只高亮真正改动的字
+    old_parts: List[str] = []
+    new_parts: List[str] = []
+    for tag, i1, i2, j1, j2 in sequence_opcodes(old, new):
         if tag == "equal":
-            chunk = a_seq[i1:i2]
-            out.append(_wrap(chunk, color="#111827"))
-        elif tag == "delete":
-            chunk = a_seq[i1:i2]
-            out.append(_wrap(chunk, color="#991B1B", bg="#FEE2E2", prefix="- "))
-        elif tag == "insert":
-            chunk = b_seq[j1:j2]
-            out.append(_wrap(chunk, color="#065F46", bg="#D1FAE5", prefix="+ "))
-        else:  # replace
-            chunk_a = a_seq[i1:i2]
-            chunk_b = b_seq[j1:j2]
-            out.append(_wrap(chunk_a, color="#991B1B", bg="#FEE2E2", prefix="- "))
-            out.append(_wrap(chunk_b, color="#065F46", bg="#D1FAE5", prefix="+ "))
-    out.append("</div>")
-    return "\n".join(out)
-
-
-def _wrap(seq, *, color: str, bg: str | None = None, prefix: str = "") -> str:
-    if not seq:
+            old_parts.append(escape(old[i1:i2]))
+            new_parts.append(escape(new[j1:j2]))
+            continue
+        if i2 > i1:
+            old_parts.append(f"<span style='{_DEL_STYLE}'>{escape(old[i1:i2])}</span>")
+        if j2 > j1:
+            new_parts.append(f"<span style='{_INS_STYLE}'>{escape(new[j1:j2])}</span>")
+    return "".join(old_parts), "".join(new_parts)
+
+
+def _pre(lines_html: List[str], *, color: str, bg: Optional[str] = None) -> str:
+    if not lines_html:
         return ""
     style = f"color:{color};"
     if bg:
         style += f"background:{bg};"
-    safe = escape("\n".join(f"{prefix}{s}" for s in seq))
-    return f"<pre style='margin:0; padding:8px; white-space:pre-wrap; {style}'>{safe}</pre>"
+    body = "\n".join(lines_html)
+    return f"<pre style='margin:0; padding:8px; white-space:pre-wrap; {style}'>{body}</pre>"
+
+
+def _render_lines(result: DiffResult, ops: Sequence[Opcode]) -> List[str]:
+    a_seq, b_seq = result.a_seq, result.b_seq
+    out: List[str] = []
+    for tag, i1, i2, j1, j2 in ops:
+        if tag == "equal":
+            out.append(_pre([escape(s) for s in a_seq[i1:i2]], color="#111827"))
+        elif tag == "delete":
+            out.append(_pre([escape(f"- {s}") for s in a_seq[i1:i2]], color="#991B1B", bg="#FEE2E2"))
+        elif tag == "insert":
+            out.append(_pre([escape(f"+ {s}") for s in b_seq[j1:j2]], color="#065F46", bg="#D1FAE5"))
+        else:
+            old_lines = a_seq[i1:i2]
+            new_lines = b_seq[j1:j2]
+            pairs = min(len(old_lines), len(new_lines))
+            old_html: List[str] = []
+            new_html: List[str] = []
+            for k in range(pairs):
+                o, n = old_lines[k], new_lines[k]
+                if k < _INLINE_MAX_PAIRS and len(o) <= _INLINE_MAX_LINE and len(n) <= _INLINE_MAX_LINE:
+                    oh, nh = _inline_pair(o, n)
+                else:
+                    oh, nh = escape(o), escape(n)
+                old_html.append("- " + oh)
+                new_html.append("+ " + nh)
+            old_html.extend(escape(f"- {s}") for s in old_lines[pairs:])
+            new_html.extend(escape(f"+ {s}") for s in new_lines[pairs:])
+            out.append(_pre(old_html, color="#991B1B", bg="#FEE2E2"))
+            out.append(_pre(new_html, color="#065F46", bg="#D1FAE5"))
+    return out
+
+
+def _render_inline(result: DiffResult, ops: Sequence[Opcode]) -> List[str]:
+    a_seq, b_seq = result.a_seq, result.b_seq
+    parts: List[str] = []
+    for tag, i1, i2, j1, j2 in ops:
+        if tag == "equal":
+            parts.append(escape("".join(a_seq[i1:i2])))
+            continue
+        if i2 > i1:
+            parts.append(f"<span style='{_DEL_STYLE}'>{escape(''.join(a_seq[i1:i2]))}</span>")
+        if j2 > j1:
+            parts.append(f"<span style='{_INS_STYLE}'>{escape(''.join(b_seq[j1:j2]))}</span>")
+    return [f"<pre style='margin:0; padding:8px; white-space:pre-wrap; color:#111827;'>{''.join(parts)}</pre>"]
 
+
+def render_diff_html(result: DiffResult, *, start: int = 0, limit: Optional[int] = None) -> str:
+    """
+    Render opcodes [start, start+limit) of a DiffResult.
+    line: +/- blocks with character-level highlights inside replaced lines; word/char: inline highlights.
+    """
+    ops = result.opcodes[start : None if limit is None else start + limit]
+    body = _render_lines(result, ops) if result.granularity == "line" else _render_inline(result, ops)
+    return "\n".join([_STYLE_WRAPPER, *body, "</div>"])
+
+
+def diff_html(
+    a: str,
+    b: str,
+    *,
+    granularity: Granularity = "line",
+    max_ops: Optional[int] = None,
+) -> str:
+    """
+    Returns a simple HTML diff view.
+    - line: compare by lines (replaced lines get character-level highlights)
+    - word: CJK-aware tokens (Chinese per character, English per word)
+    - char: compare by characters
+    """
+    return render_diff_html(diff_opcodes(a, b, granularity=granularity), limit=max_ops)
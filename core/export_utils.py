@@ -1,7 +1,41 @@
 from __future__ import annotations
 
+import hashlib
+import json
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
 from io import BytesIO
-from typing import Optional
+from pathlib import Path
+from typing import IO, Callable, Iterable, Optional, Sequence, Tuple
+
+from core.file_io import Cue
+from core.project_state import MODULES, Project, iter_versions
+from core.subtitles import SUBTITLE_MODULES, align_to_cues, cues_digest, cues_from_records, format_srt
+
+EXPORT_FORMATS: Tuple[str, ...] = ("markdown", "txt", "docx")
+# 字幕导出需要原始时间轴（srt/vtt 上传），不在通用格式列表里
+SUBTITLE_FORMAT = "srt"
+EXPORT_EXT = {"markdown": "md", "txt": "txt", "docx": "docx", "srt": "srt"}
+EXPORT_MIME = {
+    "markdown": "text/markdown",
+    "txt": "text/plain",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "srt": "application/x-subrip",
+}
+
+# 导出结果按 (格式, 标题, 正文哈希) 记忆，超出上限时淘汰最久未用的
+_EXPORT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+_EXPORT_CACHE: "OrderedDict[str, bytes]" = OrderedDict()
+_EXPORT_CACHE_BYTES = 0
+_EXPORT_LOCK = threading.Lock()
+
+# 打包的 ZIP 写在磁盘上，下载时才读出；超过保留期的在下次打包时清理
+_ARCHIVE_DIR = Path(tempfile.gettempdir()) / "podcastsop-archives"
+ARCHIVE_RETENTION_S = 3600.0
 
 
 def export_docx_bytes(*, text: str, title: Optional[str] = None) -> bytes:
@@ -35,3 +69,144 @@ def export_docx_bytes(*, text: str, title: Optional[str] = None) -> bytes:
     doc.save(buf)
     return buf.getvalue()
 
+
+def _export_key(text: str, fmt: str, title: Optional[str]) -> str:
+    h = hashlib.sha256()
+    for part in (fmt, title or "", text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _memoized(key: str, build: Callable[[], bytes]) -> bytes:
+    global _EXPORT_CACHE_BYTES
+    with _EXPORT_LOCK:
+        cached = _EXPORT_CACHE.get(key)
+        if cached is not None:
+            _EXPORT_CACHE.move_to_end(key)
+            return cached
+    data = build()
+    with _EXPORT_LOCK:
+        if key not in _EXPORT_CACHE:
+            _EXPORT_CACHE[key] = data
+            _EXPORT_CACHE_BYTES += len(data)
+        while _EXPORT_CACHE_BYTES > _EXPORT_CACHE_MAX_BYTES and len(_EXPORT_CACHE) > 1:
+            _old_key, old = _EXPORT_CACHE.popitem(last=False)
+            _EXPORT_CACHE_BYTES -= len(old)
+    return data
+
+
+def export_bytes(
+    *,
+    text: str,
+    fmt: str,
+    title: Optional[str] = None,
+    cues: Optional[Sequence[Cue]] = None,
+    memo: bool = True,
+) -> bytes:
+    """
+    File contents for one export format. Memoized by content hash and title,
+    so re-downloading unchanged text never rebuilds the docx.
+    fmt="srt" aligns the text onto `cues` (the uploaded subtitle timeline) and is memoized per cue set.
+    memo=False builds without touching the cache (one-off documents such as archived history versions).
+    """
+    if fmt == SUBTITLE_FORMAT:
+        if not cues:
+            raise ValueError("SRT export needs the timeline of an uploaded .srt/.vtt transcript")
+        if not memo:
+            return format_srt(align_to_cues(cues, text)).encode("utf-8")
+        return _memoized(
+            _export_key(text, fmt, cues_digest(cues)),
+            lambda: format_srt(align_to_cues(cues, text)).encode("utf-8"),
+        )
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    if fmt != "docx":
+        return text.encode("utf-8")
+    if not memo:
+        return export_docx_bytes(text=text, title=title)
+    return _memoized(_export_key(text, fmt, title), lambda: export_docx_bytes(text=text, title=title))
+
+
+def safe_filename(name: str, default: str = "export") -> str:
+    cleaned = re.sub(r'[\\/:*?"<>|\x00-\x1f]+', "_", name).strip(" .")
+    return cleaned or default
+
+
+def write_project_archive(
+    project: Project,
+    out: IO[bytes],
+    *,
+    formats: Iterable[str] = EXPORT_FORMATS,
+    include_history: bool = True,
+) -> int:
+    """
+    Write every module's current text (and every history version) in each format into a ZIP on `out`.
+    Entries are written one at a time and versions are materialized one by one, so only a single
+    document is held in memory besides the archive itself. Returns the number of files written.
+
+    Layout: <title>/<module>/current.<ext>, <title>/<module>/history/<version_id>.<ext>, <title>/manifest.json
+    With "srt" in `formats` and an uploaded subtitle timeline, modules A and E also get aligned .srt files.
+    """
+    fmts = [f for f in formats if f in EXPORT_FORMATS]
+    # 有字幕时间轴时，模块A/E额外导出对齐后的字幕
+    cues = cues_from_records(project.get("input_cues") or []) if SUBTITLE_FORMAT in formats else []
+    title = (project["meta"].get("title") or "").strip() or None
+    root = safe_filename(title or "", default="project")
+    manifest = {"title": title or "", "modules": {}}
+    count = 0
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+
+        def _write(path: str, text: str, module: str, memo: bool = True) -> None:
+            nonlocal count
+            subtitle = [SUBTITLE_FORMAT] if cues and module in SUBTITLE_MODULES else []
+            for fmt in fmts + subtitle:
+                data = export_bytes(text=text, fmt=fmt, title=title, cues=cues, memo=memo)
+                # docx 本身已压缩，不再二次压缩
+                compress = zipfile.ZIP_STORED if fmt == "docx" else zipfile.ZIP_DEFLATED
+                zf.writestr(f"{root}/{path}.{EXPORT_EXT[fmt]}", data, compress_type=compress)
+                count += 1
+
+        for module in MODULES:
+            state = project[module]
+            entry = {"current": bool(state["current"].strip()), "versions": []}
+            if state["current"].strip():
+                _write(f"{module}/current", state["current"], module)
+            if include_history:
+                for item in iter_versions(project, module):
+                    # 历史版本只在打包时用一次：不进导出缓存，免得挤掉单文件导出
+                    _write(f"{module}/history/{safe_filename(item['version_id'])}", item["text"], module, memo=False)
+                    entry["versions"].append(
+                        {"version_id": item["version_id"], "time": item["time"], "settings": item["settings"]}
+                    )
+            manifest["modules"][module] = entry
+        zf.writestr(f"{root}/manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2))
+    return count
+
+
+def _prune_archives(now: float) -> None:
+    for old in _ARCHIVE_DIR.glob("*.zip"):
+        try:
+            if now - old.stat().st_mtime > ARCHIVE_RETENTION_S:
+                old.unlink()
+        except OSError:
+            continue
+
+
+def export_project_archive(project: Project, **kwargs) -> Path:
+    """
+    Write the archive to a temp file on disk and return its path; nothing of it stays in memory.
+    Archives older than ARCHIVE_RETENTION_S are removed on the next build; the caller removes
+    the previous one when it builds a new one.
+    """
+    _ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    _prune_archives(time.time())
+    with tempfile.NamedTemporaryFile(dir=_ARCHIVE_DIR, suffix=".zip", delete=False) as out:
+        path = Path(out.name)
+        try:
+            write_project_archive(project, out, **kwargs)
+        except BaseException:
+            out.close()
+            path.unlink(missing_ok=True)
+            raise
+    return path
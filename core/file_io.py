@@ -1,41 +1,319 @@
 from __future__ import annotations
 
-from io import BytesIO
-from typing import Literal, Tuple
+import codecs
+import io
+import re
+import time
+import zipfile
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import BinaryIO, Iterable, Iterator, List, Literal, Optional, Tuple, Union
+from xml.etree import ElementTree
 
+FileKind = Literal["docx", "txt", "srt", "vtt"]
+SUPPORTED_EXTS: Tuple[str, ...] = ("docx", "txt", "srt", "vtt")
 
-def read_uploaded_file(filename: str, data: bytes) -> Tuple[str, Literal["docx", "txt", "srt"]]:
-    ext = filename.split(".")[-1].lower()
-    if ext not in ("docx", "txt", "srt"):
-        raise ValueError(f"Unsupported file type: {ext}")
+# 每次从上传流读取的字节数；解析过程中只保留一个块 + 当前行/字幕/段落
+CHUNK_BYTES = 1 << 16
+_SNIFF_BYTES = 1 << 16
+
+_BOMS = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
+# 无 BOM 时依次尝试；gb18030 覆盖 GBK/GB2312，latin-1 兜底（任何字节都能解码）。
+# Big5 不单独排队：gb18030 几乎能解码任何双字节文本，Big5 文件也会被它“成功”解成生僻字，
+# 所以在 gb18030 成功时再比较两种解法里常用字的占比
+_FALLBACK_ENCODINGS = ("utf-8", "gb18030", "latin-1")
+# Big5 常用字区（含全形标点）
+_BIG5_COMMON = (b"\xa1\x40", b"\xc6\x7e")
+
+_TIMING_RE = re.compile(
+    r"^\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})\s*-->\s*((?:\d+:)?\d{1,2}:\d{2}[,.]\d{1,3})"
+)
+_TAG_RE = re.compile(r"<[^>]+>")
+
+_W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+@dataclass
+class Cue:
+    """One subtitle cue (SRT/VTT); times are in seconds."""
+
+    start: float
+    end: float
+    text: str
+
+
+@dataclass
+class IngestResult:
+    text: str
+    kind: FileKind
+    encoding: Optional[str]
+    bytes_read: int
+    seconds: float
+    # 字幕文件的逐条时间轴（text 即各条字幕正文按行拼接）；docx/txt 为空
+    cues: List[Cue] = field(default_factory=list)
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes_read / 1024 / 1024 / self.seconds if self.seconds > 0 else 0.0
 
-    if ext == "txt":
-        # best-effort: utf-8 first, fallback latin-1
-        try:
-            return data.decode("utf-8"), "txt"
-        except UnicodeDecodeError:
-            return data.decode("latin-1"), "txt"
 
-    if ext == "docx":
+class _CountingReader:
+    """Wraps a binary stream and counts the bytes handed to the parser."""
+
+    def __init__(self, raw: BinaryIO) -> None:
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.raw.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+def _strict_decode(sample: bytes, encoding: str) -> Optional[str]:
+    try:
+        # final=False：样本末尾被截断的多字节字符不算错误
+        return codecs.getincrementaldecoder(encoding)("strict").decode(sample, final=False)
+    except UnicodeDecodeError:
+        return None
+
+
+def _common_share(text: str, encoding: str) -> float:
+    """Share of the non-ASCII characters that are everyday ones for the encoding (GB2312 for gb18030, Big5 常用字)."""
+    counts = Counter(ch for ch in text if not ch.isascii())
+    total = sum(counts.values())
+    if not total:
+        return 1.0
+    common = 0
+    for ch, n in counts.items():
         try:
-            from docx import Document  # type: ignore
-        except Exception as e:
-            raise RuntimeError("Missing dependency for .docx. Please install: python-docx") from e
+            raw = ch.encode("gb2312" if encoding == "gb18030" else encoding)
+        except UnicodeEncodeError:
+            continue
+        if encoding != "big5" or _BIG5_COMMON[0] <= raw <= _BIG5_COMMON[1]:
+            common += n
+    return common / total
+
+
+def sniff_encoding(sample: bytes) -> str:
+    """
+    Guess the encoding from a leading sample: BOM first, then the first strict decode that succeeds.
+    When gb18030 succeeds and Big5 does too, the decoding with more everyday characters wins.
+    """
+    for bom, name in _BOMS:
+        if sample.startswith(bom):
+            return name
+    for name in _FALLBACK_ENCODINGS:
+        text = _strict_decode(sample, name)
+        if text is None:
+            continue
+        if name == "gb18030":
+            big5 = _strict_decode(sample, "big5")
+            if big5 is not None and _common_share(big5, "big5") > _common_share(text, name):
+                return "big5"
+        return name
+    return "latin-1"
+
+
+class DecodedStream:
+    """
+    Iterates decoded text chunks of a binary stream. The encoding is sniffed unless given;
+    undecodable bytes become U+FFFD instead of failing the upload, and line endings are
+    normalized to \\n (also when a \\r\\n pair straddles two chunks).
+
+    While the stream is pure ASCII the choice is deferred: ASCII is valid in every candidate,
+    so the first chunk with non-ASCII bytes decides (a GBK file whose first 64 KB are English
+    would otherwise be sniffed as UTF-8). `encoding` is final once iteration finishes.
+    """
 
-        doc = Document(BytesIO(data))
-        text = "\n".join(p.text for p in doc.paragraphs)
-        return text.strip(), "docx"
+    def __init__(self, stream: BinaryIO, *, encoding: Optional[str] = None, chunk_bytes: int = CHUNK_BYTES) -> None:
+        self.stream = stream
+        self.chunk_bytes = chunk_bytes
+        self.encoding: Optional[str] = encoding
 
+    def __iter__(self) -> Iterator[str]:
+        newline = io.IncrementalNewlineDecoder(None, translate=True)
+        decoder: Optional[codecs.IncrementalDecoder] = None
+        chunk = self.stream.read(max(self.chunk_bytes, _SNIFF_BYTES))
+        while chunk:
+            if decoder is None and self.encoding is None and chunk.isascii():
+                raw = chunk.decode("ascii")
+            else:
+                if decoder is None:
+                    self.encoding = self.encoding or sniff_encoding(chunk)
+                    decoder = codecs.getincrementaldecoder(self.encoding)("replace")
+                raw = decoder.decode(chunk)
+            text = newline.decode(raw)
+            if text:
+                yield text
+            chunk = self.stream.read(self.chunk_bytes)
+        tail = newline.decode(decoder.decode(b"", final=True) if decoder else "", final=True)
+        if tail:
+            yield tail
+        if self.encoding is None:
+            self.encoding = "ascii"
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """Split \\n-normalized text chunks (see DecodedStream) into lines without line endings."""
+    buf: List[str] = []
+    for chunk in chunks:
+        parts = chunk.split("\n")
+        if len(parts) == 1:
+            # 超长行只累积片段，不反复拼接
+            buf.append(chunk)
+            continue
+        buf.append(parts[0])
+        yield "".join(buf)
+        yield from parts[1:-1]
+        buf = [parts[-1]]
+    tail = "".join(buf)
+    if tail:
+        yield tail
+
+
+def _timestamp_s(value: str) -> float:
+    parts = value.replace(",", ".").split(":")
+    seconds = float(parts[-1])
+    for i, p in enumerate(reversed(parts[:-1]), start=1):
+        seconds += int(p) * 60**i
+    return seconds
+
+
+def iter_cues(lines: Iterable[str]) -> Iterator[Cue]:
+    """
+    Incremental SRT/WebVTT parser: yields one cue per block, holding only the current block.
+    Cue numbers/identifiers, WEBVTT headers, NOTE/STYLE/REGION blocks and inline tags are dropped.
+    """
+    timing: Optional[Tuple[float, float]] = None
+    text_lines: List[str] = []
+    skip_block = False
+
+    def _flush() -> Optional[Cue]:
+        if timing is None:
+            return None
+        content = _TAG_RE.sub("", "\n".join(text_lines)).strip()
+        return Cue(start=timing[0], end=timing[1], text=content) if content else None
+
+    for line in lines:
+        if not line.strip():
+            cue = _flush()
+            if cue:
+                yield cue
+            timing, text_lines, skip_block = None, [], False
+            continue
+        if skip_block:
+            continue
+        if timing is None:
+            m = _TIMING_RE.match(line)
+            if m:
+                timing = (_timestamp_s(m.group(1)), _timestamp_s(m.group(2)))
+            elif line.startswith(("WEBVTT", "NOTE", "STYLE", "REGION")):
+                skip_block = True
+            # 否则是序号 / cue 标识行，忽略
+            continue
+        text_lines.append(line)
+    cue = _flush()
+    if cue:
+        yield cue
+
+
+def iter_docx_paragraphs(stream: BinaryIO) -> Iterator[str]:
+    """
+    Stream paragraphs out of word/document.xml with iterparse; each paragraph element is cleared
+    once read, so the XML tree never builds up in memory. Needs a seekable stream (zip).
+    """
     try:
-        import srt  # type: ignore
-    except Exception as e:
-        raise RuntimeError("Missing dependency for .srt. Please install: srt") from e
-
-    subs = list(srt.parse(data.decode("utf-8", errors="replace")))
-    lines = []
-    for sub in subs:
-        content = (sub.content or "").strip()
-        if content:
-            lines.append(content)
-    return "\n".join(lines).strip(), "srt"
+        archive = zipfile.ZipFile(stream)
+    except zipfile.BadZipFile as e:
+        raise ValueError("Invalid .docx file") from e
+    with archive, archive.open("word/document.xml") as xml:
+        parts: List[str] = []
+        for event, elem in ElementTree.iterparse(xml, events=("start", "end")):
+            tag = elem.tag
+            if event == "start":
+                if tag == _W_NS + "p":
+                    parts = []
+                continue
+            if tag == _W_NS + "t":
+                parts.append(elem.text or "")
+            elif tag == _W_NS + "tab":
+                parts.append("\t")
+            elif tag in (_W_NS + "br", _W_NS + "cr"):
+                parts.append("\n")
+            elif tag == _W_NS + "p":
+                yield "".join(parts)
+                elem.clear()
+            elif tag == _W_NS + "body":
+                elem.clear()
+
+
+def _file_kind(filename: str) -> FileKind:
+    ext = filename.split(".")[-1].lower()
+    if ext not in SUPPORTED_EXTS:
+        raise ValueError(f"Unsupported file type: {ext}")
+    return ext  # type: ignore[return-value]
+
+
+def _write_lines(out: io.StringIO, lines: Iterable[str]) -> None:
+    first = True
+    for line in lines:
+        if not first:
+            out.write("\n")
+        out.write(line)
+        first = False
+
+
+def ingest_stream(filename: str, stream: BinaryIO, *, chunk_bytes: int = CHUNK_BYTES) -> IngestResult:
+    """
+    Read a transcript without holding the raw upload and its parsed forms at the same time:
+    bytes are decoded in chunks, subtitles parsed cue by cue and docx paragraph by paragraph.
+    """
+    kind = _file_kind(filename)
+    started = time.perf_counter()
+    out = io.StringIO()
+    cues: List[Cue] = []
+
+    if kind == "docx":
+        _write_lines(out, iter_docx_paragraphs(stream))
+        # zip 按需 seek 读取，按文件大小计量
+        bytes_read = stream.seek(0, io.SEEK_END)
+        encoding: Optional[str] = None
+    else:
+        reader = _CountingReader(stream)
+        decoded = DecodedStream(reader, chunk_bytes=chunk_bytes)
+        lines = iter_lines(decoded)
+        if kind == "txt":
+            _write_lines(out, lines)
+        else:
+
+            def _cue_texts() -> Iterator[str]:
+                for cue in iter_cues(lines):
+                    cues.append(cue)
+                    yield cue.text
+
+            _write_lines(out, _cue_texts())
+        bytes_read = reader.bytes_read
+        encoding = decoded.encoding
+
+    text = out.getvalue().strip()
+    out.close()
+    return IngestResult(
+        text=text,
+        kind=kind,
+        encoding=encoding,
+        bytes_read=bytes_read,
+        seconds=time.perf_counter() - started,
+        cues=cues,
+    )
+
 
+def read_uploaded_file(filename: str, data: Union[bytes, BinaryIO]) -> Tuple[str, FileKind]:
+    """Backward-compatible wrapper: accepts raw bytes or a binary file object."""
+    stream = io.BytesIO(data) if isinstance(data, (bytes, bytearray)) else data
+    result = ingest_stream(filename, stream)
+    return result.text, result.kind
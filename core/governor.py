@@ -0,0 +1,424 @@
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+# 排在前面的优先：有交互请求排队时批量请求一律让行
+PRIORITIES = ("interactive", "batch")
+# 只用于排队的设置项：不影响模型输出
+LANE_KEYS = ("session_key", "priority")
+_WAIT_SAMPLES = 512
+
+
+def _env_number(name: str) -> float:
+    try:
+        return max(0.0, float(os.getenv(name, "") or 0))
+    except ValueError:
+        return 0.0
+
+
+@dataclass(frozen=True)
+class Lane:
+    """
+    Who an upstream request is for. Requests queue by priority first; within one priority the
+    governor serves sessions round-robin, so one long batch or one busy editor cannot starve the rest.
+    """
+
+    session: str = ""
+    priority: str = "interactive"
+
+    @classmethod
+    def from_settings(cls, settings: Dict[str, Any]) -> "Lane":
+        priority = str(settings.get("priority") or PRIORITIES[0])
+        return cls(
+            session=str(settings.get("session_key") or ""),
+            priority=priority if priority in PRIORITIES else PRIORITIES[0],
+        )
+
+
+class TokenBucket:
+    """Refills `per_minute` units per minute up to a one-minute burst; the level may go negative (debt)."""
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self._stamp = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def wait_s(self, amount: float, now: float) -> float:
+        self._refill(now)
+        # 单个请求超过整桶时按整桶算，否则永远等不到
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def give(self, amount: float) -> None:
+        self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass(eq=False)
+class _Waiter:
+    lane: Lane
+    tokens: int
+    # 重试：调用方已占着并发名额，只需再过一次限流
+    retry: bool = False
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class Governor:
+    """
+    Process-wide admission control for upstream LLM requests: token buckets for requests and
+    tokens per minute, a cap on concurrent requests, and a fair queue in front of them.
+    A limit of 0 disables it. Token cost is estimated up front (prompt + max_tokens) and settled
+    against the reported usage when the request ends. Retries of a request queue again and count
+    against the request budget; an upstream Retry-After pauses every queued request (hold()).
+    """
+
+    def __init__(self, *, rpm: float = 0, tpm: float = 0, max_inflight: int = 0) -> None:
+        self._cond = threading.Condition()
+        # 优先级 -> 会话 -> 该会话的排队请求；会话按轮转顺序排列
+        self._queues: Dict[str, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in PRIORITIES}
+        # 重试排在所有新请求前面：它们占着并发名额，排在因名额已满而等待的请求后面会互相卡死
+        self._retrying: Deque[_Waiter] = deque()
+        self._rpm: Optional[TokenBucket] = None
+        self._tpm: Optional[TokenBucket] = None
+        self._max_inflight = 0
+        self._inflight = 0
+        self._waits: Deque[float] = deque(maxlen=_WAIT_SAMPLES)
+        self._granted = 0
+        self._retries = 0
+        self._waited_s = 0.0
+        # 上游要求退避（Retry-After）：此前不放行任何请求
+        self._hold_until = 0.0
+        self.flights = SingleFlight()
+        self.configure(rpm=rpm, tpm=tpm, max_inflight=max_inflight)
+
+    def configure(
+        self,
+        *,
+        rpm: Optional[float] = None,
+        tpm: Optional[float] = None,
+        max_inflight: Optional[int] = None,
+    ) -> None:
+        """Change limits at runtime (None = keep, 0 = unlimited); queued requests re-check at once."""
+        with self._cond:
+            if rpm is not None:
+                self._rpm = TokenBucket(rpm) if rpm > 0 else None
+            if tpm is not None:
+                self._tpm = TokenBucket(tpm) if tpm > 0 else None
+            if max_inflight is not None:
+                self._max_inflight = max(0, int(max_inflight))
+            self._cond.notify_all()
+
+    def _head(self) -> Optional[_Waiter]:
+        if self._retrying:
+            return self._retrying[0]
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            if queue:
+                return next(iter(queue.values()))[0]
+        return None
+
+    def _ready_in(self, waiter: _Waiter) -> float:
+        if not waiter.retry and self._max_inflight and self._inflight >= self._max_inflight:
+            return math.inf
+        now = time.monotonic()
+        delay = max(0.0, self._hold_until - now)
+        if self._rpm is not None:
+            delay = max(delay, self._rpm.wait_s(1, now))
+        if self._tpm is not None:
+            delay = max(delay, self._tpm.wait_s(waiter.tokens, now))
+        return delay
+
+    def _remove(self, waiter: _Waiter) -> None:
+        if waiter.retry:
+            self._retrying.remove(waiter)
+            return
+        queue = self._queues[waiter.lane.priority]
+        waiting = queue.pop(waiter.lane.session)
+        waiting.remove(waiter)
+        if waiting:
+            # 放到队尾：同一优先级内下一个轮到别的会话
+            queue[waiter.lane.session] = waiting
+
+    def acquire(self, lane: Lane, tokens: int, *, retry: bool = False) -> float:
+        """
+        Block until the request may go upstream; returns the seconds spent waiting.
+        retry=True re-admits a request that already holds a slot: it queues like any other and
+        takes one request from the RPM bucket (ahead of new requests), while its token estimate stays reserved from the
+        first attempt (settled once in release()).
+        """
+        waiter = _Waiter(lane=lane, tokens=0 if retry else max(0, tokens), retry=retry)
+        with self._cond:
+            if retry:
+                self._retrying.append(waiter)
+            else:
+                self._queues[lane.priority].setdefault(lane.session, deque()).append(waiter)
+            self._cond.notify_all()
+            try:
+                while True:
+                    if self._head() is waiter:
+                        delay = self._ready_in(waiter)
+                        if delay <= 0:
+                            break
+                        self._cond.wait(None if delay == math.inf else delay)
+                    else:
+                        self._cond.wait()
+            finally:
+                self._remove(waiter)
+                self._cond.notify_all()
+            if self._rpm is not None:
+                self._rpm.take(1)
+            waited = time.monotonic() - waiter.enqueued
+            if retry:
+                self._retries += 1
+                return waited
+            if self._tpm is not None:
+                self._tpm.take(waiter.tokens)
+            self._inflight += 1
+            self._granted += 1
+            self._waited_s += waited
+            self._waits.append(waited)
+            return waited
+
+    def promote(self, session: str, priority: str = PRIORITIES[0]) -> int:
+        """Move the session's queued requests of other priorities to `priority`; returns how many moved."""
+        moved = 0
+        with self._cond:
+            for other in PRIORITIES:
+                if other == priority:
+                    continue
+                waiting = self._queues[other].pop(session, None)
+                if not waiting:
+                    continue
+                for waiter in waiting:
+                    waiter.lane = Lane(session=session, priority=priority)
+                self._queues[priority].setdefault(session, deque()).extend(waiting)
+                moved += len(waiting)
+            if moved:
+                self._cond.notify_all()
+        return moved
+
+    def hold(self, seconds: float) -> None:
+        """Admit nothing for `seconds` (upstream Retry-After): every queued request backs off, not just the one that got it."""
+        with self._cond:
+            self._hold_until = max(self._hold_until, time.monotonic() + max(0.0, seconds))
+            self._cond.notify_all()
+
+    def release(self, estimated_tokens: int, used_tokens: Optional[int] = None) -> None:
+        """Free the slot; with the actual usage, return (or charge) the difference to the token bucket."""
+        with self._cond:
+            self._inflight = max(0, self._inflight - 1)
+            if self._tpm is not None and used_tokens is not None:
+                self._tpm.give(min(estimated_tokens, self._tpm.capacity) - used_tokens)
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        with self._cond:
+            depth = {p: sum(len(w) for w in q.values()) for p, q in self._queues.items()}
+            waiting = [w for q in self._queues.values() for ws in q.values() for w in ws] + list(self._retrying)
+            waits = sorted(self._waits)
+            for bucket in (self._rpm, self._tpm):
+                if bucket is not None:
+                    bucket._refill(now)
+            snap: Dict[str, Any] = {
+                "rpm": self._rpm.capacity if self._rpm else 0,
+                "tpm": self._tpm.capacity if self._tpm else 0,
+                "max_inflight": self._max_inflight,
+                "inflight": self._inflight,
+                "queue_depth": len(waiting),
+                "queue_by_priority": depth,
+                "waiting_sessions": len({(w.lane.priority, w.lane.session) for w in waiting}),
+                "oldest_wait_s": round(max((now - w.enqueued for w in waiting), default=0.0), 3),
+                "granted": self._granted,
+                "retries": self._retries,
+                "hold_s": round(max(0.0, self._hold_until - now), 3),
+                "wait_total_s": round(self._waited_s, 3),
+                "wait_avg_s": round(self._waited_s / self._granted, 3) if self._granted else 0.0,
+                "wait_p95_s": round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+                "wait_max_s": round(waits[-1], 3) if waits else 0.0,
+                "rpm_available": round(self._rpm.level, 1) if self._rpm else None,
+                "tpm_available": round(self._tpm.level) if self._tpm else None,
+            }
+        snap.update(self.flights.stats())
+        return snap
+
+    def prometheus(self) -> str:
+        snap = self.stats()
+        out = [
+            "# HELP podcastsop_llm_queue_depth Upstream requests waiting for the rate governor.",
+            "# TYPE podcastsop_llm_queue_depth gauge",
+        ]
+        for priority, depth in snap["queue_by_priority"].items():
+            out.append(f'podcastsop_llm_queue_depth{{priority="{priority}"}} {depth}')
+        out += [
+            "# HELP podcastsop_llm_inflight Upstream requests in flight.",
+            "# TYPE podcastsop_llm_inflight gauge",
+            f"podcastsop_llm_inflight {snap['inflight']}",
+            "# HELP podcastsop_llm_queue_wait_seconds_total Time requests spent waiting for the governor.",
+            "# TYPE podcastsop_llm_queue_wait_seconds_total counter",
+            f"podcastsop_llm_queue_wait_seconds_total {snap['wait_total_s']}",
+            "# HELP podcastsop_llm_admitted_total Requests admitted by the governor.",
+            "# TYPE podcastsop_llm_admitted_total counter",
+            f"podcastsop_llm_admitted_total {snap['granted']}",
+            "# HELP podcastsop_llm_retries_total Upstream retries re-admitted by the governor.",
+            "# TYPE podcastsop_llm_retries_total counter",
+            f"podcastsop_llm_retries_total {snap['retries']}",
+            "# HELP podcastsop_llm_queue_wait_p95_seconds p95 wait over recent requests.",
+            "# TYPE podcastsop_llm_queue_wait_p95_seconds gauge",
+            f"podcastsop_llm_queue_wait_p95_seconds {snap['wait_p95_s']}",
+            "# HELP podcastsop_llm_coalesced_total Requests served by an identical in-flight request.",
+            "# TYPE podcastsop_llm_coalesced_total counter",
+            f"podcastsop_llm_coalesced_total {snap['coalesced']}",
+        ]
+        return "\n".join(out) + "\n"
+
+
+class _Flight:
+    def __init__(self, source: Optional[Iterator[str]]) -> None:
+        self.parts: List[str] = []
+        self.source = source
+        # 有人正在向上游取下一段（非流式的发起者从头到尾都算）
+        self.pumping = source is None
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.refs = 1
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight requests (same request key): the first caller goes upstream,
+    later callers attach and receive the same deltas / text. A streamed response is pulled by
+    whichever consumer is furthest ahead, so any of them leaving (cancel) does not stall the others;
+    the upstream stream is closed only when the last consumer leaves.
+    """
+
+    def __init__(self) -> None:
+        self._cond = threading.Condition()
+        self._flights: Dict[str, _Flight] = {}
+        self._coalesced = 0
+
+    def _join(self, key: str, source: Optional[Callable[[], Iterator[str]]]) -> Tuple[_Flight, bool]:
+        with self._cond:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.refs += 1
+                self._coalesced += 1
+                return flight, False
+            # 流式生成器在这里只创建不启动，第一次 next() 才真正发请求
+            flight = _Flight(source() if source is not None else None)
+            self._flights[key] = flight
+            return flight, True
+
+    def _finish(self, key: str, flight: _Flight, error: Optional[BaseException] = None) -> None:
+        # 调用方持有 self._cond
+        flight.done = True
+        flight.pumping = False
+        flight.error = error
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        self._cond.notify_all()
+
+    def call(self, key: str, fn: Callable[[], str]) -> Tuple[str, bool]:
+        """Run fn() once per key at a time; returns (text, went_upstream)."""
+        flight, leader = self._join(key, None)
+        if not leader:
+            return "".join(self._follow(key, flight)), False
+        try:
+            text = fn()
+        except BaseException as e:
+            with self._cond:
+                flight.refs -= 1
+                self._finish(key, flight, e)
+            raise
+        with self._cond:
+            flight.parts.append(text)
+            flight.refs -= 1
+            self._finish(key, flight)
+        return text, True
+
+    def stream(self, key: str, source: Callable[[], Iterator[str]]) -> Tuple[Iterator[str], bool]:
+        """Shared delta stream for key; source() opens the upstream stream if nobody has. Returns (deltas, went_upstream)."""
+        flight, leader = self._join(key, source)
+        return self._follow(key, flight), leader
+
+    def _follow(self, key: str, flight: _Flight) -> Iterator[str]:
+        i = 0
+        try:
+            while True:
+                with self._cond:
+                    while i >= len(flight.parts) and not flight.done and flight.pumping:
+                        self._cond.wait()
+                    if i < len(flight.parts):
+                        delta: Optional[str] = flight.parts[i]
+                        i += 1
+                    elif flight.done:
+                        if flight.error is not None:
+                            raise flight.error
+                        return
+                    else:
+                        delta = None
+                        flight.pumping = True
+                if delta is not None:
+                    yield delta
+                    continue
+                assert flight.source is not None
+                try:
+                    nxt = next(flight.source, None)
+                except BaseException as e:
+                    with self._cond:
+                        self._finish(key, flight, e)
+                    raise
+                with self._cond:
+                    if nxt is None:
+                        self._finish(key, flight)
+                    else:
+                        flight.parts.append(nxt)
+                        flight.pumping = False
+                        self._cond.notify_all()
+        finally:
+            with self._cond:
+                flight.refs -= 1
+                abandoned = flight.refs == 0 and not flight.done
+                if abandoned:
+                    self._finish(key, flight, RuntimeError("Shared request abandoned"))
+            if abandoned and flight.source is not None:
+                # 最后一个消费者离开：关闭上游流，释放连接和并发名额
+                flight.source.close()  # type: ignore[attr-defined]
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "flights": len(self._flights),
+                "flight_waiters": sum(f.refs - 1 for f in self._flights.values() if f.refs > 1),
+                "coalesced": self._coalesced,
+            }
+
+
+_GOVERNOR: Optional[Governor] = None
+_GOVERNOR_LOCK = threading.Lock()
+
+
+def get_governor() -> Governor:
+    """Process-wide governor; limits from env LLM_RPM, LLM_TPM, LLM_MAX_INFLIGHT (0/unset = unlimited)."""
+    global _GOVERNOR
+    with _GOVERNOR_LOCK:
+        if _GOVERNOR is None:
+            _GOVERNOR = Governor(
+                rpm=_env_number("LLM_RPM"),
+                tpm=_env_number("LLM_TPM"),
+                max_inflight=int(_env_number("LLM_MAX_INFLIGHT")),
+            )
+        return _GOVERNOR
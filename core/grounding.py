@@ -0,0 +1,207 @@
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Optional, Tuple
+
+# 字符 n-gram：中文 4 字足以区分表述，英文去空格后同样按字符切
+NGRAM = 4
+# 低于该覆盖率的句子视为原文无依据；A/B 基本逐句保留原文，C/E 允许改写
+SUPPORT_THRESHOLD = {"A": 0.6, "B": 0.6, "C": 0.4, "E": 0.4}
+# 金句允许轻微润色，但绝大部分表达要能在原文找到
+QUOTE_THRESHOLD = 0.8
+# 太短的句子（标题、称呼、过渡语）不参与判断
+MIN_SENTENCE_CHARS = 8
+
+_SENT_RE = re.compile(r"[^。！？!?；;\n]+[。！？!?；;]*")
+_QUOTE_RE = re.compile(r"[“「『\"]([^”」』\"\n]{4,300})[”」』\"]")
+_SECTION_RE = re.compile(r"^\s*(?:#+|\d+[.、)）]|[一二三四五六七八九十]+[、.])")
+_GOLDEN_HEADING_RE = re.compile(r"金句(?:\s*[（(][^）)]*[)）])?\s*[：:]?\s*$")
+_OTHER_SECTIONS = ("标题", "问题", "卡片", "摘要", "导语", "LinkedIn")
+# 结构性行（模块标题、小标题、本章总结等）不是原文内容，跳过
+_STRUCTURAL_RE = re.compile(r"^\s*(?:《.*》|#+.*|【.*】|.{0,20}[：:]\s*)$")
+
+_INDEX_CACHE_SIZE = 4
+_REPORT_CACHE_SIZE = 64
+
+
+def normalize(text: str) -> str:
+    """Letters, digits and CJK only, lowercased: punctuation, spacing and line breaks never affect matching."""
+    return "".join(ch for ch in text.lower() if ch.isalnum())
+
+
+@dataclass
+class SourceIndex:
+    """Normalized transcript plus the set of its character n-grams, built once per transcript."""
+
+    text: str
+    grams: FrozenSet[str]
+
+    @classmethod
+    def build(cls, source: str) -> "SourceIndex":
+        norm = normalize(source)
+        return cls(text=norm, grams=frozenset(norm[i : i + NGRAM] for i in range(len(norm) - NGRAM + 1)))
+
+    def coverage(self, fragment: str) -> float:
+        """Share of the fragment's n-grams that occur in the source (1.0 = every 4-char run appears)."""
+        norm = normalize(fragment)
+        if len(norm) < NGRAM:
+            return 1.0 if norm in self.text else 0.0
+        total = len(norm) - NGRAM + 1
+        grams = self.grams
+        hit = sum(1 for i in range(total) if norm[i : i + NGRAM] in grams)
+        return hit / total
+
+    def contains(self, fragment: str) -> bool:
+        norm = normalize(fragment)
+        return bool(norm) and norm in self.text
+
+
+@dataclass(frozen=True)
+class SentenceScore:
+    start: int
+    end: int
+    text: str
+    coverage: float
+
+
+@dataclass(frozen=True)
+class QuoteScore:
+    start: int
+    end: int
+    text: str
+    verbatim: bool
+    coverage: float
+
+
+@dataclass
+class GroundingReport:
+    module: str
+    unsupported: List[SentenceScore] = field(default_factory=list)
+    quotes: List[QuoteScore] = field(default_factory=list)
+    checked_sentences: int = 0
+    seconds: float = 0.0
+
+    @property
+    def bad_quotes(self) -> List[QuoteScore]:
+        return [q for q in self.quotes if not q.verbatim and q.coverage < QUOTE_THRESHOLD]
+
+    @property
+    def ok(self) -> bool:
+        return not self.unsupported and not self.bad_quotes
+
+    def summary(self) -> str:
+        parts = []
+        if self.unsupported:
+            parts.append(f"{len(self.unsupported)}/{self.checked_sentences} 句在原文中找不到依据")
+        if self.bad_quotes:
+            parts.append(f"{len(self.bad_quotes)} 处引语/金句不是原话")
+        return "；".join(parts)
+
+
+def extract_golden_quotes(text: str) -> List[Tuple[int, int]]:
+    """Spans of the list items under a 金句 heading (module D), up to the next section."""
+    spans: List[Tuple[int, int]] = []
+    in_section = False
+    pos = 0
+    for line in text.splitlines(keepends=True):
+        start, pos = pos, pos + len(line)
+        stripped = line.strip()
+        if len(stripped) <= 20 and _GOLDEN_HEADING_RE.search(stripped):
+            in_section = True
+            continue
+        if not in_section or not stripped:
+            continue
+        if not _SECTION_RE.match(stripped) and not stripped.startswith(("-", "*", "•", "“", "「", '"')):
+            in_section = False
+            continue
+        if _SECTION_RE.match(stripped) and any(k in stripped for k in _OTHER_SECTIONS):
+            in_section = False
+            continue
+        # 去掉序号/项目符号后的正文
+        body = re.sub(r"^\s*(?:\d+[.、)）]|[-*•])\s*", "", line.rstrip("\n"))
+        offset = start + line.index(body) if body and body in line else start
+        spans.append((offset, offset + len(body)))
+    return spans
+
+
+def _check(index: SourceIndex, module: str, output: str) -> GroundingReport:
+    started = time.perf_counter()
+    report = GroundingReport(module=module)
+    threshold = SUPPORT_THRESHOLD.get(module)
+
+    if threshold is not None:
+        for m in _SENT_RE.finditer(output):
+            sentence = m.group(0)
+            if _STRUCTURAL_RE.match(sentence) or len(normalize(sentence)) < MIN_SENTENCE_CHARS:
+                continue
+            report.checked_sentences += 1
+            cov = index.coverage(sentence)
+            if cov < threshold:
+                report.unsupported.append(SentenceScore(m.start(), m.end(), sentence.strip(), round(cov, 2)))
+
+    quote_spans = [(m.start(1), m.end(1)) for m in _QUOTE_RE.finditer(output)]
+    if module == "D":
+        quote_spans += extract_golden_quotes(output)
+    seen = set()
+    for start, end in sorted(quote_spans):
+        body = output[start:end].strip().strip("“”「」『』\"")
+        if len(normalize(body)) < NGRAM or body in seen:
+            continue
+        seen.add(body)
+        verbatim = index.contains(body)
+        report.quotes.append(
+            QuoteScore(start, end, body, verbatim, 1.0 if verbatim else round(index.coverage(body), 2))
+        )
+
+    report.seconds = round(time.perf_counter() - started, 4)
+    return report
+
+
+_INDEXES: "OrderedDict[str, SourceIndex]" = OrderedDict()
+_REPORTS: "OrderedDict[Tuple[str, str, str], GroundingReport]" = OrderedDict()
+_LOCK = threading.Lock()
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_index(source: str, source_hash: Optional[str] = None) -> SourceIndex:
+    """Index for a transcript, built once and shared by every check against it."""
+    key = source_hash or _digest(source)
+    with _LOCK:
+        idx = _INDEXES.get(key)
+        if idx is not None:
+            _INDEXES.move_to_end(key)
+            return idx
+    idx = SourceIndex.build(source)
+    with _LOCK:
+        _INDEXES[key] = idx
+        while len(_INDEXES) > _INDEX_CACHE_SIZE:
+            _INDEXES.popitem(last=False)
+    return idx
+
+
+def check_grounding(source: str, module: str, output: str) -> GroundingReport:
+    """
+    Score every sentence of a module output against the transcript and verify quotes / 金句.
+    Reports are cached by (transcript hash, module, output hash), i.e. once per saved version.
+    """
+    source_hash = _digest(source)
+    key = (source_hash, module, _digest(output))
+    with _LOCK:
+        hit = _REPORTS.get(key)
+        if hit is not None:
+            _REPORTS.move_to_end(key)
+            return hit
+    report = _check(source_index(source, source_hash), module, output)
+    with _LOCK:
+        _REPORTS[key] = report
+        while len(_REPORTS) > _REPORT_CACHE_SIZE:
+            _REPORTS.popitem(last=False)
+    return report
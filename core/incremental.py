@@ -0,0 +1,137 @@
+from __future__ import annotations
+
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.chunking import merge_chunk_outputs, split_units
+from core.metrics import RunMetrics
+from core.project_state import Project, SegmentRecord, mark_generated, source_text
+from core.run_module import ProgressCallback, post_check, run_module
+from core.tokens import estimate_tokens
+
+# 内容定义分段：某个发言的哈希命中锚点即可断段，改动一处只影响所在段（最多波及下一段），之后自动重新对齐
+_ANCHOR_MOD = 4
+
+
+def _digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def segment_transcript(text: str, *, max_tokens: int = 1500, min_tokens: int = 300) -> List[str]:
+    """
+    Split a transcript into stable segments of whole speaker turns.
+    Boundaries are content-defined (turn hash anchors, bounded by min/max tokens),
+    so editing one turn does not shift every later segment.
+    """
+    segments: List[str] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    for unit in split_units(text, max_tokens):
+        t = estimate_tokens(unit)
+        if cur and cur_tokens + t > max_tokens:
+            segments.append("\n".join(cur))
+            cur, cur_tokens = [], 0
+        cur.append(unit)
+        cur_tokens += t
+        if cur_tokens >= min_tokens and int(_digest(unit)[:8], 16) % _ANCHOR_MOD == 0:
+            segments.append("\n".join(cur))
+            cur, cur_tokens = [], 0
+    if cur:
+        segments.append("\n".join(cur))
+    return segments
+
+
+def _settings_fingerprint(settings: Dict[str, Any]) -> str:
+    # 模型或参数变了，旧段落输出不能复用
+    keys = ("model_provider", "model_name", "temperature", "max_tokens")
+    return "|".join(str(settings.get(k)) for k in keys)
+
+
+def segment_hash(segment: str, settings: Dict[str, Any]) -> str:
+    return _digest(_settings_fingerprint(settings) + "\n" + segment)[:16]
+
+
+def plan_incremental(project: Project, settings: Dict[str, Any]) -> Tuple[List[str], List[str], List[int]]:
+    """
+    Returns (segments, hashes, dirty_indices) for the current module-A input (source_text)
+    against the recorded module-A segment map.
+    """
+    segments = segment_transcript(
+        source_text(project),
+        max_tokens=int(settings.get("segment_tokens", 1500)),
+        min_tokens=int(settings.get("segment_min_tokens", 300)),
+    )
+    hashes = [segment_hash(seg, settings) for seg in segments]
+    known = {rec["hash"] for rec in project.get("a_segments", [])}
+    dirty = [i for i, h in enumerate(hashes) if h not in known]
+    return segments, hashes, dirty
+
+
+def run_module_a_incremental(
+    project: Project,
+    settings: Dict[str, Any],
+    *,
+    on_progress: Optional[ProgressCallback] = None,
+    use_cache: bool = True,
+    force: bool = False,
+) -> Dict[str, Any]:
+    """
+    Re-run module A only for transcript segments that changed since the last run and splice the
+    results back in order. force=True re-sends every segment (重新生成).
+    Writes project["A"]["current"] and the segment map; downstream modules become stale via source_hashes.
+    """
+    segments, hashes, dirty = plan_incremental(project, settings)
+    if force:
+        dirty = list(range(len(segments)))
+    known = {rec["hash"]: rec["output"] for rec in project.get("a_segments", [])}
+    outputs: List[str] = [known.get(h, "") for h in hashes]
+
+    # 所有段落计入同一次模块A运行
+    metrics = RunMetrics.start("A", settings)
+    seg_settings = {**settings, "chunked": False}
+    total = len(dirty)
+    if on_progress:
+        on_progress(0, total)
+    if dirty:
+        workers = max(1, min(int(settings.get("chunk_workers", 4)), total))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment-A") as pool:
+            futures = {
+                pool.submit(
+                    run_module,
+                    module_name="A",
+                    input_text=segments[i],
+                    settings=seg_settings,
+                    use_cache=use_cache,
+                    metrics=metrics,
+                ): i
+                for i in dirty
+            }
+            done = 0
+            try:
+                for fut in as_completed(futures):
+                    outputs[futures[fut]] = fut.result()["text"]
+                    done += 1
+                    if on_progress:
+                        on_progress(done, total)
+            except BaseException:
+                for f in futures:
+                    f.cancel()
+                raise
+
+    text = merge_chunk_outputs(outputs, dedupe=False)
+    project["a_segments"] = [SegmentRecord(hash=h, output=o) for h, o in zip(hashes, outputs)]
+    project["A"]["current"] = text
+
+    with metrics.post_check_span():
+        ok, msg = post_check(text, settings.get("lang"))
+    run_metrics = metrics.finish()
+    mark_generated(project, "A", source_text(project), run_metrics)
+    return {
+        "text": text,
+        "post_check_ok": ok,
+        "post_check_msg": msg,
+        "segments": len(segments),
+        "dirty": total,
+        "metrics": run_metrics,
+    }
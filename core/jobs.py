@@ -0,0 +1,310 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.governor import PRIORITIES, get_governor
+from core.incremental import run_module_a_incremental
+from core.metrics import RunMetrics
+from core.project_state import Project, SegmentRecord, mark_generated
+from core.run_module import CHUNKABLE_MODULES, post_check, run_module, run_module_stream
+
+# queued -> running -> done / failed / cancelled
+FINISHED = ("done", "failed", "cancelled")
+# 已结束的任务保留多久（等会话下次渲染时取走结果；刷新页面后也能取到）
+JOB_RETENTION_S = 3600.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+@dataclass
+class Job:
+    """
+    One background module run. Workers append to `parts` / update `progress`; the session reads
+    them with snapshot() while polling and writes `result` into the project via apply_job().
+    """
+
+    id: str
+    project_id: str
+    module: str
+    module_input: str
+    settings: Dict[str, Any]
+    use_cache: bool = True
+    incremental: bool = False
+    # 预取任务：结果不自动写回，只在用户点击运行且输入未变时认领（见 core.prefetch）
+    speculative: bool = False
+    status: str = "queued"
+    # 分块/增量：(已完成块数, 总块数)
+    progress: Optional[Tuple[int, int]] = None
+    parts: List[str] = field(default_factory=list)
+    result: Optional[Dict[str, Any]] = None
+    error: str = ""
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+    applied: bool = False
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+    future: Optional[Future] = field(default=None, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def active(self) -> bool:
+        return self.status not in FINISHED
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "id": self.id,
+                "module": self.module,
+                "status": self.status,
+                "speculative": self.speculative,
+                "progress": self.progress,
+                "partial": "".join(self.parts),
+                "error": self.error,
+                "elapsed_s": (self.finished or time.time()) - self.created,
+                "cancel_requested": self.cancel_event.is_set(),
+            }
+
+    def _check_cancel(self) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+    def _on_progress(self, done: int, total: int) -> None:
+        # 在块之间检查取消：抛出后调用方会取消尚未开始的块
+        self._check_cancel()
+        with self._lock:
+            self.progress = (done, total)
+
+
+def _work_copy(project: Project, settings: Dict[str, Any]) -> Project:
+    # 增量模块A会改写项目里的分段记录和 A 的当前稿；在副本上运行，结果由会话线程写回
+    work = dict(project)
+    work["settings"] = settings
+    work["A"] = {"current": project["A"]["current"], "history": []}
+    work["a_segments"] = list(project.get("a_segments", []))
+    work["source_hashes"] = dict(project.get("source_hashes", {}))
+    work["run_metrics"] = dict(project.get("run_metrics", {}))
+    return work  # type: ignore[return-value]
+
+
+def _execute(job: Job, project: Optional[Project]) -> Dict[str, Any]:
+    settings = job.settings
+    if job.incremental and project is not None:
+        result = run_module_a_incremental(
+            project,
+            settings,
+            on_progress=job._on_progress,
+            use_cache=job.use_cache,
+            force=not job.use_cache,
+        )
+        result["a_segments"] = project["a_segments"]
+        return result
+    if job.module in CHUNKABLE_MODULES and settings.get("chunked"):
+        return run_module(
+            module_name=job.module,
+            input_text=job.module_input,
+            settings=settings,
+            on_progress=job._on_progress,
+            use_cache=job.use_cache,
+        )
+    # 流式：增量写入 parts 供轮询显示；取消时关闭生成器，上游连接随之断开
+    metrics = RunMetrics.start(job.module, settings)
+    stream = run_module_stream(
+        module_name=job.module, input_text=job.module_input, settings=settings, use_cache=job.use_cache, metrics=metrics
+    )
+    try:
+        for delta in stream:
+            job._check_cancel()
+            with job._lock:
+                job.parts.append(delta)
+    finally:
+        stream.close()
+    text = "".join(job.parts)
+    with metrics.post_check_span():
+        ok, msg = post_check(text, settings.get("lang"))
+    return {"text": text, "post_check_ok": ok, "post_check_msg": msg, "metrics": metrics.finish()}
+
+
+class JobManager:
+    """
+    Process-wide worker pool for module runs. Jobs outlive the Streamlit script run that submitted
+    them (reruns, tab switches, page refreshes) and are looked up by project id.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None) -> None:
+        workers = max_workers or int(os.getenv("PODCASTSOP_JOB_WORKERS", "4") or 4)
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="job")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        project: Project,
+        module: str,
+        module_input: str,
+        *,
+        use_cache: bool = True,
+        speculative: bool = False,
+    ) -> Job:
+        """
+        Queue a run of `module` on `module_input` with a copy of the project's current settings.
+        Raises ValueError if the project already has an active job for this module (for a
+        speculative job: any active job, speculative or not).
+        """
+        project_id = project["meta"].get("project_id") or ""
+        # lang 决定后置校验用哪种语言的规则
+        settings = dict(project["settings"], session_key=project_id, lang=project["meta"].get("lang"))
+        if speculative:
+            # 预取的请求在限流队列里让行给用户真正发起的请求
+            settings["priority"] = "batch"
+        incremental = module == "A" and bool(settings.get("incremental")) and not speculative
+        with self._lock:
+            self._prune()
+            if self._active(project_id, module, include_speculative=speculative) is not None:
+                raise ValueError(f"Module {module} already has a running job")
+            job = Job(
+                id=uuid.uuid4().hex[:12],
+                project_id=project_id,
+                module=module,
+                module_input=module_input,
+                settings=settings,
+                use_cache=use_cache,
+                incremental=incremental,
+                speculative=speculative,
+            )
+            self._jobs[job.id] = job
+        work = _work_copy(project, settings) if incremental else None
+        job.future = self._pool.submit(self._run, job, work)
+        return job
+
+    def _run(self, job: Job, project: Optional[Project]) -> None:
+        try:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            with job._lock:
+                job.status = "running"
+            result = _execute(job, project)
+            with job._lock:
+                job.result = result
+                job.status = "done"
+        except JobCancelled:
+            with job._lock:
+                job.status = "cancelled"
+        except Exception as e:
+            with job._lock:
+                job.error = str(e)
+                job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> bool:
+        """Request cancellation; a queued job never starts, a running one stops at its next delta or chunk."""
+        job = self.get(job_id)
+        if job is None or not job.active:
+            return False
+        job.cancel_event.set()
+        return True
+
+    def _active(self, project_id: str, module: str, *, include_speculative: bool = False) -> Optional[Job]:
+        for job in self._jobs.values():
+            if job.project_id == project_id and job.module == module and job.active:
+                if include_speculative or not job.speculative:
+                    return job
+        return None
+
+    def active(self, project_id: str, module: str) -> Optional[Job]:
+        with self._lock:
+            return self._active(project_id, module)
+
+    def for_project(self, project_id: str) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if job.project_id == project_id]
+
+    def speculative(self, project_id: str) -> List[Job]:
+        """Unclaimed speculative jobs of a project, running or finished."""
+        with self._lock:
+            return [j for j in self._jobs.values() if j.project_id == project_id and j.speculative and not j.applied]
+
+    def claim(self, job: Job) -> bool:
+        """
+        Turn a speculative job into a regular one. A finished job is marked applied (the caller
+        applies it right away); a running one becomes the module's active job and is applied when it
+        finishes. False if it was already claimed or discarded.
+        A running job's remaining requests, including those already queued in the rate governor,
+        go back to interactive priority.
+        """
+        with self._lock:
+            if not job.speculative or job.applied or job.cancel_event.is_set():
+                return False
+            job.speculative = False
+            job.applied = not job.active
+            running = job.active
+            # 用户已经在等这个结果：后续请求（分块等）按交互优先级排队
+            job.settings["priority"] = PRIORITIES[0]
+        if running:
+            get_governor().promote(job.project_id)
+        return True
+
+    def discard(self, job: Job) -> bool:
+        """Drop an unclaimed speculative job, cancelling it if it is still queued or running."""
+        with self._lock:
+            if not job.speculative or job.applied:
+                return False
+            job.applied = True
+            job.cancel_event.set()
+            return True
+
+    def take_finished(self, project_id: str) -> List[Job]:
+        """Finished regular jobs of a project whose result has not been applied yet; marks them applied."""
+        with self._lock:
+            out = [
+                j
+                for j in self._jobs.values()
+                if j.project_id == project_id and not j.active and not j.applied and not j.speculative
+            ]
+            for job in out:
+                job.applied = True
+            return out
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RETENTION_S
+        for job_id in [j.id for j in self._jobs.values() if j.finished is not None and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+
+def apply_job(project: Project, job: Job) -> bool:
+    """
+    Write a finished job's output into the project (current text, input hash, run metrics and,
+    for incremental module A, the segment map). Returns False when there is nothing to apply.
+    """
+    if job.status != "done" or job.result is None:
+        return False
+    result = job.result
+    project[job.module]["current"] = result["text"]
+    if "a_segments" in result:
+        project["a_segments"] = [SegmentRecord(hash=r["hash"], output=r["output"]) for r in result["a_segments"]]
+    mark_generated(project, job.module, job.module_input, result.get("metrics"))
+    return True
+
+
+_JOBS: Optional[JobManager] = None
+_JOBS_LOCK = threading.Lock()
+
+
+def get_jobs() -> JobManager:
+    global _JOBS
+    with _JOBS_LOCK:
+        if _JOBS is None:
+            _JOBS = JobManager()
+        return _JOBS
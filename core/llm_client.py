@@ -1,32 +1,223 @@
 from __future__ import annotations
 
+import json
 import os
-from typing import Any, Dict, List, Optional
+import random
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Any, Dict, Iterator, List, Optional
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from core.governor import Lane, get_governor
+from core.tokens import estimate_tokens
 
 
 class LLMError(RuntimeError):
     pass
 
 
-class DeepSeekClient:
+# 可重试的状态码：限流 + 网关/服务端临时错误
+RETRY_STATUS = frozenset({408, 409, 429, 500, 502, 503, 504})
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return default
+
+
+def _retry_after_s(resp: requests.Response) -> Optional[float]:
+    value = (resp.headers.get("Retry-After") or "").strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+@dataclass
+class CallStats:
     """
-    Minimal DeepSeek Chat Completions client.
-    Expects env var: DEEPSEEK_API_KEY
+    Timings and usage of one upstream request, filled in by chat() / chat_stream() when passed.
+
+    queue_s: waiting in the rate governor (core.governor); network_s: request sent → response headers
+    (for non-streaming calls this includes the server-side generation); generation_s: headers → last byte.
+    """
+
+    provider: str = ""
+    queue_s: float = 0.0
+    network_s: float = 0.0
+    generation_s: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+    def add_usage(self, usage: Optional[Dict[str, Any]]) -> None:
+        if not usage:
+            return
+        self.prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        self.completion_tokens = int(usage.get("completion_tokens") or 0)
+        # DeepSeek: prompt_cache_hit_tokens；OpenAI 兼容：prompt_tokens_details.cached_tokens
+        details = usage.get("prompt_tokens_details") or {}
+        self.cached_tokens = int(usage.get("prompt_cache_hit_tokens") or details.get("cached_tokens") or 0)
+
+
+def set_max_inflight(limit: Optional[int]) -> None:
+    """
+    Cap concurrent upstream requests for the whole process (None/0 = unlimited).
+    Env default: LLM_MAX_INFLIGHT. Requests per / tokens per minute: LLM_RPM / LLM_TPM (core.governor).
+    """
+    get_governor().configure(max_inflight=limit or 0)
+
+
+def _request_tokens(messages: List[Dict[str, str]], max_tokens: int) -> int:
+    # 限流按“输入估算 + 输出上限”预扣，请求结束后按实际用量多退少补
+    return sum(estimate_tokens(m.get("content") or "") for m in messages) + max_tokens
+
+
+@contextmanager
+def _inflight_slot(
+    stats: Optional[CallStats] = None, lane: Optional[Lane] = None, tokens: int = 0
+) -> Iterator[None]:
+    governor = get_governor()
+    waited = governor.acquire(lane or Lane(), tokens)
+    if stats is not None:
+        stats.queue_s += waited
+    try:
+        yield
+    finally:
+        used = stats.prompt_tokens + stats.completion_tokens if stats is not None and stats.prompt_tokens else None
+        governor.release(tokens, used)
+
+
+class ChatClient:
+    """
+    Minimal client for an OpenAI-compatible Chat Completions endpoint (DeepSeek, OpenAI, Qwen, local servers).
+
+    Holds one pooled keep-alive requests.Session; safe to share across threads and Streamlit sessions.
+    Tunables (env): LLM_POOL_SIZE, LLM_MAX_RETRIES, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT,
+    LLM_BACKOFF_BASE, LLM_BACKOFF_MAX.
     """
 
     def __init__(
         self,
-        api_key: Optional[str] = None,
-        base_url: str = "https://api.deepseek.com",
-        timeout_s: int = 120,
+        *,
+        name: str,
+        base_url: str,
+        api_key: str = "",
+        path: str = "/chat/completions",
+        timeout_s: Optional[float] = None,
+        connect_timeout_s: Optional[float] = None,
+        pool_size: Optional[int] = None,
+        max_retries: Optional[int] = None,
+        backoff_base_s: Optional[float] = None,
+        backoff_max_s: Optional[float] = None,
     ) -> None:
-        self.api_key = api_key or os.getenv("DEEPSEEK_API_KEY", "")
-        if not self.api_key:
-            raise LLMError("Missing DEEPSEEK_API_KEY")
+        self.name = name
+        self.api_key = api_key
         self.base_url = base_url.rstrip("/")
-        self.timeout_s = timeout_s
+        self.url = self.base_url + path
+        # timeout_s 是读超时（两次收包之间的最长等待），连接超时单独设置
+        self.timeout_s = timeout_s if timeout_s is not None else _env_float("LLM_READ_TIMEOUT", 120.0)
+        self.connect_timeout_s = (
+            connect_timeout_s if connect_timeout_s is not None else _env_float("LLM_CONNECT_TIMEOUT", 10.0)
+        )
+        self.max_retries = max_retries if max_retries is not None else _env_int("LLM_MAX_RETRIES", 3)
+        self.backoff_base_s = backoff_base_s if backoff_base_s is not None else _env_float("LLM_BACKOFF_BASE", 1.0)
+        self.backoff_max_s = backoff_max_s if backoff_max_s is not None else _env_float("LLM_BACKOFF_MAX", 30.0)
+
+        pool = pool_size if pool_size is not None else _env_int("LLM_POOL_SIZE", 16)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool, pool_maxsize=pool, pool_block=False)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(self._headers())
+
+    def _backoff_s(self, attempt: int, retry_after: Optional[float]) -> float:
+        # full jitter：在 [0, base*2^attempt] 内随机，避免多会话同时重试；服务端给了 Retry-After 则至少等这么久
+        delay = random.uniform(0, min(self.backoff_max_s, self.backoff_base_s * (2**attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max_s * 2))
+        return delay
+
+    def _retry_wait(self, delay: float, lane: Optional[Lane], stats: Optional[CallStats]) -> None:
+        time.sleep(delay)
+        # 重试同样要过限流：计入每分钟请求数，并遵守其他请求收到的 Retry-After
+        waited = get_governor().acquire(lane or Lane(), 0, retry=True)
+        if stats is not None:
+            stats.queue_s += waited
+
+    def _post(
+        self,
+        payload: Dict[str, Any],
+        *,
+        stream: bool = False,
+        lane: Optional[Lane] = None,
+        stats: Optional[CallStats] = None,
+    ) -> requests.Response:
+        """POST with retries; call inside _inflight_slot(). Each retry is re-admitted by the governor."""
+        url = self.url
+        attempt = 0
+        while True:
+            try:
+                resp = self.session.post(
+                    url,
+                    json=payload,
+                    timeout=(self.connect_timeout_s, self.timeout_s),
+                    stream=stream,
+                )
+            except (requests.ConnectionError, requests.ConnectTimeout) as e:
+                if attempt >= self.max_retries:
+                    raise LLMError(f"{self.name} API connection failed after {attempt + 1} attempts: {e}") from e
+                self._retry_wait(self._backoff_s(attempt, None), lane, stats)
+                attempt += 1
+                continue
+            except requests.RequestException as e:
+                raise LLMError(f"{self.name} API request failed: {e}") from e
+
+            if resp.status_code in RETRY_STATUS and attempt < self.max_retries:
+                retry_after = _retry_after_s(resp)
+                delay = self._backoff_s(attempt, retry_after)
+                resp.close()
+                if retry_after is not None:
+                    # 上游限流针对整个账号：让排队中的所有请求一起退避，而不只是这一个
+                    get_governor().hold(min(retry_after, self.backoff_max_s * 2))
+                self._retry_wait(delay, lane, stats)
+                attempt += 1
+                continue
+            if resp.status_code >= 400:
+                text = resp.text
+                resp.close()
+                raise LLMError(f"{self.name} API error {resp.status_code}: {text}")
+            return resp
+
+    def _headers(self) -> Dict[str, str]:
+        headers = {"Content-Type": "application/json"}
+        # 本地服务通常不需要鉴权
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        return headers
 
     def chat(
         self,
@@ -35,31 +226,116 @@ class DeepSeekClient:
         messages: List[Dict[str, str]],
         temperature: float = 0.2,
         max_tokens: int = 4096,
+        stats: Optional[CallStats] = None,
+        lane: Optional[Lane] = None,
     ) -> str:
-        url = f"{self.base_url}/v1/chat/completions"
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json",
-        }
         payload: Dict[str, Any] = {
             "model": model,
             "messages": messages,
             "temperature": temperature,
             "max_tokens": max_tokens,
         }
-        resp = requests.post(url, headers=headers, json=payload, timeout=self.timeout_s)
-        if resp.status_code >= 400:
-            raise LLMError(f"DeepSeek API error {resp.status_code}: {resp.text}")
-        data = resp.json()
+        # 没传 stats 也要记下用量：限流器在释放名额时按实际 tokens 结算
+        stats = stats if stats is not None else CallStats()
+        with _inflight_slot(stats, lane, _request_tokens(messages, max_tokens)):
+            t0 = time.monotonic()
+            resp = self._post(payload, lane=lane, stats=stats)
+            t1 = time.monotonic()
+            data = resp.json()
+            stats.network_s += t1 - t0
+            stats.generation_s += time.monotonic() - t1
+            stats.add_usage(data.get("usage") if isinstance(data, dict) else None)
         try:
             return data["choices"][0]["message"]["content"]
         except Exception as e:
-            raise LLMError(f"Unexpected DeepSeek response shape: {data}") from e
+            raise LLMError(f"Unexpected {self.name} response shape: {data}") from e
+
+    def chat_stream(
+        self,
+        *,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.2,
+        max_tokens: int = 4096,
+        stats: Optional[CallStats] = None,
+        lane: Optional[Lane] = None,
+    ) -> Iterator[str]:
+        """
+        Streaming variant of chat(): yields content deltas as they arrive (SSE, `stream: true`).
+        Usage arrives in the final event (`stream_options.include_usage`).
+        """
+        payload: Dict[str, Any] = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "stream": True,
+            "stream_options": {"include_usage": True},
+        }
+        stats = stats if stats is not None else CallStats()
+        # 只在拿到首字节前重试；流开始后出错直接抛给调用方
+        with _inflight_slot(stats, lane, _request_tokens(messages, max_tokens)):
+            t0 = time.monotonic()
+            with self._post(payload, stream=True, lane=lane, stats=stats) as resp:
+                t1 = time.monotonic()
+                stats.network_s += t1 - t0
+                try:
+                    # SSE 规定 UTF-8；不能依赖 requests 按 text/* 默认猜的 latin-1
+                    yield from _iter_sse_deltas(
+                        (line.decode("utf-8", errors="replace") for line in resp.iter_lines()), stats
+                    )
+                finally:
+                    stats.generation_s += time.monotonic() - t1
 
 
-def get_client(provider: str) -> DeepSeekClient:
-    provider_norm = (provider or "").strip().lower()
-    if provider_norm in ("deepseek", "ds"):
-        return DeepSeekClient()
-    raise LLMError(f"Unsupported provider: {provider}")
+class DeepSeekClient(ChatClient):
+    """
+    DeepSeek Chat Completions client.
+    Expects env var: DEEPSEEK_API_KEY
+    """
+
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        base_url: str = "https://api.deepseek.com",
+        timeout_s: Optional[float] = None,
+        **kwargs: Any,
+    ) -> None:
+        key = api_key or os.getenv("DEEPSEEK_API_KEY", "")
+        if not key:
+            raise LLMError("Missing DEEPSEEK_API_KEY")
+        super().__init__(
+            name="DeepSeek", base_url=base_url, api_key=key, path="/v1/chat/completions", timeout_s=timeout_s, **kwargs
+        )
+
+
+def _iter_sse_deltas(lines: Iterator[str], stats: Optional[CallStats] = None) -> Iterator[str]:
+    for line in lines:
+        if not line or not line.startswith("data:"):
+            # 空行是事件分隔符，": keep-alive" 之类的注释行直接跳过
+            continue
+        data = line[len("data:"):].strip()
+        if data == "[DONE]":
+            return
+        try:
+            chunk = json.loads(data)
+        except ValueError as e:
+            raise LLMError(f"Malformed stream event: {data[:200]}") from e
+        if "error" in chunk:
+            raise LLMError(f"Stream error: {chunk['error']}")
+        if stats is not None and chunk.get("usage"):
+            stats.add_usage(chunk["usage"])
+        for choice in chunk.get("choices") or []:
+            delta = (choice.get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+
+def get_client(provider: str) -> ChatClient:
+    """
+    Process-wide client per provider (see core.providers for the registry): every run_module call
+    and every Streamlit session shares the same pooled connection set.
+    """
+    from core.providers import get_registry
 
+    return get_registry().client(provider)
@@ -0,0 +1,258 @@
+from __future__ import annotations
+
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field, fields
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from core.budget import model_profile
+from core.governor import get_governor
+from core.llm_client import CallStats
+
+SPANS = ("queue_s", "network_s", "generation_s", "post_check_s", "total_s")
+TOKENS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+@dataclass
+class RunMetrics:
+    """
+    One module run: span totals summed over its upstream requests (chunked runs overlap, so
+    queue/network/generation can exceed total_s), token usage and an estimated cost.
+    """
+
+    module: str
+    model: str
+    provider: str = ""
+    requests: int = 0
+    cache_hits: int = 0
+    # 搭上另一会话在途的相同请求、未单独请求上游的次数
+    coalesced: int = 0
+    queue_s: float = 0.0
+    network_s: float = 0.0
+    generation_s: float = 0.0
+    post_check_s: float = 0.0
+    total_s: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost: float = 0.0
+    started: float = field(default_factory=time.monotonic, repr=False)
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @classmethod
+    def start(cls, module: str, settings: Dict[str, Any]) -> "RunMetrics":
+        return cls(
+            module=module,
+            model=str(settings.get("model_name", "")),
+            provider=str(settings.get("model_provider", "")),
+        )
+
+    def add_call(self, stats: CallStats) -> None:
+        """Fold in one upstream request; safe to call from chunk worker threads."""
+        profile = model_profile(self.model)
+        uncached = max(0, stats.prompt_tokens - stats.cached_tokens)
+        cost = (
+            uncached * profile.price_in
+            + stats.cached_tokens * profile.price_in_cached
+            + stats.completion_tokens * profile.price_out
+        ) / 1_000_000
+        with self._lock:
+            self.requests += 1
+            if stats.provider:
+                self.provider = stats.provider
+            self.queue_s += stats.queue_s
+            self.network_s += stats.network_s
+            self.generation_s += stats.generation_s
+            self.prompt_tokens += stats.prompt_tokens
+            self.completion_tokens += stats.completion_tokens
+            self.cached_tokens += stats.cached_tokens
+            self.cost += cost
+
+    def add_cache_hit(self) -> None:
+        with self._lock:
+            self.cache_hits += 1
+
+    def add_coalesced(self) -> None:
+        with self._lock:
+            self.coalesced += 1
+
+    @contextmanager
+    def post_check_span(self) -> Iterator[None]:
+        t0 = time.monotonic()
+        try:
+            yield
+        finally:
+            self.post_check_s += time.monotonic() - t0
+
+    def finish(self) -> Dict[str, Any]:
+        """Close the run, add it to the process-wide aggregates and return it as a dict."""
+        self.total_s = time.monotonic() - self.started
+        get_metrics().record(self)
+        return self.to_dict()
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {f.name: getattr(self, f.name) for f in fields(self) if f.name not in ("started", "_lock")}
+        for key in SPANS:
+            data[key] = round(data[key], 3)
+        data["cost"] = round(data["cost"], 5)
+        data["cache_hit_rate"] = round(self.cached_tokens / self.prompt_tokens, 3) if self.prompt_tokens else 0.0
+        return data
+
+
+@dataclass
+class _Aggregate:
+    runs: int = 0
+    requests: int = 0
+    cache_hits: int = 0
+    coalesced: int = 0
+    cost: float = 0.0
+    spans: Dict[str, float] = field(default_factory=lambda: dict.fromkeys(SPANS, 0.0))
+    tokens: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(TOKENS, 0))
+    max_total_s: float = 0.0
+
+
+class MetricsRegistry:
+    """Process-wide aggregates per (module, model), exported as JSON or Prometheus text."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._aggs: Dict[Tuple[str, str], _Aggregate] = {}
+        self.since = time.time()
+
+    def record(self, run: RunMetrics) -> None:
+        with self._lock:
+            agg = self._aggs.setdefault((run.module, run.model), _Aggregate())
+            agg.runs += 1
+            agg.requests += run.requests
+            agg.cache_hits += run.cache_hits
+            agg.coalesced += run.coalesced
+            agg.cost += run.cost
+            for key in SPANS:
+                agg.spans[key] += getattr(run, key)
+            for key in TOKENS:
+                agg.tokens[key] += getattr(run, key)
+            agg.max_total_s = max(agg.max_total_s, run.total_s)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._aggs.clear()
+            self.since = time.time()
+
+    def snapshot(self) -> Dict[str, Any]:
+        rows: List[Dict[str, Any]] = []
+        with self._lock:
+            for (module, model), agg in sorted(self._aggs.items()):
+                rows.append(
+                    {
+                        "module": module,
+                        "model": model,
+                        "runs": agg.runs,
+                        "requests": agg.requests,
+                        "cache_hits": agg.cache_hits,
+                        "coalesced": agg.coalesced,
+                        "cost": round(agg.cost, 5),
+                        "avg_total_s": round(agg.spans["total_s"] / agg.runs, 3),
+                        "max_total_s": round(agg.max_total_s, 3),
+                        "spans_s": {k: round(v, 3) for k, v in agg.spans.items()},
+                        "tokens": dict(agg.tokens),
+                        # 输入 tokens 中命中服务端前缀缓存的比例
+                        "cache_hit_rate": (
+                            round(agg.tokens["cached_tokens"] / agg.tokens["prompt_tokens"], 3)
+                            if agg.tokens["prompt_tokens"]
+                            else 0.0
+                        ),
+                    }
+                )
+        return {"since": self.since, "modules": rows, "governor": get_governor().stats()}
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition format (counters are totals since process start / reset)."""
+        snap = self.snapshot()
+        out = [
+            "# HELP podcastsop_module_runs_total Module runs.",
+            "# TYPE podcastsop_module_runs_total counter",
+        ]
+
+        def _labels(row: Dict[str, Any], **extra: str) -> str:
+            pairs = {"module": row["module"], "model": row["model"], **extra}
+            return ",".join(f'{k}="{json.dumps(v, ensure_ascii=False)[1:-1]}"' for k, v in pairs.items())
+
+        for row in snap["modules"]:
+            out.append(f"podcastsop_module_runs_total{{{_labels(row)}}} {row['runs']}")
+        out += ["# HELP podcastsop_requests_total Upstream LLM requests.", "# TYPE podcastsop_requests_total counter"]
+        for row in snap["modules"]:
+            out.append(f"podcastsop_requests_total{{{_labels(row)}}} {row['requests']}")
+        out += ["# HELP podcastsop_cache_hits_total Response cache hits.", "# TYPE podcastsop_cache_hits_total counter"]
+        for row in snap["modules"]:
+            out.append(f"podcastsop_cache_hits_total{{{_labels(row)}}} {row['cache_hits']}")
+        out += ["# HELP podcastsop_tokens_total Tokens by kind.", "# TYPE podcastsop_tokens_total counter"]
+        for row in snap["modules"]:
+            for kind, value in row["tokens"].items():
+                out.append(f"podcastsop_tokens_total{{{_labels(row, kind=kind.replace('_tokens', ''))}}} {value}")
+        out += ["# HELP podcastsop_span_seconds_total Time spent per span.", "# TYPE podcastsop_span_seconds_total counter"]
+        for row in snap["modules"]:
+            for span, value in row["spans_s"].items():
+                out.append(f"podcastsop_span_seconds_total{{{_labels(row, span=span[:-2])}}} {value}")
+        out += [
+            "# HELP podcastsop_prompt_cache_hit_ratio Share of prompt tokens served from the provider's prefix cache.",
+            "# TYPE podcastsop_prompt_cache_hit_ratio gauge",
+        ]
+        for row in snap["modules"]:
+            out.append(f"podcastsop_prompt_cache_hit_ratio{{{_labels(row)}}} {row['cache_hit_rate']}")
+        out += ["# HELP podcastsop_cost_yuan_total Estimated cost.", "# TYPE podcastsop_cost_yuan_total counter"]
+        for row in snap["modules"]:
+            out.append(f"podcastsop_cost_yuan_total{{{_labels(row)}}} {row['cost']}")
+        return "\n".join(out) + "\n" + get_governor().prometheus()
+
+
+_METRICS: Optional[MetricsRegistry] = None
+_METRICS_LOCK = threading.Lock()
+_SERVER: Optional[ThreadingHTTPServer] = None
+
+
+def get_metrics() -> MetricsRegistry:
+    global _METRICS
+    with _METRICS_LOCK:
+        if _METRICS is None:
+            _METRICS = MetricsRegistry()
+        return _METRICS
+
+
+def start_metrics_server(port: int, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+    """
+    Serve GET /metrics (Prometheus text) and /metrics.json from a daemon thread.
+    Idempotent: later calls return the running server.
+    """
+    global _SERVER
+    with _METRICS_LOCK:
+        if _SERVER is not None:
+            return _SERVER
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def do_GET(self) -> None:
+                if self.path.startswith("/metrics.json"):
+                    body = json.dumps(get_metrics().snapshot(), ensure_ascii=False).encode("utf-8")
+                    ctype = "application/json; charset=utf-8"
+                elif self.path.startswith("/metrics"):
+                    body = get_metrics().prometheus().encode("utf-8")
+                    ctype = "text/plain; version=0.0.4; charset=utf-8"
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        _SERVER = server
+        return server
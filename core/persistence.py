@@ -0,0 +1,298 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_DEFAULT_DB = Path(__file__).resolve().parent.parent / "data" / "projects.sqlite3"
+# 会话交出项目时的回调：参数是替换用的占位 {"meta": {"project_id"}, "evicted": True}
+ReleaseCallback = Callable[[Dict[str, Any]], None]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS projects (
+    id TEXT PRIMARY KEY,
+    meta TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    input_raw TEXT NOT NULL,
+    state TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS modules (
+    project_id TEXT NOT NULL,
+    module TEXT NOT NULL,
+    current TEXT NOT NULL,
+    PRIMARY KEY (project_id, module)
+);
+CREATE TABLE IF NOT EXISTS versions (
+    project_id TEXT NOT NULL,
+    module TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    version_id TEXT NOT NULL,
+    time TEXT NOT NULL,
+    settings TEXT NOT NULL,
+    text TEXT,
+    delta TEXT,
+    metrics TEXT,
+    PRIMARY KEY (project_id, module, version_id)
+);
+CREATE INDEX IF NOT EXISTS versions_by_seq ON versions (project_id, module, seq);
+"""
+
+# projects.state 里存的小字段（整体 JSON）
+_STATE_KEYS = ("version_counter", "a_segments", "source_hashes", "run_metrics", "input_cues")
+
+
+def _dumps(value: Any) -> str:
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _fingerprint(value: Any) -> str:
+    raw = value if isinstance(value, str) else _dumps(value)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ProjectStore:
+    """
+    SQLite persistence for Project dicts.
+
+    - meta / settings / input_raw / module currents are stored and loaded eagerly;
+    - history rows hold the version text or delta and are only read when a version is opened;
+    - sync() writes only the fields whose content changed since the last write;
+    - evict_idle() drops projects nobody touched recently from memory (they reload on next access).
+    """
+
+    def __init__(self, path: Optional[Path] = None) -> None:
+        self.path = Path(path) if path else _DEFAULT_DB
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._lock = threading.RLock()
+        # project_id -> {field: fingerprint}，用于增量写入
+        self._written: Dict[str, Dict[str, str]] = {}
+        # project_id -> (project dict, last touch, release callback of the session holding it)
+        self._live: Dict[str, Tuple[Dict[str, Any], float, Optional[ReleaseCallback]]] = {}
+
+    def _migrate(self) -> None:
+        # 旧库没有 versions.metrics 列
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(versions)")}
+        if "metrics" not in columns:
+            self._conn.execute("ALTER TABLE versions ADD COLUMN metrics TEXT")
+
+    # ---- 写入 ----
+
+    def sync(self, project: Dict[str, Any], modules: Tuple[str, ...]) -> int:
+        """Write changed fields of a project. Returns the number of fields written."""
+        pid = project["meta"]["project_id"]
+        fields: Dict[str, Any] = {
+            "meta": project["meta"],
+            "settings": project["settings"],
+            "input_raw": project["input_raw"],
+            "state": {k: project.get(k) for k in _STATE_KEYS},
+        }
+        for m in modules:
+            fields[f"module:{m}"] = project[m]["current"]
+        with self._lock:
+            written = self._written.setdefault(pid, {})
+            dirty = {}
+            for key, value in fields.items():
+                fp = _fingerprint(value)
+                if written.get(key) != fp:
+                    dirty[key] = (value, fp)
+            if not dirty:
+                return 0
+            with self._conn:
+                self._conn.execute("BEGIN")
+                row_fields = ("meta", "settings", "input_raw", "state")
+                if any(k in dirty for k in row_fields):
+                    self._conn.execute(
+                        "INSERT INTO projects (id, meta, settings, input_raw, state, updated) VALUES (?, ?, ?, ?, ?, ?)"
+                        " ON CONFLICT(id) DO UPDATE SET meta=excluded.meta, settings=excluded.settings,"
+                        " input_raw=excluded.input_raw, state=excluded.state, updated=excluded.updated",
+                        (
+                            pid,
+                            _dumps(fields["meta"]),
+                            _dumps(fields["settings"]),
+                            fields["input_raw"],
+                            _dumps(fields["state"]),
+                            time.time(),
+                        ),
+                    )
+                for key, (value, _fp) in dirty.items():
+                    if key.startswith("module:"):
+                        self._conn.execute(
+                            "INSERT INTO modules (project_id, module, current) VALUES (?, ?, ?)"
+                            " ON CONFLICT(project_id, module) DO UPDATE SET current=excluded.current",
+                            (pid, key.split(":", 1)[1], value),
+                        )
+            for key, (_value, fp) in dirty.items():
+                written[key] = fp
+            return len(dirty)
+
+    def append_version(self, project_id: str, module: str, item: Dict[str, Any]) -> None:
+        delta = item.get("delta")
+        with self._lock, self._conn:
+            seq = self._conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM versions WHERE project_id=? AND module=?",
+                (project_id, module),
+            ).fetchone()[0]
+            self._conn.execute(
+                "INSERT OR REPLACE INTO versions"
+                " (project_id, module, seq, version_id, time, settings, text, delta, metrics)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    project_id,
+                    module,
+                    seq,
+                    item["version_id"],
+                    item["time"],
+                    _dumps(item["settings"]),
+                    None if delta is not None else item["text"],
+                    _dumps(delta) if delta is not None else None,
+                    _dumps(item["metrics"]) if item.get("metrics") else None,
+                ),
+            )
+
+    # ---- 读取 ----
+
+    def exists(self, project_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM projects WHERE id=?", (project_id,)).fetchone() is not None
+
+    def load(self, project_id: str, modules: Tuple[str, ...]) -> Optional[Dict[str, Any]]:
+        """
+        Load a project with its history as metadata-only stubs (`lazy: True`);
+        version payloads are fetched with load_payload() on demand.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT meta, settings, input_raw, state FROM projects WHERE id=?", (project_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            project: Dict[str, Any] = {
+                "meta": json.loads(row[0]),
+                "settings": json.loads(row[1]),
+                "input_raw": row[2],
+            }
+            state = json.loads(row[3])
+            for key in _STATE_KEYS:
+                if state.get(key) is not None:
+                    project[key] = state[key]
+            currents = dict(
+                self._conn.execute("SELECT module, current FROM modules WHERE project_id=?", (project_id,)).fetchall()
+            )
+            for m in modules:
+                project[m] = {"current": currents.get(m, ""), "history": []}
+            for module, version_id, vtime, settings, is_delta, metrics in self._conn.execute(
+                "SELECT module, version_id, time, settings, delta IS NOT NULL, metrics FROM versions"
+                " WHERE project_id=? ORDER BY module, seq",
+                (project_id,),
+            ):
+                if module not in project:
+                    continue
+                stub: Dict[str, Any] = {
+                    "version_id": version_id,
+                    "text": "",
+                    "time": vtime,
+                    "settings": json.loads(settings),
+                    "lazy": True,
+                }
+                if is_delta:
+                    stub["delta"] = None
+                if metrics:
+                    stub["metrics"] = json.loads(metrics)
+                project[module]["history"].append(stub)
+            self._written[project_id] = {}
+        return project
+
+    def load_payload(self, project_id: str, module: str, version_id: str) -> Tuple[str, Optional[List[Any]]]:
+        """(text, delta) of one stored version; delta is None for snapshots."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, delta FROM versions WHERE project_id=? AND module=? AND version_id=?",
+                (project_id, module, version_id),
+            ).fetchone()
+        if row is None:
+            raise KeyError(f"{project_id}/{module}/{version_id}")
+        return (row[0] or "", json.loads(row[1]) if row[1] is not None else None)
+
+    def list_projects(self, limit: int = 50) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, meta, updated FROM projects ORDER BY updated DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [{"id": r[0], "title": json.loads(r[1]).get("title", ""), "updated": r[2]} for r in rows]
+
+    # ---- 内存驻留 ----
+
+    def touch(self, project: Dict[str, Any], release: Optional[ReleaseCallback] = None) -> None:
+        """
+        Mark the project as in use. `release(stub)` is how its session lets go of it on eviction;
+        once given it is kept across later touches of the same dict.
+        """
+        pid = project["meta"]["project_id"]
+        with self._lock:
+            if release is None:
+                held = self._live.get(pid)
+                if held is not None and held[0] is project:
+                    release = held[2]
+            self._live[pid] = (project, time.time(), release)
+
+    def evict_idle(
+        self,
+        max_idle_s: float,
+        modules: Tuple[str, ...],
+        busy: Optional[Callable[[str], bool]] = None,
+    ) -> int:
+        """
+        Flush projects not touched for max_idle_s and hand their sessions the stub
+        {"meta": {"project_id"}, "evicted": True} in place of the project (reload_into() restores it).
+        The project dict itself is never modified: a script run, fragment or background job still
+        holding it keeps a complete project. Projects for which busy(project_id) is true are skipped;
+        projects without a release callback are only forgotten.
+        """
+        now = time.time()
+        evicted = 0
+        with self._lock:
+            for pid, (project, last, release) in list(self._live.items()):
+                if now - last < max_idle_s or (busy is not None and busy(pid)):
+                    continue
+                del self._live[pid]
+                if project.get("evicted"):
+                    continue
+                self.sync(project, modules)
+                if release is not None:
+                    release({"meta": {"project_id": pid}, "evicted": True})
+                    evicted += 1
+        return evicted
+
+    def reload_into(self, project: Dict[str, Any], modules: Tuple[str, ...]) -> bool:
+        loaded = self.load(project["meta"]["project_id"], modules)
+        if loaded is None:
+            return False
+        project.clear()
+        project.update(loaded)
+        self.touch(project)
+        return True
+
+
+_STORE: Optional[ProjectStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> ProjectStore:
+    """Process-wide store. Env: PODCASTSOP_DB (default ./data/projects.sqlite3)."""
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            path = os.getenv("PODCASTSOP_DB") or None
+            _STORE = ProjectStore(Path(path) if path else None)
+        return _STORE
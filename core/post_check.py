@@ -0,0 +1,250 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from html import escape
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+_DEFAULT_RULES = Path(__file__).resolve().parent / "post_check_rules.json"
+# 规则可按语言区分；项目语言为双语（bi）或未设置时两种语言的规则都用
+LANGS = ("zh", "en")
+
+_SEVERITY_ORDER = {"error": 0, "warning": 1, "info": 2}
+_MARK_STYLE = {
+    "error": "background:#FECACA;color:#991B1B;",
+    "warning": "background:#FDE68A;color:#92400E;",
+    "info": "background:#DBEAFE;color:#1E40AF;",
+}
+
+
+@dataclass(frozen=True)
+class Rule:
+    pattern: str
+    group: str
+    severity: str
+    message: str
+    whole_word: bool = False
+    # 空串：不分语言
+    lang: str = ""
+
+
+@dataclass(frozen=True)
+class Hit:
+    start: int
+    end: int
+    text: str
+    rule: Rule
+
+
+@dataclass
+class CheckReport:
+    hits: List[Hit] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.hits
+
+    def summary(self) -> str:
+        """Backward-compatible one-line message: each group with the distinct phrases it hit."""
+        groups: Dict[str, Tuple[Rule, List[str]]] = {}
+        for hit in self.hits:
+            rule, phrases = groups.setdefault(hit.rule.group, (hit.rule, []))
+            if hit.rule.pattern not in phrases:
+                phrases.append(hit.rule.pattern)
+        parts = []
+        for rule, phrases in sorted(groups.values(), key=lambda g: _SEVERITY_ORDER.get(g[0].severity, 9)):
+            parts.append(f"{rule.message}：命中" + "".join(f"「{p}」" for p in phrases))
+        return "；".join(parts)
+
+
+def _fold(ch: str) -> str:
+    # 逐字符小写；多字符的小写形式（如 'İ'）保持原样，保证命中位置与原文一一对应
+    low = ch.lower()
+    return low if len(low) == 1 else ch
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and (ch.isalnum() or ch == "_")
+
+
+class PatternMatcher:
+    """
+    Aho-Corasick automaton over case-folded patterns. One left-to-right pass over the text reports
+    every occurrence of every pattern (overlaps included), so checking time is linear in text length
+    plus the number of hits, independent of how many rules are loaded.
+    """
+
+    def __init__(self, rules: List[Rule]) -> None:
+        self.rules = rules
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态结束的规则下标（已沿 fail 链合并）
+        self._out: List[List[int]] = [[]]
+        for idx, rule in enumerate(rules):
+            state = 0
+            for ch in rule.pattern:
+                ch = _fold(ch)
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                state = nxt
+            if rule.pattern:
+                self._out[state].append(idx)
+        self._build_fail_links()
+
+    def _build_fail_links(self) -> None:
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                f = self._fail[state]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                target = self._goto[f].get(ch, 0)
+                self._fail[nxt] = target if target != nxt else 0
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text: str) -> List[Hit]:
+        goto, fail, out, rules = self._goto, self._fail, self._out, self.rules
+        hits: List[Hit] = []
+        state = 0
+        for pos, ch in enumerate(text):
+            ch = _fold(ch)
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            end = pos + 1
+            for idx in out[state]:
+                rule = rules[idx]
+                start = end - len(rule.pattern)
+                if rule.whole_word and (
+                    (start > 0 and _is_word_char(text[start - 1]) and _is_word_char(text[start]))
+                    or (end < len(text) and _is_word_char(text[end]) and _is_word_char(text[end - 1]))
+                ):
+                    continue
+                hits.append(Hit(start=start, end=end, text=text[start:end], rule=rule))
+        hits.sort(key=lambda h: (h.start, -h.end))
+        return hits
+
+
+def load_rules(path: Optional[Path] = None) -> List[Rule]:
+    """
+    Rule file (JSON): {"groups": [{"id", "severity", "message", "whole_word"?, "lang"?, "patterns"}]}.
+    `patterns` is a list (in the group's `lang`, or any language when omitted) or a dict of
+    per-language lists, e.g. {"zh": [...], "en": [...], "*": [...]}.
+    """
+    data = json.loads(Path(path or _DEFAULT_RULES).read_text(encoding="utf-8"))
+    rules: List[Rule] = []
+    for group in data.get("groups", []):
+        patterns = group.get("patterns", [])
+        if isinstance(patterns, dict):
+            by_lang = [("" if lang == "*" else lang, items) for lang, items in patterns.items()]
+        else:
+            by_lang = [(group.get("lang", ""), patterns)]
+        for lang, items in by_lang:
+            for pattern in items:
+                if not pattern:
+                    continue
+                rules.append(
+                    Rule(
+                        pattern=pattern,
+                        group=group["id"],
+                        severity=group.get("severity", "warning"),
+                        message=group.get("message", group["id"]),
+                        whole_word=bool(group.get("whole_word", False)),
+                        lang=lang,
+                    )
+                )
+    return rules
+
+
+def _lang_key(lang: Optional[str]) -> Optional[str]:
+    return lang if lang in LANGS else None
+
+
+_RULES: List[Rule] = []
+_MATCHERS: Dict[Optional[str], PatternMatcher] = {}
+_MATCHER_KEY: Optional[Tuple[str, float]] = None
+_MATCHER_LOCK = threading.Lock()
+
+
+def _matcher_key() -> Tuple[str, float]:
+    path = Path(os.getenv("PODCASTSOP_RULES") or _DEFAULT_RULES)
+    return str(path), path.stat().st_mtime
+
+
+def get_matcher(lang: Optional[str] = None) -> PatternMatcher:
+    """
+    Process-wide matcher per language for the rule file (env PODCASTSOP_RULES, default
+    core/post_check_rules.json): rules without a language plus those for `lang` ("zh" / "en");
+    any other value ("bi", None) uses every rule. Rebuilt automatically when the file changes on disk.
+    """
+    global _RULES, _MATCHER_KEY
+    key = _matcher_key()
+    lang = _lang_key(lang)
+    with _MATCHER_LOCK:
+        if _MATCHER_KEY != key:
+            _RULES = load_rules(Path(key[0]))
+            _MATCHERS.clear()
+            _MATCHER_KEY = key
+        matcher = _MATCHERS.get(lang)
+        if matcher is None:
+            matcher = PatternMatcher([r for r in _RULES if lang is None or r.lang in ("", lang)])
+            _MATCHERS[lang] = matcher
+        return matcher
+
+
+_REPORTS: "OrderedDict[Tuple[Tuple[str, float], Optional[str], int, str], CheckReport]" = OrderedDict()
+_REPORTS_SIZE = 32
+_REPORTS_LOCK = threading.Lock()
+
+
+def check_text(text: str, lang: Optional[str] = None) -> CheckReport:
+    """
+    All rule hits in `text` for the project language (meta["lang"]), memoized per
+    (rule file version, language, text); treat the report as read-only.
+    """
+    # 按（长度, 内容哈希）记忆：报告只含命中片段和位置，缓存里不保留成稿全文
+    lang = _lang_key(lang)
+    key = (_matcher_key(), lang, len(text), hashlib.sha256(text.encode("utf-8")).hexdigest()[:16])
+    with _REPORTS_LOCK:
+        report = _REPORTS.get(key)
+        if report is not None:
+            _REPORTS.move_to_end(key)
+            return report
+    report = CheckReport(hits=get_matcher(lang).find_all(text))
+    with _REPORTS_LOCK:
+        _REPORTS[key] = report
+        while len(_REPORTS) > _REPORTS_SIZE:
+            _REPORTS.popitem(last=False)
+    return report
+
+
+def render_hits_html(text: str, hits: List[Hit]) -> str:
+    """Whole text with every hit wrapped in <mark> (overlapping hits merge into the first span)."""
+    parts: List[str] = []
+    pos = 0
+    for hit in hits:
+        if hit.start < pos:
+            continue
+        parts.append(escape(text[pos : hit.start]))
+        style = _MARK_STYLE.get(hit.rule.severity, _MARK_STYLE["warning"])
+        parts.append(
+            f"<mark style='{style}' title='{escape(hit.rule.message)}'>{escape(text[hit.start : hit.end])}</mark>"
+        )
+        pos = hit.end
+    parts.append(escape(text[pos:]))
+    body = "".join(parts)
+    return f"<pre style='margin:0; padding:8px; white-space:pre-wrap; font-size:14px; line-height:1.7;'>{body}</pre>"
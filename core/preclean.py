@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from core.tokens import estimate_tokens
+
+_DEFAULT_RULES = Path(__file__).resolve().parent / "preclean_rules.json"
+
+# 口头禅只在分句开头、且后面跟停顿标点时删除（“然后，” 删，“然后我们” 保留）
+_CLAUSE_BOUNDARY = r"，,。.！!？?、；;：:…\s"
+_PAUSE = r"[，,、…]+"
+_CJK = r"[\u3400-\u4dbf\u4e00-\u9fff]"
+# 重复片段之间允许的间隔
+_STUTTER_SEP = r"[，,、…—\s]"
+# 行首说话人标签：主持人：/ 【Host】: / (嘉宾) ：
+_LABEL_RE = re.compile(r"^\s*[\[【(（]?\s*([^\s\[\]【】()（）:：][^\[\]【】()（）:：\n]{0,19}?)\s*[\]】)）]?\s*[:：]\s*")
+
+COUNT_KEYS = ("fillers", "stutters", "terms", "speakers", "duplicate_lines")
+# 口吃类匹配 -> 保留下来的那一遍
+_STUTTER_UNIT = {"stutter_word": "sw", "stutter1": "s1", "stutter": "s3", "stutter2": "s2", "stutter_en": "en"}
+
+
+@dataclass
+class PrecleanResult:
+    text: str
+    chars_before: int
+    tokens_before: int
+    tokens_after: int
+    counts: Dict[str, int] = field(default_factory=lambda: dict.fromkeys(COUNT_KEYS, 0))
+
+    @property
+    def chars_saved(self) -> int:
+        return self.chars_before - len(self.text)
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.tokens_before - self.tokens_after
+
+    def to_dict(self) -> Dict[str, int]:
+        return {
+            "chars_before": self.chars_before,
+            "chars_after": len(self.text),
+            "chars_saved": self.chars_saved,
+            "tokens_before": self.tokens_before,
+            "tokens_after": self.tokens_after,
+            "tokens_saved": self.tokens_saved,
+            **self.counts,
+        }
+
+
+def _alternation(words: List[str]) -> str:
+    # 长的在前，避免“对对”抢先匹配“对对对”
+    return "|".join(re.escape(w) for w in sorted(set(words), key=len, reverse=True) if w)
+
+
+def _periodic(unit: str) -> bool:
+    # “谢谢谢” 由更短的片段叠成：整段是叠字，不是口吃
+    return (unit + unit).find(unit, 1) < len(unit)
+
+
+def _bounded(word: str) -> str:
+    # 以字母数字开头/结尾的写法要求词边界，避免把 "said" 里的 "ai" 改掉
+    pat = re.escape(word)
+    if word[:1].isascii() and word[:1].isalnum():
+        pat = r"(?<![A-Za-z0-9])" + pat
+    if word[-1:].isascii() and word[-1:].isalnum():
+        pat += r"(?![A-Za-z0-9])"
+    return pat
+
+
+class Precleaner:
+    """
+    Deterministic local clean-up before module A. Every line goes through one compiled
+    alternation (fillers, stutters, terminology variants); speaker labels are normalized at the
+    start of the line and adjacent duplicate lines are dropped in the same pass.
+
+    A stutter is a whole unit said again right away; the run collapses to one copy. Without a
+    pause in between only `stutter_words` ("这个这个" → "这个") and units of 3+ characters count,
+    so reduplicated words ("谢谢谢谢", "一点一点", "研究研究") are kept.
+    """
+
+    def __init__(
+        self,
+        *,
+        fillers: List[str],
+        terms: Dict[str, List[str]],
+        speaker_aliases: Dict[str, List[str]],
+        stutter_words: Optional[List[str]] = None,
+    ) -> None:
+        self._term_map: Dict[str, str] = {}
+        for canonical, variants in terms.items():
+            for v in variants:
+                if v and v != canonical:
+                    self._term_map[v] = canonical
+        self.speaker_aliases = speaker_aliases
+
+        parts: List[str] = []
+        if fillers:
+            parts.append(rf"(?P<filler>(?<![^{_CLAUSE_BOUNDARY}])(?:(?:{_alternation(fillers)})+{_PAUSE})+)")
+        if stutter_words:
+            # “这个这个问题”“我们我们今天”：常见的口吃词，紧挨着重复也算
+            parts.append(rf"(?P<stutter_word>(?P<sw>{_alternation(stutter_words)})(?:{_STUTTER_SEP}*(?P=sw))+)")
+        parts += [
+            r"(?P<stutter1>(?P<s1>[我你他她它这那])(?P=s1)+)",
+            # “其实一开，其实一开始”：3 字以上的片段紧接着重复（可隔停顿）
+            rf"(?P<stutter>(?P<s3>{_CJK}{{3,8}})(?:{_STUTTER_SEP}*(?P=s3))+)",
+            # 2 字片段必须隔着停顿才算重复，“一点一点”“研究研究”这类叠词保留
+            rf"(?P<stutter2>(?P<s2>{_CJK}{{2}})(?:{_PAUSE}(?P=s2))+)",
+            r"(?P<stutter_en>(?<![A-Za-z])(?P<en>[A-Za-z]+)(?:\s*,?\s+(?P=en)(?![A-Za-z]))+)",
+        ]
+        if self._term_map:
+            variants = sorted(self._term_map, key=len, reverse=True)
+            parts.append("(?P<term>" + "|".join(_bounded(v) for v in variants) + ")")
+        self._inline = re.compile("|".join(parts))
+
+    def _speaker_map(self, speakers: Tuple[str, ...]) -> Dict[str, str]:
+        mapping: Dict[str, str] = {}
+        for canonical in speakers:
+            for alias in self.speaker_aliases.get(canonical, []):
+                mapping[alias.casefold()] = canonical
+        # 用户填写的说话人本身优先于别名（比如把“主播”单列为一个说话人）
+        for canonical in speakers:
+            mapping[canonical.casefold()] = canonical
+        return mapping
+
+    def clean(self, text: str, speakers: Tuple[str, ...] = ()) -> PrecleanResult:
+        counts = dict.fromkeys(COUNT_KEYS, 0)
+        speaker_map = self._speaker_map(speakers)
+        term_map = self._term_map
+
+        def _sub(m: "re.Match[str]") -> str:
+            kind = m.lastgroup
+            if kind == "term":
+                counts["terms"] += 1
+                return term_map[m.group(0)]
+            if kind == "filler":
+                counts["fillers"] += 1
+                return ""
+            unit = m.group(_STUTTER_UNIT[kind])
+            if kind == "stutter" and _periodic(unit):
+                return m.group(0)
+            counts["stutters"] += 1
+            return unit
+
+        out: List[str] = []
+        prev = None
+        for line in text.split("\n"):
+            if speaker_map:
+                m = _LABEL_RE.match(line)
+                if m:
+                    canonical = speaker_map.get(m.group(1).casefold())
+                    if canonical is not None:
+                        label = f"{canonical}："
+                        if m.group(0) != label:
+                            counts["speakers"] += 1
+                            line = label + line[m.end() :]
+            line = self._inline.sub(_sub, line)
+            key = line.strip()
+            if key and key == prev:
+                counts["duplicate_lines"] += 1
+                continue
+            prev = key
+            out.append(line)
+
+        cleaned = "\n".join(out)
+        return PrecleanResult(
+            text=cleaned,
+            chars_before=len(text),
+            tokens_before=estimate_tokens(text),
+            tokens_after=estimate_tokens(cleaned),
+            counts=counts,
+        )
+
+
+def load_rules(path: Optional[Path] = None) -> Precleaner:
+    """
+    Dictionary file (JSON): {"fillers": [...], "stutter_words": [...], "terms": {canonical: [variants]},
+    "speaker_aliases": {speaker: [aliases]}}.
+    """
+    data = json.loads(Path(path or _DEFAULT_RULES).read_text(encoding="utf-8"))
+    return Precleaner(
+        fillers=list(data.get("fillers", [])),
+        terms={k: list(v) for k, v in data.get("terms", {}).items()},
+        speaker_aliases={k: list(v) for k, v in data.get("speaker_aliases", {}).items()},
+        stutter_words=list(data.get("stutter_words", [])),
+    )
+
+
+_CLEANER: Optional[Precleaner] = None
+_CLEANER_KEY: Optional[Tuple[str, float]] = None
+_CLEANER_LOCK = threading.Lock()
+
+
+def _rules_key() -> Tuple[str, float]:
+    path = Path(os.getenv("PODCASTSOP_PRECLEAN_RULES") or _DEFAULT_RULES)
+    return str(path), path.stat().st_mtime
+
+
+def get_precleaner() -> Precleaner:
+    """
+    Process-wide precleaner for the dictionary file (env PODCASTSOP_PRECLEAN_RULES,
+    default core/preclean_rules.json). Rebuilt automatically when the file changes on disk.
+    """
+    global _CLEANER, _CLEANER_KEY
+    key = _rules_key()
+    with _CLEANER_LOCK:
+        if _CLEANER is None or _CLEANER_KEY != key:
+            _CLEANER = load_rules(Path(key[0]))
+            _CLEANER_KEY = key
+        return _CLEANER
+
+
+_MEMO: "OrderedDict[Tuple[Tuple[str, float], int, str, Tuple[str, ...]], PrecleanResult]" = OrderedDict()
+# 结果里带着清洗后的全文，只留最近几份（一个会话通常只在看一份逐字稿）
+_MEMO_SIZE = 4
+_MEMO_LOCK = threading.Lock()
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def preclean(text: str, speakers: Optional[List[str]] = None) -> PrecleanResult:
+    """Cleaned transcript plus savings, memoized per (dictionary version, text, speakers); treat as read-only."""
+    # 按（长度, 内容哈希）记忆，缓存里不保留原始逐字稿
+    key = (_rules_key(), len(text), _text_hash(text), tuple(speakers or ()))
+    with _MEMO_LOCK:
+        result = _MEMO.get(key)
+        if result is not None:
+            _MEMO.move_to_end(key)
+            return result
+    result = get_precleaner().clean(text, key[3])
+    with _MEMO_LOCK:
+        _MEMO[key] = result
+        while len(_MEMO) > _MEMO_SIZE:
+            _MEMO.popitem(last=False)
+    return result
@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from core.budget import plan_budget
+from core.governor import LANE_KEYS
+from core.jobs import Job, JobManager, get_jobs
+from core.project_state import (
+    WORKFLOW_PREV,
+    Project,
+    get_module_input,
+    has_current,
+    stale_modules,
+    text_hash,
+)
+from core.tokens import estimate_tokens
+
+# 上游输出多久没被改动才开始预取下一模块
+PREFETCH_IDLE_S = float(os.getenv("PODCASTSOP_PREFETCH_IDLE_S", "5") or 5)
+# 每小时最多浪费多少 tokens 在没被用上的预取上（进程内所有会话共享）
+PREFETCH_MAX_WASTE = int(os.getenv("PODCASTSOP_PREFETCH_MAX_WASTE", "200000") or 200000)
+_WASTE_WINDOW_S = 3600.0
+
+
+def _run_settings(settings: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in settings.items() if k not in LANE_KEYS}
+
+
+def _matches(job: Job, project: Project, module_input: str) -> bool:
+    # 任务设置里带着提交时的项目语言（后置校验用），一并比对
+    current = dict(project["settings"], lang=project["meta"].get("lang"))
+    return job.module_input == module_input and _run_settings(job.settings) == _run_settings(current)
+
+
+class Prefetcher:
+    """
+    Speculative runs of the next workflow module (settings["prefetch"]). Once a module's output has
+    stayed unchanged for PREFETCH_IDLE_S, the module downstream of it is submitted as a speculative
+    background job. Clicking "运行本模块" with the same input and settings claims it; an upstream
+    edit or settings change discards it.
+
+    Waste cap: every speculative job reserves its estimated tokens (prompt + expected output);
+    discarded jobs turn into waste. Reserved plus wasted tokens of the last hour never exceed
+    PREFETCH_MAX_WASTE.
+    """
+
+    def __init__(self, jobs: JobManager, *, idle_s: float = PREFETCH_IDLE_S, max_waste: int = PREFETCH_MAX_WASTE) -> None:
+        self.jobs = jobs
+        self.idle_s = idle_s
+        self.max_waste = max_waste
+        self._lock = threading.Lock()
+        # (项目, 模块) -> (输入哈希, 首次看到该输入的时间)
+        self._seen: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        # 任务 id -> (预估输入 tokens, 预估总 tokens)
+        self._reserved: Dict[str, Tuple[int, int]] = {}
+        self._wasted: Deque[Tuple[float, int]] = deque()
+        # (项目, 模块) -> 预取失败时的输入哈希：同一输入不再自动重试
+        self._failed: Dict[Tuple[str, str], str] = {}
+        self.claimed = 0
+        self.discarded = 0
+
+    # ---- 浪费预算 ----
+
+    def _wasted_tokens(self, now: float) -> int:
+        while self._wasted and self._wasted[0][0] < now - _WASTE_WINDOW_S:
+            self._wasted.popleft()
+        return sum(tokens for _t, tokens in self._wasted)
+
+    def _settle(self, job: Job, wasted: bool) -> None:
+        with self._lock:
+            prompt, _total = self._reserved.pop(job.id, (0, 0))
+            if not wasted:
+                return
+            self.discarded += 1
+            metrics = (job.result or {}).get("metrics") or {}
+            if job.status == "done":
+                tokens = int(metrics.get("prompt_tokens", 0)) + int(metrics.get("completion_tokens", 0))
+            elif job.status == "queued":
+                tokens = 0
+            else:
+                # 运行中被取消或失败：按输入估算 + 已收到的部分输出计
+                tokens = prompt + estimate_tokens(job.snapshot()["partial"])
+            if tokens:
+                self._wasted.append((time.monotonic(), tokens))
+
+    def _discard(self, job: Job) -> None:
+        if self.jobs.discard(job):
+            self._settle(job, wasted=True)
+
+    # ---- 认领与丢弃 ----
+
+    def claim(self, project: Project, module: str, module_input: str) -> Optional[Job]:
+        """
+        Speculative job for this exact run, if any. A finished one is returned already marked applied
+        (apply it with apply_job); a running one has become the module's regular active job.
+        Non-matching or failed speculative jobs for the module are discarded.
+        """
+        project_id = project["meta"].get("project_id") or ""
+        found: Optional[Job] = None
+        for job in self.jobs.speculative(project_id):
+            if job.module != module:
+                continue
+            usable = job.status not in ("failed", "cancelled") and _matches(job, project, module_input)
+            if usable and found is None and self.jobs.claim(job):
+                found = job
+                with self._lock:
+                    self.claimed += 1
+                self._settle(job, wasted=False)
+            else:
+                self._discard(job)
+        return found
+
+    def drop(self, project: Project, module: str) -> None:
+        """Discard every speculative job of the module (e.g. before "重新生成", which wants a fresh result)."""
+        for job in self.jobs.speculative(project["meta"].get("project_id") or ""):
+            if job.module == module:
+                self._discard(job)
+
+    def discard_stale(self, project: Project, purpose: str) -> List[Job]:
+        """Discard speculative jobs whose input or settings changed, or whose module no longer needs a run."""
+        if project.get("evicted"):
+            # 已释放的项目没有可比对的内容；重新载入后的下一次调用再判断
+            return []
+        project_id = project["meta"].get("project_id") or ""
+        enabled = bool(project["settings"].get("prefetch"))
+        stale = set(stale_modules(project, purpose))
+        dropped: List[Job] = []
+        for job in self.jobs.speculative(project_id):
+            module = job.module
+            if job.status == "failed":
+                with self._lock:
+                    self._failed[(project_id, module)] = text_hash(job.module_input)
+            keep = (
+                job.status != "failed"
+                and enabled
+                and module in WORKFLOW_PREV.get(purpose, {})
+                and (not has_current(project, module) or module in stale)
+                and self.jobs.active(project_id, module) is None
+                and _matches(job, project, get_module_input(project, module, purpose))
+            )
+            if not keep:
+                self._discard(job)
+                dropped.append(job)
+        with self._lock:
+            # 任务被清理（保留期已过）而未认领的预留也记为浪费
+            gone = [job_id for job_id in self._reserved if self.jobs.get(job_id) is None]
+            now = time.monotonic()
+            for job_id in gone:
+                self._wasted.append((now, self._reserved.pop(job_id)[1]))
+                self.discarded += 1
+        return dropped
+
+    # ---- 触发 ----
+
+    def _candidate(self, project: Project, purpose: str) -> Optional[Tuple[str, str]]:
+        chain = WORKFLOW_PREV.get(purpose, WORKFLOW_PREV["公众号深度访谈"])
+        project_id = project["meta"].get("project_id") or ""
+        stale = set(stale_modules(project, purpose))
+        for module, prev in chain.items():
+            if prev is None or not has_current(project, prev) or prev in stale:
+                continue
+            if has_current(project, module) and module not in stale:
+                continue
+            if self.jobs.active(project_id, prev) is not None or self.jobs.active(project_id, module) is not None:
+                # 上游还在生成，或用户已经在跑这个模块
+                return None
+            return module, get_module_input(project, module, purpose)
+        return None
+
+    def tick(self, project: Project, purpose: str) -> Dict[str, Any]:
+        """
+        Called periodically while the project is open: discards stale speculation and, once the
+        next module's input has been idle long enough, starts a speculative run within the waste cap.
+        Returns {"module", "state": idle|waiting|running|ready|budget, "wait_s"}; module is None when
+        there is nothing to prefetch (also while the project is evicted from memory).
+        """
+        if project.get("evicted"):
+            return {"module": None, "state": "idle", "wait_s": 0.0}
+        self.discard_stale(project, purpose)
+        project_id = project["meta"].get("project_id") or ""
+        if not project["settings"].get("prefetch") or not project_id:
+            return {"module": None, "state": "idle", "wait_s": 0.0}
+        candidate = self._candidate(project, purpose)
+        if candidate is None:
+            return {"module": None, "state": "idle", "wait_s": 0.0}
+        module, module_input = candidate
+        for job in self.jobs.speculative(project_id):
+            if job.module == module:
+                return {"module": module, "state": "running" if job.active else "ready", "wait_s": 0.0}
+
+        now = time.monotonic()
+        digest = text_hash(module_input)
+        with self._lock:
+            if self._failed.get((project_id, module)) == digest:
+                return {"module": module, "state": "idle", "wait_s": 0.0}
+            seen = self._seen.get((project_id, module))
+            if seen is None or seen[0] != digest:
+                seen = (digest, now)
+                self._seen[(project_id, module)] = seen
+        wait_s = self.idle_s - (now - seen[1])
+        if wait_s > 0:
+            return {"module": module, "state": "waiting", "wait_s": wait_s}
+
+        plan = plan_budget(module, module_input, project["settings"])
+        if plan.warnings:
+            # 可能超出上下文或被截断：交给用户决定，不做推测
+            return {"module": module, "state": "idle", "wait_s": 0.0}
+        estimate = plan.prompt_tokens + plan.expected_output_tokens
+        with self._lock:
+            committed = self._wasted_tokens(now) + sum(total for _p, total in self._reserved.values())
+            if committed + estimate > self.max_waste:
+                return {"module": module, "state": "budget", "wait_s": 0.0}
+            try:
+                job = self.jobs.submit(project, module, module_input, speculative=True)
+            except ValueError:
+                return {"module": module, "state": "idle", "wait_s": 0.0}
+            self._reserved[job.id] = (plan.prompt_tokens, estimate)
+            self._seen.pop((project_id, module), None)
+        return {"module": module, "state": "running", "wait_s": 0.0}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "claimed": self.claimed,
+                "discarded": self.discarded,
+                "wasted_tokens": self._wasted_tokens(time.monotonic()),
+                "reserved_tokens": sum(total for _p, total in self._reserved.values()),
+                "max_waste": self.max_waste,
+            }
+
+
+_PREFETCHER: Optional[Prefetcher] = None
+_PREFETCHER_LOCK = threading.Lock()
+
+
+def get_prefetcher() -> Prefetcher:
+    global _PREFETCHER
+    with _PREFETCHER_LOCK:
+        if _PREFETCHER is None:
+            _PREFETCHER = Prefetcher(get_jobs())
+        return _PREFETCHER
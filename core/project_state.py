@@ -1,44 +1,89 @@
 from __future__ import annotations
 
+import hashlib
+import uuid
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, TypedDict
 
+from core.preclean import preclean
+from core.version_store import Delta, apply_delta, delta_size, encode_delta
 
-class HistoryItem(TypedDict):
+
+class _HistoryFields(TypedDict):
     version_id: str
     text: str
     time: str
     settings: Dict[str, Any]
 
 
+class HistoryItem(_HistoryFields, total=False):
+    # 生成该版本的那次运行：各阶段耗时、tokens 与费用（core.metrics.RunMetrics.to_dict）
+    metrics: Dict[str, Any]
+
+
+class StoredHistoryItem(HistoryItem, total=False):
+    # 有 delta 时 text 为空，正文由上一版本 + delta 还原；没有 delta 的是完整快照
+    delta: Optional[Delta]
+    # 持久化项目：内存里只留元数据，text/delta 打开时才从数据库读取
+    lazy: bool
+
+
 class ModuleState(TypedDict):
     current: str
-    history: List[HistoryItem]
+    history: List[StoredHistoryItem]
+
+
+class SegmentRecord(TypedDict):
+    hash: str
+    output: str
+
+
+class CueRecord(TypedDict):
+    start: float
+    end: float
+    text: str
 
 
 class Project(TypedDict):
     meta: Dict[str, Any]
     settings: Dict[str, Any]
     input_raw: str
+    # 字幕上传（srt/vtt）时保留的原始时间轴，用于把模块A/E输出对齐回字幕；其他格式为空
+    input_cues: List[CueRecord]
     A: ModuleState
     B: ModuleState
     C: ModuleState
     D: ModuleState
     E: ModuleState
     version_counter: Dict[str, int]
+    # 模块A增量处理：逐字稿分段哈希 -> 该段的A输出
+    a_segments: List[SegmentRecord]
+    # 每个模块生成时所用输入的哈希，用于判断上游改动后是否过期
+    source_hashes: Dict[str, str]
+    # 每个模块当前稿最近一次生成的运行指标，保存版本时随版本一起存下
+    run_metrics: Dict[str, Dict[str, Any]]
 
 
 MODULES = ("A", "B", "C", "D", "E")
 
+# 每隔若干版本存一次完整快照，限制还原时需要回放的增量条数
+SNAPSHOT_EVERY = 10
+# 单个项目历史版本的默认内存预算（字符数），可用 settings["history_budget_chars"] 覆盖
+HISTORY_BUDGET_CHARS = 2_000_000
+
 
 def _now_iso() -> str:
     return datetime.now(timezone.utc).isoformat(timespec="seconds")
 
 
-def create_empty_project() -> Project:
+def create_empty_project(*, persist: bool = False) -> Project:
+    """
+    persist=True gives the project an id and backs it with the SQLite store (core.persistence):
+    versions are written as they are saved and history texts are loaded lazily.
+    """
     empty_module: ModuleState = {"current": "", "history": []}
-    return {
+    project: Project = {
         "meta": {
             "title": "",
             "lang": "zh",
@@ -50,16 +95,39 @@ def create_empty_project() -> Project:
             "model_name": "deepseek-chat",
             "temperature": 0.2,
             "max_tokens": 4096,
+            # 按输入规模和模块类型自动设定 max_tokens（关闭时用 max_tokens）
+            "auto_max_tokens": True,
+            # 所选服务失败/不健康时切换到其他已配置的服务；hedge：主服务过慢时并发一个备用请求
+            "fallback": True,
+            "hedge": False,
+            # prefix：输入在前、模块指令在后，重跑与兄弟模块共享服务端前缀缓存；legacy：旧模板顺序
+            "prompt_layout": "prefix",
             "strict_no_add": True,
+            # 模块A前的本地预清洗：口头禅、重复、术语、说话人标签（core/preclean_rules.json）
+            "preclean": True,
+            # 模块A分块并行：长逐字稿按说话人切块、并发生成后合并
+            "chunked": False,
+            "chunk_tokens": 6000,
+            "chunk_workers": 4,
+            # 上游结果停留片刻未改动时，在后台预先生成下一模块（core/prefetch.py）
+            "prefetch": False,
         },
         "input_raw": "",
+        "input_cues": [],
         "A": {"current": "", "history": []},
         "B": {"current": "", "history": []},
         "C": {"current": "", "history": []},
         "D": {"current": "", "history": []},
         "E": {"current": "", "history": []},
         "version_counter": {m: 0 for m in MODULES},
+        "a_segments": [],
+        "source_hashes": {},
+        "run_metrics": {},
     }
+    if persist:
+        project["meta"]["project_id"] = uuid.uuid4().hex
+        sync_project(project)
+    return project
 
 
 # 按发稿用途的模块依赖：公众号 A->B->C，播客 A->B->E，社媒 A->B->C->D
@@ -70,12 +138,22 @@ WORKFLOW_PREV: dict[str, dict[str, str | None]] = {
 }
 
 
+def source_text(project: Project) -> str:
+    """
+    Input of the first module: the raw transcript, locally pre-cleaned when settings["preclean"] is on.
+    Projects saved before the option existed keep the raw transcript, so their module A does not turn stale.
+    """
+    if not project["settings"].get("preclean", False):
+        return project["input_raw"]
+    return preclean(project["input_raw"], project["meta"].get("speakers")).text
+
+
 def get_module_input(project: Project, module_name: str, purpose: str | None = None) -> str:
     purpose = purpose or project["meta"].get("purpose", "公众号深度访谈")
     chain = WORKFLOW_PREV.get(purpose, WORKFLOW_PREV["公众号深度访谈"])
     prev = chain.get(module_name)
     if prev is None:
-        return project["input_raw"]
+        return source_text(project)
     return project.get(prev, {}).get("current", "")
 
 
@@ -83,36 +161,258 @@ def has_current(project: Project, module_name: str) -> bool:
     return bool(project[module_name]["current"].strip())
 
 
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:16]
+
+
+def mark_generated(
+    project: Project, module_name: str, input_text: str, metrics: Optional[Dict[str, Any]] = None
+) -> None:
+    """Record which input a module's current output was generated from, and how the run went."""
+    project.setdefault("source_hashes", {})[module_name] = text_hash(input_text)
+    if metrics is not None:
+        project.setdefault("run_metrics", {})[module_name] = metrics
+    else:
+        project.get("run_metrics", {}).pop(module_name, None)
+
+
+def stale_modules(project: Project, purpose: str | None = None) -> List[str]:
+    """
+    Modules whose output was generated from an input that has since changed
+    (re-uploaded transcript, incremental A update, manual upstream edits).
+    """
+    purpose = purpose or project["meta"].get("purpose", "公众号深度访谈")
+    chain = WORKFLOW_PREV.get(purpose, WORKFLOW_PREV["公众号深度访谈"])
+    recorded = project.get("source_hashes", {})
+    stale: List[str] = []
+    for module in chain:
+        h = recorded.get(module)
+        if h and has_current(project, module) and h != text_hash(get_module_input(project, module, purpose)):
+            stale.append(module)
+    return stale
+
+
 def next_version_id(project: Project, module_name: str) -> str:
     project["version_counter"][module_name] += 1
     return f"{module_name}-{project['version_counter'][module_name]}"
 
 
+def _store(project: Project):
+    if not project["meta"].get("project_id"):
+        return None
+    from core.persistence import get_store
+
+    return get_store()
+
+
+def _is_snapshot(item: StoredHistoryItem) -> bool:
+    return "delta" not in item
+
+
+def _item_size(item: StoredHistoryItem) -> int:
+    if item.get("lazy"):
+        return 0
+    return delta_size(item["delta"] or []) if "delta" in item else len(item["text"])
+
+
+def _payload(project: Project, module_name: str, item: StoredHistoryItem) -> Tuple[str, Optional[Delta]]:
+    if item.get("lazy"):
+        return _store(project).load_payload(project["meta"]["project_id"], module_name, item["version_id"])
+    return item["text"], item.get("delta")
+
+
+def _materialize(project: Project, module_name: str, index: int) -> str:
+    history = project[module_name]["history"]
+    start = index
+    while start > 0 and not _is_snapshot(history[start]):
+        start -= 1
+    text, _ = _payload(project, module_name, history[start])
+    for item in history[start + 1 : index + 1]:
+        text = apply_delta(text, _payload(project, module_name, item)[1] or [])
+    return text
+
+
+def _find(history: List[StoredHistoryItem], version_id: str) -> int:
+    for idx in range(len(history) - 1, -1, -1):
+        if history[idx]["version_id"] == version_id:
+            return idx
+    return -1
+
+
+def history_chars(project: Project) -> int:
+    return sum(_item_size(item) for m in MODULES for item in project[m]["history"])
+
+
+def _drop_oldest(project: Project, module_name: str) -> None:
+    # 删除最旧版本前，把紧随其后的增量版本还原成快照，保证后续链条可还原
+    history = project[module_name]["history"]
+    if len(history) > 1 and not _is_snapshot(history[1]):
+        text = _materialize(project, module_name, 1)
+        rebased: StoredHistoryItem = {k: v for k, v in history[1].items() if k != "delta"}  # type: ignore[assignment]
+        rebased["text"] = text
+        history[1] = rebased
+    del history[0]
+
+
+def enforce_history_budget(project: Project, budget_chars: Optional[int] = None) -> int:
+    """
+    Evict the oldest versions (across modules, oldest first) until the stored history fits the budget.
+    The newest version of every module is always kept. Returns the number of evicted versions.
+    """
+    budget = budget_chars or int(project["settings"].get("history_budget_chars", HISTORY_BUDGET_CHARS))
+    total = history_chars(project)
+    evicted = 0
+    while total > budget:
+        candidates: List[Tuple[str, str]] = [
+            (project[m]["history"][0]["time"], m) for m in MODULES if len(project[m]["history"]) > 1
+        ]
+        if not candidates:
+            break
+        _time, module = min(candidates)
+        history = project[module]["history"]
+        before = _item_size(history[0]) + (_item_size(history[1]) if len(history) > 1 else 0)
+        _drop_oldest(project, module)
+        total -= before - _item_size(history[0])
+        evicted += 1
+    return evicted
+
+
 def save_version(
     project: Project,
     module_name: str,
     text: str,
     settings_snapshot: Dict[str, Any],
 ) -> HistoryItem:
-    item: HistoryItem = {
+    history = project[module_name]["history"]
+    item: StoredHistoryItem = {
         "version_id": next_version_id(project, module_name),
         "text": text,
         "time": _now_iso(),
         "settings": settings_snapshot,
     }
-    project[module_name]["history"].append(item)
+    # 这次运行的指标只挂到它之后保存的第一个版本上
+    metrics = project.get("run_metrics", {}).get(module_name)
+    if metrics is not None and not metrics.get("saved_as"):
+        item["metrics"] = dict(metrics)
+        metrics["saved_as"] = item["version_id"]
+    stored: StoredHistoryItem = dict(item)  # type: ignore[assignment]
+    if history:
+        since_snapshot = 0
+        for prev in reversed(history):
+            if _is_snapshot(prev):
+                break
+            since_snapshot += 1
+        if since_snapshot + 1 < SNAPSHOT_EVERY:
+            delta = encode_delta(_materialize(project, module_name, len(history) - 1), text)
+            # 改动过大时增量不划算，直接存快照
+            if delta_size(delta) < len(text) // 2:
+                stored["text"] = ""
+                stored["delta"] = delta
     project[module_name]["current"] = text
+
+    store = _store(project)
+    if store is not None:
+        # 只追加这一条版本 + 同步有变化的字段；内存里只保留元数据
+        store.append_version(project["meta"]["project_id"], module_name, stored)
+        stored = {**stored, "text": "", "lazy": True}  # type: ignore[typeddict-item]
+        if "delta" in stored:
+            stored["delta"] = None
+        history.append(stored)
+        sync_project(project)
+        return item
+
+    history.append(stored)
+    enforce_history_budget(project)
     return item
 
 
+def version_text(project: Project, module_name: str, version_id: str) -> Optional[str]:
+    idx = _find(project[module_name]["history"], version_id)
+    return _materialize(project, module_name, idx) if idx >= 0 else None
+
+
+def iter_versions(project: Project, module_name: str) -> Iterator[HistoryItem]:
+    """Materialize history versions oldest-first, one at a time (lazy payloads are read as needed)."""
+    text = ""
+    for item in list(project[module_name]["history"]):
+        item_text, delta = _payload(project, module_name, item)
+        text = apply_delta(text, delta or []) if "delta" in item else item_text
+        out: HistoryItem = {
+            "version_id": item["version_id"],
+            "text": text,
+            "time": item["time"],
+            "settings": item["settings"],
+        }
+        if item.get("metrics"):
+            out["metrics"] = item["metrics"]
+        yield out
+
+
 def list_versions(project: Project, module_name: str) -> List[HistoryItem]:
-    return list(project[module_name]["history"])
+    return list(iter_versions(project, module_name))
 
 
 def rollback_to_version(project: Project, module_name: str, version_id: str) -> Optional[HistoryItem]:
-    for item in reversed(project[module_name]["history"]):
-        if item["version_id"] == version_id:
-            project[module_name]["current"] = item["text"]
-            return item
-    return None
+    history = project[module_name]["history"]
+    idx = _find(history, version_id)
+    if idx < 0:
+        return None
+    item = history[idx]
+    text = _materialize(project, module_name, idx)
+    project[module_name]["current"] = text
+    project.get("run_metrics", {}).pop(module_name, None)
+    if _store(project) is not None:
+        sync_project(project)
+    return {"version_id": item["version_id"], "text": text, "time": item["time"], "settings": item["settings"]}
+
+
+def sync_project(project: Project) -> int:
+    """Write the fields of a persisted project that changed since the last write (no-op otherwise)."""
+    store = _store(project)
+    if store is None:
+        return 0
+    store.touch(project)
+    return store.sync(project, MODULES)
+
+
+def load_project(project_id: str) -> Optional[Project]:
+    """Load a persisted project; history versions stay on disk until opened."""
+    from core.persistence import get_store
+
+    store = get_store()
+    project = store.load(project_id, MODULES)
+    if project is not None:
+        store.touch(project)
+    return project  # type: ignore[return-value]
+
+
+def ensure_loaded(project: Project) -> Project:
+    """Reload a project that evict_idle_projects() stripped from memory (in place)."""
+    if project.get("evicted"):
+        from core.persistence import get_store
+
+        get_store().reload_into(project, MODULES)  # type: ignore[arg-type]
+    return project
+
+
+def hold_project(project: Project, release: Callable[[Project], None]) -> None:
+    """
+    Register the session holding `project`: on eviction release(stub) must swap the stub in for
+    the project wherever the session keeps it (the project dict itself is left intact).
+    """
+    store = _store(project)
+    if store is not None:
+        store.touch(project, release)  # type: ignore[arg-type]
+
+
+def _has_active_jobs(project_id: str) -> bool:
+    from core.jobs import get_jobs
+
+    return any(job.active for job in get_jobs().for_project(project_id))
+
+
+def evict_idle_projects(max_idle_s: float) -> int:
+    """Release idle projects from their sessions (see ProjectStore.evict_idle); projects with running jobs stay."""
+    from core.persistence import get_store
 
+    return get_store().evict_idle(max_idle_s, MODULES, busy=_has_active_jobs)
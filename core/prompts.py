@@ -1,3 +1,5 @@
+import re
+
 SYSTEM_PROMPT = """你是一名媒体总编，负责执行“AI访谈自动编辑系统”。
 用户会提供一段采访逐字稿。你必须严格按模块A→模块E顺序执行。
 每个模块必须单独输出，不能合并。
@@ -118,3 +120,35 @@ MODULE_PROMPTS = {
     "E": PROMPT_E_TEMPLATE,
 }
 
+
+
+# 前缀缓存友好的消息布局：SYSTEM_PROMPT → 输入正文 → 模块指令。
+# 服务端按前缀复用已计算的 KV（DeepSeek / OpenAI / Qwen 均为自动前缀缓存），
+# 同一输入的重新生成与兄弟模块（如都以 B 为输入的 C 和 E）共享“系统规则 + 输入正文”这段最长前缀，
+# 只有末尾的模块指令不同。
+SOURCE_BLOCK_TEMPLATE = """以下是本次要处理的输入文本（处理要求在文本之后给出）：
+<<<输入开始>>>
+{input_text}
+<<<输入结束>>>
+
+"""
+
+_TRAILER_RE = re.compile(r"\n*[^\n]*如下：\n\{input_text\}\n*$")
+
+
+def _instructions(template: str) -> str:
+    # 模板末尾“……如下：{input_text}”换成指向上文的说明
+    return _TRAILER_RE.sub("", template).rstrip() + "\n\n请对上面给出的输入文本执行以上要求。\n"
+
+
+MODULE_INSTRUCTIONS = {name: _instructions(tmpl) for name, tmpl in MODULE_PROMPTS.items()}
+
+
+def build_user_prompt(module_name: str, input_text: str, *, layout: str = "prefix") -> str:
+    """
+    User message for one module run. layout="prefix" (default): input first, instructions last;
+    layout="legacy": the original template with instructions before the input.
+    """
+    if layout == "legacy":
+        return MODULE_PROMPTS[module_name].format(input_text=input_text)
+    return SOURCE_BLOCK_TEMPLATE.format(input_text=input_text) + MODULE_INSTRUCTIONS[module_name]
@@ -0,0 +1,360 @@
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field, fields
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+from core.llm_client import CallStats, ChatClient, LLMError, _env_float
+
+# 统计窗口：最近 100 次请求、10 分钟内
+_STATS_WINDOW = 100
+_STATS_MAX_AGE_S = 600.0
+# 连续失败达到该次数后，冷却期内不再优先选它
+_FAIL_STREAK = 3
+_COOLDOWN_S = 30.0
+_MIN_SAMPLES = 4
+
+
+@dataclass
+class ProviderConfig:
+    """One OpenAI-compatible endpoint. `models` maps the app's model names to this provider's names."""
+
+    name: str
+    label: str
+    base_url: str
+    api_key_env: str = ""
+    key_required: bool = True
+    path: str = "/chat/completions"
+    models: Dict[str, str] = field(default_factory=dict)
+    default_model: str = ""
+    aliases: Tuple[str, ...] = ()
+    # 未显式配置（如本地服务没设地址）时不参与自动切换，只在用户选中时使用
+    configured: bool = True
+
+    def api_key(self) -> str:
+        return os.getenv(self.api_key_env, "") if self.api_key_env else ""
+
+    @property
+    def available(self) -> bool:
+        return self.configured and (not self.key_required or bool(self.api_key()))
+
+    def model_for(self, model: str) -> str:
+        return self.models.get(model) or self.default_model or model
+
+
+def builtin_providers() -> List[ProviderConfig]:
+    return [
+        ProviderConfig(
+            name="deepseek",
+            label="DeepSeek",
+            base_url=os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com"),
+            api_key_env="DEEPSEEK_API_KEY",
+            path="/v1/chat/completions",
+            aliases=("ds",),
+        ),
+        ProviderConfig(
+            name="openai",
+            label="OpenAI",
+            base_url=os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+            api_key_env="OPENAI_API_KEY",
+            default_model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"),
+        ),
+        ProviderConfig(
+            name="qwen",
+            label="Qwen",
+            base_url=os.getenv("QWEN_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1"),
+            api_key_env="QWEN_API_KEY",
+            default_model=os.getenv("QWEN_MODEL", "qwen-plus"),
+            aliases=("dashscope",),
+        ),
+        ProviderConfig(
+            name="local",
+            label="本地",
+            base_url=os.getenv("LOCAL_LLM_BASE_URL", "http://localhost:11434/v1"),
+            api_key_env="LOCAL_LLM_API_KEY",
+            key_required=False,
+            default_model=os.getenv("LOCAL_LLM_MODEL", "qwen2.5:7b-instruct"),
+            aliases=("ollama", "vllm"),
+            configured=bool(os.getenv("LOCAL_LLM_BASE_URL")),
+        ),
+    ]
+
+
+def load_provider_file(path: Path) -> List[ProviderConfig]:
+    """
+    Extra / overriding providers from JSON: [{"name", "label"?, "base_url", "api_key_env"?, "path"?,
+    "models"?, "default_model"?, "key_required"?, "aliases"?}, ...]
+    """
+    out: List[ProviderConfig] = []
+    for item in json.loads(path.read_text(encoding="utf-8")):
+        out.append(
+            ProviderConfig(
+                name=item["name"].strip().lower(),
+                label=item.get("label", item["name"]),
+                base_url=item["base_url"],
+                api_key_env=item.get("api_key_env", ""),
+                key_required=bool(item.get("key_required", bool(item.get("api_key_env")))),
+                path=item.get("path", "/chat/completions"),
+                models=dict(item.get("models", {})),
+                default_model=item.get("default_model", ""),
+                aliases=tuple(a.lower() for a in item.get("aliases", [])),
+            )
+        )
+    return out
+
+
+class ProviderStats:
+    """Rolling latency / error window for one provider."""
+
+    def __init__(self) -> None:
+        self._samples: Deque[Tuple[float, float, bool]] = deque(maxlen=_STATS_WINDOW)
+        self.fail_streak = 0
+        self.last_failure = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, latency_s: float, ok: bool) -> None:
+        now = time.time()
+        with self._lock:
+            self._samples.append((now, latency_s, ok))
+            if ok:
+                self.fail_streak = 0
+            else:
+                self.fail_streak += 1
+                self.last_failure = now
+
+    def snapshot(self) -> Dict[str, Any]:
+        cutoff = time.time() - _STATS_MAX_AGE_S
+        with self._lock:
+            recent = [s for s in self._samples if s[0] >= cutoff]
+            streak, last_failure = self.fail_streak, self.last_failure
+        latencies = sorted(lat for _t, lat, ok in recent if ok)
+        errors = sum(1 for _t, _lat, ok in recent if not ok)
+
+        def _pct(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return latencies[min(len(latencies) - 1, int(q * len(latencies)))]
+
+        return {
+            "samples": len(recent),
+            "p50": _pct(0.5),
+            "p95": _pct(0.95),
+            "error_rate": errors / len(recent) if recent else 0.0,
+            "fail_streak": streak,
+            "cooling": streak >= _FAIL_STREAK and time.time() - last_failure < _COOLDOWN_S,
+        }
+
+
+def _copy_stats(src: CallStats, dst: Optional[CallStats]) -> None:
+    if dst is not None:
+        for f in fields(CallStats):
+            setattr(dst, f.name, getattr(src, f.name))
+
+
+def _healthy(snap: Dict[str, Any]) -> bool:
+    if snap["cooling"]:
+        return False
+    return snap["samples"] < _MIN_SAMPLES or snap["error_rate"] < 0.5
+
+
+class ProviderRegistry:
+    """
+    Providers by name, one pooled client each, plus rolling stats used for routing:
+
+    - the selected provider is tried first unless it is unhealthy (cooling down after repeated
+      failures, or >= 50% errors in the window); healthy alternatives follow, fastest p95 first;
+    - with fallback, a failed request moves on to the next provider;
+    - with hedging (non-streaming only), a second request to the next provider starts once the first
+      has run longer than the primary's p95 (or LLM_HEDGE_AFTER_S); the first success wins.
+    """
+
+    def __init__(self, configs: List[ProviderConfig]) -> None:
+        self._configs: Dict[str, ProviderConfig] = {}
+        self._aliases: Dict[str, str] = {}
+        for cfg in configs:
+            self._configs[cfg.name] = cfg
+            for alias in (cfg.name, *cfg.aliases):
+                self._aliases[alias] = cfg.name
+        self._clients: Dict[str, ChatClient] = {}
+        self._stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in self._configs}
+        self._lock = threading.Lock()
+        self._hedge_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+    # ---- 查询 ----
+
+    def resolve(self, provider: str) -> str:
+        name = self._aliases.get((provider or "").strip().lower())
+        if name is None:
+            raise LLMError(f"Unsupported provider: {provider}")
+        return name
+
+    def config(self, provider: str) -> ProviderConfig:
+        return self._configs[self.resolve(provider)]
+
+    def names(self) -> List[str]:
+        return list(self._configs)
+
+    def client(self, provider: str) -> ChatClient:
+        name = self.resolve(provider)
+        with self._lock:
+            client = self._clients.get(name)
+            if client is None:
+                cfg = self._configs[name]
+                if cfg.key_required and not cfg.api_key():
+                    raise LLMError(f"Missing {cfg.api_key_env}")
+                client = ChatClient(name=cfg.label, base_url=cfg.base_url, api_key=cfg.api_key(), path=cfg.path)
+                self._clients[name] = client
+            return client
+
+    def health(self) -> Dict[str, Dict[str, Any]]:
+        return {name: self._stats[name].snapshot() for name in self._configs}
+
+    def candidates(self, provider: str, *, fallback: bool = True) -> List[str]:
+        primary = self.resolve(provider)
+        if not fallback:
+            return [primary]
+        snaps = self.health()
+        others = [n for n, cfg in self._configs.items() if n != primary and cfg.available and _healthy(snaps[n])]
+        others.sort(key=lambda n: snaps[n]["p95"] if snaps[n]["p95"] is not None else float("inf"))
+        if _healthy(snaps[primary]) or not others:
+            return [primary, *others]
+        return [*others, primary]
+
+    # ---- 调用 ----
+
+    def _call(self, name: str, request: Dict[str, Any], stats: Optional[CallStats] = None) -> str:
+        cfg = self._configs[name]
+        payload = {**request, "model": cfg.model_for(request["model"])}
+        # 每次尝试单独计量，只有成功的那次写回调用方的 stats
+        attempt = CallStats(provider=name)
+        t0 = time.monotonic()
+        try:
+            text = self.client(name).chat(**payload, stats=attempt)
+        except LLMError:
+            self._stats[name].record(time.monotonic() - t0, False)
+            raise
+        self._stats[name].record(time.monotonic() - t0, True)
+        _copy_stats(attempt, stats)
+        return text
+
+    def _hedge_after_s(self, name: str) -> float:
+        fixed = _env_float("LLM_HEDGE_AFTER_S", 0.0)
+        if fixed > 0:
+            return fixed
+        snap = self._stats[name].snapshot()
+        return max(5.0, snap["p95"]) if snap["p95"] is not None and snap["samples"] >= _MIN_SAMPLES else 30.0
+
+    def chat(
+        self,
+        provider: str,
+        *,
+        fallback: bool = True,
+        hedge: bool = False,
+        stats: Optional[CallStats] = None,
+        **request: Any,
+    ) -> str:
+        order = self.candidates(provider, fallback=fallback)
+        last_error: Optional[LLMError] = None
+        i = 0
+        while i < len(order):
+            name = order[i]
+            if hedge and i + 1 < len(order):
+                try:
+                    return self._hedged(name, order[i + 1], request, stats)
+                except LLMError as e:
+                    last_error = e
+                    i += 2
+                    continue
+            try:
+                return self._call(name, request, stats)
+            except LLMError as e:
+                last_error = e
+                i += 1
+        assert last_error is not None
+        raise last_error
+
+    def _hedged(self, primary: str, backup: str, request: Dict[str, Any], stats: Optional[CallStats]) -> str:
+        # 两路各自计量，胜出的一路写回 stats
+        slots = {primary: CallStats(), backup: CallStats()}
+        first: Future = self._hedge_pool.submit(self._call, primary, request, slots[primary])
+        done, _ = wait([first], timeout=self._hedge_after_s(primary))
+        if done and first.exception() is None:
+            return self._won(first, slots[primary], stats)
+        pending = [first] if not done else []
+        second: Future = self._hedge_pool.submit(self._call, backup, request, slots[backup])
+        pending.append(second)
+        errors: List[BaseException] = [first.exception()] if done else []
+        while pending:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                if fut.exception() is None:
+                    # 另一路不等了；它完成后照常计入统计
+                    return self._won(fut, slots[primary if fut is first else backup], stats)
+                errors.append(fut.exception())
+            pending = list(not_done)
+        raise errors[-1] if isinstance(errors[-1], LLMError) else LLMError(str(errors[-1]))
+
+    @staticmethod
+    def _won(fut: Future, slot: CallStats, stats: Optional[CallStats]) -> str:
+        text = fut.result()
+        _copy_stats(slot, stats)
+        return text
+
+    def chat_stream(
+        self,
+        provider: str,
+        *,
+        fallback: bool = True,
+        stats: Optional[CallStats] = None,
+        **request: Any,
+    ) -> Iterator[str]:
+        """Fails over only before the first delta; an error mid-stream goes to the caller."""
+        last_error: Optional[LLMError] = None
+        for name in self.candidates(provider, fallback=fallback):
+            cfg = self._configs[name]
+            payload = {**request, "model": cfg.model_for(request["model"])}
+            attempt = CallStats(provider=name)
+            t0 = time.monotonic()
+            try:
+                stream = self.client(name).chat_stream(**payload, stats=attempt)
+                first = next(stream, None)
+            except LLMError as e:
+                self._stats[name].record(time.monotonic() - t0, False)
+                last_error = e
+                continue
+            if first is not None:
+                yield first
+            try:
+                yield from stream
+            except LLMError:
+                self._stats[name].record(time.monotonic() - t0, False)
+                raise
+            self._stats[name].record(time.monotonic() - t0, True)
+            _copy_stats(attempt, stats)
+            return
+        assert last_error is not None
+        raise last_error
+
+
+_REGISTRY: Optional[ProviderRegistry] = None
+_REGISTRY_LOCK = threading.Lock()
+
+
+def get_registry() -> ProviderRegistry:
+    """Process-wide registry: built-in providers plus env LLM_PROVIDERS_FILE (JSON) if set."""
+    global _REGISTRY
+    with _REGISTRY_LOCK:
+        if _REGISTRY is None:
+            configs = {cfg.name: cfg for cfg in builtin_providers()}
+            extra = os.getenv("LLM_PROVIDERS_FILE")
+            if extra:
+                for cfg in load_provider_file(Path(extra)):
+                    configs[cfg.name] = cfg
+            _REGISTRY = ProviderRegistry(list(configs.values()))
+        return _REGISTRY
@@ -1,60 +1,231 @@
 from __future__ import annotations
 
-from typing import Any, Dict, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from core.llm_client import LLMError, get_client
-from core.prompts import MODULE_PROMPTS, SYSTEM_PROMPT
+from core.budget import request_max_tokens
+from core.cache import get_response_cache, request_key
+from core.chunking import merge_chunk_outputs, split_transcript
+from core.governor import Lane, get_governor
+from core.llm_client import CallStats, LLMError
+from core.metrics import RunMetrics
+from core.post_check import check_text
+from core.prompts import MODULE_PROMPTS, SYSTEM_PROMPT, build_user_prompt
+from core.providers import get_registry
 
+# 分块模式只用于模块A：A 是逐段清洗，切开后各块互不依赖
+CHUNKABLE_MODULES = ("A",)
 
-def post_check(output_text: str) -> Tuple[bool, str]:
+ProgressCallback = Callable[[int, int], None]
+
+
+def post_check(output_text: str, lang: Optional[str] = None) -> Tuple[bool, str]:
     """
-    MVP heuristic checks.
-    Returns (ok, message). If ok is False, message explains the risk.
+    Rule-file driven red-flag check (core/post_check_rules.json), all hits in one pass, using the
+    rules for the transcript language `lang` (project meta["lang"], carried as settings["lang"]).
+    Returns (ok, message). If ok is False, message lists every rule group and phrase that hit;
+    use core.post_check.check_text() for the individual spans.
     """
-    lowered = output_text.lower()
-    suspicious = [
-        "根据外部",
-        "引用外部",
-        "资料显示",
-        "research",
-        "source:",
-        "参考资料",
-        "来自网络",
-    ]
-    for s in suspicious:
-        if s.lower() in lowered:
-            return False, f"可能出现外部资料引用迹象：命中「{s}」"
-    return True, ""
+    report = check_text(output_text, lang)
+    return report.ok, report.summary()
 
 
-def run_module(
-    *,
-    module_name: str,
-    input_text: str,
-    settings: Dict[str, Any],
-) -> Dict[str, Any]:
-    prompt_tmpl = MODULE_PROMPTS.get(module_name)
-    if not prompt_tmpl:
+def _build_request(module_name: str, input_text: str, settings: Dict[str, Any]) -> Tuple[str, Dict[str, Any]]:
+    if module_name not in MODULE_PROMPTS:
         raise ValueError(f"Unknown module: {module_name}")
 
-    user_prompt = prompt_tmpl.format(input_text=input_text)
+    # 默认输入在前、指令在后，重新生成和同输入的兄弟模块可命中服务端前缀缓存
+    user_prompt = build_user_prompt(module_name, input_text, layout=str(settings.get("prompt_layout", "prefix")))
 
     provider = settings.get("model_provider", "deepseek")
     model = settings.get("model_name", "deepseek-chat")
     temperature = float(settings.get("temperature", 0.2))
-    max_tokens = int(settings.get("max_tokens", 4096))
+    # 开启自动长度时按输入规模为每个请求（含每个分块）单独估算
+    max_tokens = request_max_tokens(module_name, input_text, settings)
 
-    client = get_client(provider)
-    output = client.chat(
-        model=model,
-        messages=[
+    return provider, {
+        "model": model,
+        "messages": [
             {"role": "system", "content": SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt},
         ],
-        temperature=temperature,
-        max_tokens=max_tokens,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        # 限流排队用：按会话轮转，交互优先于批量（不参与缓存键）
+        "lane": Lane.from_settings(settings),
+    }
+
+
+def _generate(
+    module_name: str,
+    input_text: str,
+    settings: Dict[str, Any],
+    use_cache: bool = True,
+    metrics: Optional[RunMetrics] = None,
+) -> str:
+    provider, request = _build_request(module_name, input_text, settings)
+    cache = get_response_cache()
+    key = request_key(module_name, request)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            if metrics is not None:
+                metrics.add_cache_hit()
+            return cached
+    stats = CallStats()
+
+    def _chat() -> str:
+        # 失败时按设置切换到其他可用服务；hedge 在主服务过慢时并发一个备用请求
+        return get_registry().chat(
+            provider,
+            fallback=bool(settings.get("fallback", True)),
+            hedge=bool(settings.get("hedge", False)),
+            stats=stats,
+            **request,
+        )
+
+    if use_cache:
+        # 同一请求已在途（另一个会话在跑同一模块、同一输入）时直接等它的结果，不再重复请求
+        output, upstream = get_governor().flights.call(key, _chat)
+    else:
+        # 重新生成要的是新结果，不挂到在途的相同请求上
+        output, upstream = _chat(), True
+    if not upstream:
+        if metrics is not None:
+            metrics.add_coalesced()
+        return output
+    if metrics is not None:
+        metrics.add_call(stats)
+    # 绕过缓存（重新生成）时仍写回，下次同输入直接命中最新结果
+    cache.put(key, output)
+    return output
+
+
+def _generate_chunked(
+    module_name: str,
+    input_text: str,
+    settings: Dict[str, Any],
+    on_progress: Optional[ProgressCallback] = None,
+    use_cache: bool = True,
+    metrics: Optional[RunMetrics] = None,
+) -> str:
+    """
+    Map-reduce: split at speaker turns, run chunks on a bounded pool, merge in order.
+    on_progress(done, total) is called from the caller's thread (safe for Streamlit widgets).
+    """
+    chunks = split_transcript(
+        input_text,
+        max_tokens=int(settings.get("chunk_tokens", 6000)),
+        overlap_turns=int(settings.get("chunk_overlap_turns", 1)),
     )
+    total = len(chunks)
+    if on_progress:
+        on_progress(0, total)
+    if total <= 1:
+        out = _generate(module_name, input_text, settings, use_cache, metrics)
+        if on_progress:
+            on_progress(1, 1)
+        return out
+
+    workers = max(1, min(int(settings.get("chunk_workers", 4)), total))
+    outputs: List[str] = [""] * total
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"chunk-{module_name}") as pool:
+        futures = {
+            pool.submit(_generate, module_name, chunk, settings, use_cache, metrics): i for i, chunk in enumerate(chunks)
+        }
+        done = 0
+        try:
+            for fut in as_completed(futures):
+                outputs[futures[fut]] = fut.result()
+                done += 1
+                if on_progress:
+                    on_progress(done, total)
+        except BaseException:
+            for f in futures:
+                f.cancel()
+            raise
+    return merge_chunk_outputs(outputs)
+
+
+def run_module(
+    *,
+    module_name: str,
+    input_text: str,
+    settings: Dict[str, Any],
+    on_progress: Optional[ProgressCallback] = None,
+    use_cache: bool = True,
+    metrics: Optional[RunMetrics] = None,
+) -> Dict[str, Any]:
+    """
+    use_cache=False skips the response-cache lookup (used by "重新生成"); the fresh result is still stored.
+    Timings and token usage are returned under "metrics". Pass `metrics` to fold this run into a
+    caller-owned RunMetrics (e.g. incremental segments); the caller then finishes it.
+    """
+    own = metrics is None
+    run = metrics if metrics is not None else RunMetrics.start(module_name, settings)
+    if module_name in CHUNKABLE_MODULES and settings.get("chunked"):
+        output = _generate_chunked(module_name, input_text, settings, on_progress, use_cache, run)
+    else:
+        output = _generate(module_name, input_text, settings, use_cache, run)
+
+    with run.post_check_span():
+        ok, msg = post_check(output, settings.get("lang"))
+    return {
+        "text": output,
+        "post_check_ok": ok,
+        "post_check_msg": msg,
+        "metrics": run.finish() if own else run.to_dict(),
+    }
+
+
+def run_module_stream(
+    *,
+    module_name: str,
+    input_text: str,
+    settings: Dict[str, Any],
+    use_cache: bool = True,
+    metrics: Optional[RunMetrics] = None,
+) -> Iterator[str]:
+    """
+    Streaming variant of run_module: yields text deltas as the model produces them.
+    The caller joins them and runs post_check once the stream ends (inside metrics.post_check_span(),
+    then metrics.finish(), when it passes a RunMetrics).
+    A cache hit is yielded as a single delta.
+    """
+    provider, request = _build_request(module_name, input_text, settings)
+    cache = get_response_cache()
+    key = request_key(module_name, request)
+    if use_cache:
+        cached = cache.get(key)
+        if cached is not None:
+            if metrics is not None:
+                metrics.add_cache_hit()
+            yield cached
+            return
+    stats = CallStats()
+    parts: List[str] = []
 
-    ok, msg = post_check(output)
-    return {"text": output, "post_check_ok": ok, "post_check_msg": msg}
+    def _open() -> Iterator[str]:
+        return get_registry().chat_stream(
+            provider, fallback=bool(settings.get("fallback", True)), stats=stats, **request
+        )
 
+    if use_cache:
+        # 相同请求在途时共享同一条上游流，后来者从头收到已生成的部分
+        stream, upstream = get_governor().flights.stream(key, _open)
+    else:
+        # 重新生成：单独请求，不共享在途的流
+        stream, upstream = _open(), True
+    try:
+        for delta in stream:
+            parts.append(delta)
+            yield delta
+    finally:
+        stream.close()  # type: ignore[attr-defined]
+    # 只缓存完整结束的流；调用方中途关闭生成器时不会走到这里
+    if metrics is not None:
+        if upstream:
+            metrics.add_call(stats)
+        else:
+            metrics.add_coalesced()
+    cache.put(key, "".join(parts))
@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from core.incremental import run_module_a_incremental
+from core.project_state import WORKFLOW_PREV, Project, has_current, mark_generated, source_text
+from core.run_module import run_module
+
+ModuleOutcome = Dict[str, Any]
+DoneCallback = Callable[[str, ModuleOutcome], None]
+
+
+def build_dag(targets: Iterable[str], purposes: Optional[Iterable[str]] = None) -> Dict[str, Optional[str]]:
+    """
+    Union DAG (module -> prerequisite) of every WORKFLOW_PREV chain that contains a target,
+    restricted to the targets and their ancestors.
+    """
+    chains = [WORKFLOW_PREV[p] for p in purposes] if purposes else list(WORKFLOW_PREV.values())
+    prev_of: Dict[str, Optional[str]] = {}
+    for chain in chains:
+        for module, prev in chain.items():
+            if module in prev_of and prev_of[module] != prev:
+                raise ValueError(f"Conflicting prerequisites for module {module}: {prev_of[module]} vs {prev}")
+            prev_of[module] = prev
+
+    dag: Dict[str, Optional[str]] = {}
+    for target in targets:
+        if target not in prev_of:
+            raise ValueError(f"Module {target} is not part of the selected workflows")
+        node: Optional[str] = target
+        while node is not None and node not in dag:
+            dag[node] = prev_of[node]
+            node = prev_of[node]
+    return dag
+
+
+def _descendants(dag: Dict[str, Optional[str]], module: str) -> Set[str]:
+    out: Set[str] = set()
+    frontier = [module]
+    while frontier:
+        cur = frontier.pop()
+        for child, prev in dag.items():
+            if prev == cur and child not in out:
+                out.add(child)
+                frontier.append(child)
+    return out
+
+
+def run_dag(
+    project: Project,
+    targets: Iterable[str],
+    *,
+    purposes: Optional[Iterable[str]] = None,
+    settings: Optional[Dict[str, Any]] = None,
+    max_workers: int = 4,
+    reuse_existing: bool = True,
+    on_done: Optional[DoneCallback] = None,
+) -> Dict[str, ModuleOutcome]:
+    """
+    Run every ready module of the union DAG at the same time.
+
+    - Each result is written to project[module]["current"] as soon as it finishes.
+    - A failed module only skips its own descendants; independent branches keep running.
+    - With reuse_existing, ancestors that already have output (and are not targets) are not re-run.
+    - on_done(module, outcome) is called from the caller's thread.
+
+    Outcome: {"status": "ok"|"failed"|"skipped"|"reused", "text", "error", "seconds", "post_check_ok", "post_check_msg",
+    "metrics"}
+    """
+    target_set = set(targets)
+    dag = build_dag(target_set, purposes)
+    run_settings = dict(settings if settings is not None else project["settings"])
+    # 限流按项目轮转
+    run_settings.setdefault("session_key", project["meta"].get("project_id") or "")
+    # 后置校验按项目语言选规则
+    run_settings.setdefault("lang", project["meta"].get("lang"))
+    outcomes: Dict[str, ModuleOutcome] = {}
+    write_lock = threading.Lock()
+
+    def _finish(module: str, outcome: ModuleOutcome) -> None:
+        outcomes[module] = outcome
+        if on_done:
+            on_done(module, outcome)
+
+    for module in dag:
+        if reuse_existing and module not in target_set and has_current(project, module):
+            _finish(module, {"status": "reused", "text": project[module]["current"]})
+
+    def _run(module: str, module_input: str) -> ModuleOutcome:
+        t0 = time.monotonic()
+        if module == "A" and run_settings.get("incremental"):
+            # A 没有并行的兄弟模块，增量路径直接写回 project 和分段记录
+            result = run_module_a_incremental(project, run_settings)
+        else:
+            result = run_module(module_name=module, input_text=module_input, settings=run_settings)
+        with write_lock:
+            project[module]["current"] = result["text"]
+            mark_generated(project, module, module_input, result.get("metrics"))
+        return {
+            "status": "ok",
+            "text": result["text"],
+            "seconds": round(time.monotonic() - t0, 2),
+            "post_check_ok": result["post_check_ok"],
+            "post_check_msg": result["post_check_msg"],
+            "metrics": result.get("metrics"),
+        }
+
+    def _ready() -> List[str]:
+        return [
+            m
+            for m, prev in dag.items()
+            if m not in outcomes
+            and m not in running.values()
+            and (prev is None or outcomes.get(prev, {}).get("status") in ("ok", "reused"))
+        ]
+
+    running: Dict[Future, str] = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="dag") as pool:
+        while True:
+            for module in _ready():
+                prev = dag[module]
+                with write_lock:
+                    module_input = source_text(project) if prev is None else project[prev]["current"]
+                running[pool.submit(_run, module, module_input)] = module
+            if not running:
+                break
+            done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for fut in done:
+                module = running.pop(fut)
+                try:
+                    _finish(module, fut.result())
+                except Exception as e:
+                    _finish(module, {"status": "failed", "error": str(e)})
+                    for child in sorted(_descendants(dag, module)):
+                        if child not in outcomes:
+                            _finish(child, {"status": "skipped", "error": f"上游模块 {module} 失败"})
+    return outcomes
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import bisect
+import hashlib
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from core.file_io import Cue
+from core.project_state import CueRecord
+
+# 可以回写到原字幕时间轴的模块：A 逐句保留原文，E 是口播稿
+SUBTITLE_MODULES = ("A", "E")
+# 每条输出字幕的最大字数（超出时在标点处断开）
+MAX_CUE_CHARS = 36
+MIN_CUE_S = 0.5
+# 锚点长度（归一化字符数）：先用长锚点在全文对齐，再在锚点之间的大空隙里用短锚点细化
+ANCHOR_SIZES = (8, 4)
+_REFINE_MIN_GAP = 16
+
+_PIECE_RE = re.compile(r"[^，。！？!?；;,、]+[，。！？!?；;,、]*|[，。！？!?；;,、]+")
+_STRUCTURAL_RE = re.compile(r"^\s*(?:《.*》|#+\s.*|【.*】|-{3,}|\*{3,})\s*$")
+
+
+def cues_from_records(records: Iterable[CueRecord]) -> List[Cue]:
+    return [Cue(start=float(r["start"]), end=float(r["end"]), text=str(r["text"])) for r in records]
+
+
+def cue_records(cues: Iterable[Cue]) -> List[CueRecord]:
+    return [CueRecord(start=c.start, end=c.end, text=c.text) for c in cues]
+
+
+def cues_digest(cues: Sequence[Cue]) -> str:
+    h = hashlib.sha256()
+    for c in cues:
+        h.update(f"{c.start:.3f}|{c.end:.3f}|{c.text}\0".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _srt_time(seconds: float) -> str:
+    ms = int(round(max(0.0, seconds) * 1000))
+    h, ms = divmod(ms, 3_600_000)
+    m, ms = divmod(ms, 60_000)
+    s, ms = divmod(ms, 1000)
+    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+
+
+def format_srt(cues: Iterable[Cue]) -> str:
+    blocks = [
+        f"{i}\n{_srt_time(c.start)} --> {_srt_time(c.end)}\n{c.text}\n" for i, c in enumerate(cues, start=1)
+    ]
+    return "\n".join(blocks)
+
+
+def split_subtitle_units(text: str, max_chars: int = MAX_CUE_CHARS) -> List[str]:
+    """
+    Output text as subtitle-sized units: one per line, long lines packed from clause pieces up to
+    max_chars. Headings and separators (《…》, # …, 【…】) are not subtitle content and are dropped.
+    """
+    units: List[str] = []
+    for line in text.split("\n"):
+        line = line.strip()
+        if not line or _STRUCTURAL_RE.match(line):
+            continue
+        cur = ""
+        for piece in _PIECE_RE.findall(line):
+            while len(piece) > max_chars:
+                if cur:
+                    units.append(cur)
+                    cur = ""
+                units.append(piece[:max_chars])
+                piece = piece[max_chars:]
+            if cur and len(cur) + len(piece) > max_chars:
+                units.append(cur)
+                cur = ""
+            cur += piece
+        if cur:
+            units.append(cur)
+    return units
+
+
+def _normalize(text: str) -> str:
+    # 与原文核对一致：只比较字母、数字、汉字，标点和空白不影响对齐
+    return "".join(ch for ch in text.lower() if ch.isalnum())
+
+
+def _unique_grams(s: str, k: int, lo: int, hi: int) -> Dict[str, int]:
+    seen: Dict[str, int] = {}
+    for i in range(lo, hi - k + 1):
+        g = s[i : i + k]
+        seen[g] = -1 if g in seen else i
+    return {g: i for g, i in seen.items() if i >= 0}
+
+
+def _chain(pairs: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Longest chain of (out, src) pairs increasing in both coordinates (pairs come sorted by out)."""
+    tails: List[int] = []
+    tail_idx: List[int] = []
+    prev: List[int] = [-1] * len(pairs)
+    for i, (_o, s) in enumerate(pairs):
+        j = bisect.bisect_left(tails, s)
+        if j == len(tails):
+            tails.append(s)
+            tail_idx.append(i)
+        else:
+            tails[j] = s
+            tail_idx[j] = i
+        prev[i] = tail_idx[j - 1] if j else -1
+    out: List[Tuple[int, int]] = []
+    i = tail_idx[-1] if tail_idx else -1
+    while i >= 0:
+        out.append(pairs[i])
+        i = prev[i]
+    return out[::-1]
+
+
+def _anchors(out: str, src: str, o_lo: int, o_hi: int, s_lo: int, s_hi: int, level: int) -> List[Tuple[int, int]]:
+    """
+    Monotone anchor points (out_pos, src_pos) inside the window: k-grams that occur exactly once on
+    each side, reduced to their longest increasing chain; gaps between anchors are refined
+    recursively with the next (shorter) anchor size.
+    """
+    if level >= len(ANCHOR_SIZES):
+        return []
+    k = ANCHOR_SIZES[level]
+    src_grams = _unique_grams(src, k, s_lo, s_hi)
+    out_grams = _unique_grams(out, k, o_lo, o_hi)
+    pairs = sorted((o, src_grams[g]) for g, o in out_grams.items() if g in src_grams)
+    points: List[Tuple[int, int]] = []
+    last_o, last_s = o_lo - 1, s_lo - 1
+    for o, s in _chain(pairs):
+        # 展开为逐字对应，跳过与前一个锚点重叠的部分
+        for j in range(k):
+            if o + j > last_o and s + j > last_s:
+                points.append((o + j, s + j))
+                last_o, last_s = o + j, s + j
+
+    refined: List[Tuple[int, int]] = []
+    bounds = [(o_lo - 1, s_lo - 1)] + points + [(o_hi, s_hi)]
+    for (o1, s1), (o2, s2) in zip(bounds, bounds[1:]):
+        if o2 - o1 > _REFINE_MIN_GAP and s2 - s1 > _REFINE_MIN_GAP:
+            refined += _anchors(out, src, o1 + 1, o2, s1 + 1, s2, level + 1)
+        if o2 < o_hi:
+            refined.append((o2, s2))
+    return refined
+
+
+def map_positions(out: str, src: str) -> List[float]:
+    """
+    For every character of `out`, a (fractional) position in `src`. Characters covered by an anchor
+    map exactly; the rest are interpolated linearly between the surrounding anchors. Runs in
+    O(n log n) instead of the O(n·m) of a full edit-distance alignment.
+    """
+    if not out or not src:
+        return [0.0] * len(out)
+    points = _anchors(out, src, 0, len(out), 0, len(src), 0)
+    bounds = [(-1, -1.0)] + [(o, float(s)) for o, s in points] + [(len(out), float(len(src)))]
+    mapped: List[float] = [0.0] * len(out)
+    for (o1, s1), (o2, s2) in zip(bounds, bounds[1:]):
+        if o1 >= 0:
+            mapped[o1] = s1
+        span = o2 - o1
+        for o in range(o1 + 1, o2):
+            mapped[o] = s1 + (s2 - s1) * (o - o1) / span
+    return [min(max(p, 0.0), len(src) - 1.0) for p in mapped]
+
+
+def align_to_cues(cues: Sequence[Cue], text: str, *, max_chars: int = MAX_CUE_CHARS) -> List[Cue]:
+    """
+    Map module output (cleaned transcript or podcast script) back onto the original subtitle
+    timeline. The output is cut into subtitle-sized units; each unit takes its start/end from the
+    source cues its first/last characters align to (interpolated within a cue by character offset).
+    """
+    if not cues:
+        return []
+    # 原文：归一化字符 -> 所在字幕下标，以及每条字幕在归一化文本中的起点和长度
+    src_parts: List[str] = []
+    cue_first: List[int] = []
+    pos = 0
+    for cue in cues:
+        norm = _normalize(cue.text)
+        cue_first.append(pos)
+        src_parts.append(norm)
+        pos += len(norm)
+    src = "".join(src_parts)
+
+    units = split_subtitle_units(text, max_chars)
+    unit_norm = [_normalize(u) for u in units]
+    mapped = map_positions("".join(unit_norm), src)
+
+    def _time_at(p: float) -> float:
+        i = max(0, bisect.bisect_right(cue_first, int(p)) - 1)
+        length = len(src_parts[i])
+        cue = cues[i]
+        if not length:
+            return cue.start
+        frac = min(1.0, max(0.0, (p - cue_first[i]) / length))
+        return cue.start + (cue.end - cue.start) * frac
+
+    out: List[Cue] = []
+    offset = 0
+    prev_end = 0.0
+    for unit, norm in zip(units, unit_norm):
+        if not norm:
+            continue
+        first, last = mapped[offset], mapped[offset + len(norm) - 1]
+        offset += len(norm)
+        start = max(_time_at(first), prev_end)
+        end = max(_time_at(last + 1), start + MIN_CUE_S)
+        out.append(Cue(start=round(start, 3), end=round(end, 3), text=unit))
+        prev_end = end
+    return out
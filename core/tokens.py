@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import re
+
+# CJK 表意文字、假名、全角标点：大致按 1 字 ≈ 0.6 token 估算（DeepSeek/Qwen 词表实测量级）
+CJK_CLASS = r"\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef"
+_CJK_RE = re.compile(f"[{CJK_CLASS}]")
+_WORD_RE = re.compile(rf"[A-Za-z0-9_]+|[^\sA-Za-z0-9_{CJK_CLASS}]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap local token estimate for mixed CJK/English text.
+    Not exact; good enough for chunking and budget decisions.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = 0
+    for m in _WORD_RE.finditer(text):
+        tok = m.group(0)
+        # 英文单词约 4 字符 1 token；标点/符号按 1 token
+        other += (len(tok) + 3) // 4 if tok[0].isalnum() or tok[0] == "_" else 1
+    return int(cjk * 0.6 + other + 0.5)
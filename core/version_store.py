@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+from typing import List, Sequence, Union
+
+from core.diff_utils import sequence_opcodes
+
+# 增量：列表 [i1, i2] 表示复制基准版本的第 i1..i2 行（含换行符），字符串表示新增文本
+DeltaOp = Union[List[int], str]
+Delta = List[DeltaOp]
+
+
+def encode_delta(base: str, text: str) -> Delta:
+    """Line-level delta that rebuilds `text` from `base`. JSON-serializable."""
+    base_lines = base.splitlines(keepends=True)
+    new_lines = text.splitlines(keepends=True)
+    delta: Delta = []
+    for tag, i1, i2, j1, j2 in sequence_opcodes(base_lines, new_lines):
+        if tag == "equal":
+            delta.append([i1, i2])
+        elif j2 > j1:
+            literal = "".join(new_lines[j1:j2])
+            if delta and isinstance(delta[-1], str):
+                delta[-1] += literal
+            else:
+                delta.append(literal)
+    return delta
+
+
+def apply_delta(base: str, delta: Sequence[DeltaOp]) -> str:
+    base_lines = base.splitlines(keepends=True)
+    parts: List[str] = []
+    for op in delta:
+        if isinstance(op, str):
+            parts.append(op)
+        else:
+            parts.extend(base_lines[op[0] : op[1]])
+    return "".join(parts)
+
+
+def delta_size(delta: Sequence[DeltaOp]) -> int:
+    """Approximate memory cost in characters (literals plus a small per-op overhead)."""
+    return sum(len(op) if isinstance(op, str) else 8 for op in delta)
@@ -0,0 +1,303 @@
+from __future__ import annotations
+
+import threading
+import time
+from typing import Callable, Iterator, List
+
+import pytest
+
+from bench.mock_server import MockLLMServer
+from core import llm_client
+from core.governor import Governor, Lane, SingleFlight, TokenBucket
+from core import run_module
+from core.llm_client import CallStats, ChatClient
+
+
+def _wait_until(predicate: Callable[[], bool], timeout: float = 2.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("timed out")
+        time.sleep(0.005)
+
+
+def _queue(governor: Governor, lane: Lane, name: str, order: List[str]) -> threading.Thread:
+    """Start a thread that acquires for `lane` and wait until it is queued."""
+    depth = governor.stats()["queue_depth"]
+
+    def _run() -> None:
+        governor.acquire(lane, 0)
+        order.append(name)
+
+    thread = threading.Thread(target=_run, daemon=True)
+    thread.start()
+    _wait_until(lambda: governor.stats()["queue_depth"] == depth + 1)
+    return thread
+
+
+def test_priority_then_round_robin_by_session() -> None:
+    governor = Governor(max_inflight=1)
+    governor.acquire(Lane("busy"), 0)
+    order: List[str] = []
+    threads = [
+        _queue(governor, Lane("s1", "batch"), "batch-s1", order),
+        _queue(governor, Lane("s1"), "s1-first", order),
+        _queue(governor, Lane("s1"), "s1-second", order),
+        _queue(governor, Lane("s2"), "s2", order),
+    ]
+    for n in range(1, len(threads) + 1):
+        governor.release(0)
+        _wait_until(lambda: len(order) == n)
+    for thread in threads:
+        thread.join(1)
+    assert order == ["s1-first", "s2", "s1-second", "batch-s1"]
+
+
+def test_promote_moves_queued_requests_ahead_of_batch() -> None:
+    governor = Governor(max_inflight=1)
+    governor.acquire(Lane("busy"), 0)
+    order: List[str] = []
+    threads = [
+        _queue(governor, Lane("other", "batch"), "other-batch", order),
+        _queue(governor, Lane("p1", "batch"), "p1-claimed", order),
+    ]
+    assert governor.promote("p1") == 1
+    assert governor.stats()["queue_by_priority"] == {"interactive": 1, "batch": 1}
+    for n in range(1, len(threads) + 1):
+        governor.release(0)
+        _wait_until(lambda: len(order) == n)
+    assert order == ["p1-claimed", "other-batch"]
+
+
+def test_retry_is_admitted_ahead_of_new_requests() -> None:
+    governor = Governor(max_inflight=1)
+    governor.acquire(Lane("a"), 0)
+    order: List[str] = []
+    thread = _queue(governor, Lane("b"), "b", order)
+    # 重试方占着唯一的名额：排在等名额的请求后面就会卡死
+    governor.acquire(Lane("a"), 0, retry=True)
+    assert governor.stats()["retries"] == 1
+    assert order == []
+    governor.release(0)
+    thread.join(1)
+    assert order == ["b"]
+
+
+def test_hold_delays_every_request() -> None:
+    governor = Governor()
+    governor.hold(0.2)
+    assert governor.acquire(Lane("a"), 0) >= 0.15
+    assert governor.acquire(Lane("b"), 0) < 0.1
+
+
+def test_token_bucket_wait_and_cap() -> None:
+    bucket = TokenBucket(60)
+    now = bucket._stamp
+    assert bucket.wait_s(10, now) == 0.0
+    bucket.take(60)
+    assert bucket.wait_s(10, now) == pytest.approx(10.0)
+    assert bucket.wait_s(10, now + 4) == pytest.approx(6.0)
+    # 超过整桶的请求按整桶算
+    assert bucket.wait_s(600, now + 4) == pytest.approx(56.0)
+
+
+def test_token_settlement_returns_and_charges_difference() -> None:
+    governor = Governor(tpm=600)
+    governor.acquire(Lane(), 100)
+    assert governor.stats()["tpm_available"] == pytest.approx(500, abs=2)
+    governor.release(100, 30)
+    assert governor.stats()["tpm_available"] == pytest.approx(570, abs=2)
+    governor.acquire(Lane(), 100)
+    governor.release(100, 300)
+    assert governor.stats()["tpm_available"] == pytest.approx(270, abs=2)
+    assert governor.stats()["inflight"] == 0
+
+
+@pytest.mark.parametrize("with_stats", [True, False])
+def test_chat_settles_tokens_against_reported_usage(monkeypatch: pytest.MonkeyPatch, with_stats: bool) -> None:
+    governor = Governor(tpm=100_000)
+    monkeypatch.setattr(llm_client, "get_governor", lambda: governor)
+    stats = CallStats() if with_stats else None
+    with MockLLMServer() as server:
+        client = ChatClient(name="mock", base_url=server.url, max_retries=0)
+        text = client.chat(model="m", messages=[{"role": "user", "content": "你好"}], max_tokens=4096, stats=stats)
+    assert text
+    snap = governor.stats()
+    assert snap["inflight"] == 0
+    # 只扣实际用量，而不是预扣的 max_tokens
+    assert 100_000 - snap["tpm_available"] < 200
+    if stats is not None:
+        assert stats.prompt_tokens > 0 and stats.completion_tokens > 0
+
+
+class _Source:
+    def __init__(self, parts: List[str], fail_after: int = -1) -> None:
+        self.parts = parts
+        self.fail_after = fail_after
+        self.opened = 0
+        self.closed = False
+
+    def __call__(self) -> Iterator[str]:
+        self.opened += 1
+        return self._gen()
+
+    def _gen(self) -> Iterator[str]:
+        try:
+            for i, part in enumerate(self.parts):
+                if i == self.fail_after:
+                    raise ValueError("upstream failed")
+                yield part
+        finally:
+            self.closed = True
+
+
+def test_stream_shared_when_one_consumer_closes_early() -> None:
+    flights = SingleFlight()
+    source = _Source(["a", "b", "c"])
+    first, leader = flights.stream("k", source)
+    second, follower_leader = flights.stream("k", source)
+    assert leader and not follower_leader
+    assert next(first) == "a"
+    first.close()
+    assert not source.closed
+    assert list(second) == ["a", "b", "c"]
+    assert source.opened == 1
+    assert flights.stats()["coalesced"] == 1
+    assert flights.stats()["flights"] == 0
+
+
+def test_stream_closed_upstream_when_last_consumer_leaves() -> None:
+    flights = SingleFlight()
+    source = _Source(["a", "b", "c"])
+    first, _ = flights.stream("k", source)
+    second, _ = flights.stream("k", source)
+    assert next(first) == "a"
+    assert next(second) == "a"
+    first.close()
+    second.close()
+    assert source.closed
+    # 放弃的请求不再被合并：下一个调用重新发起
+    third, leader = flights.stream("k", source)
+    assert leader
+    assert list(third) == ["a", "b", "c"]
+
+
+def test_stream_error_reaches_every_consumer() -> None:
+    flights = SingleFlight()
+    source = _Source(["a", "b"], fail_after=1)
+    first, _ = flights.stream("k", source)
+    second, _ = flights.stream("k", source)
+    assert next(first) == "a"
+    with pytest.raises(ValueError):
+        next(first)
+    assert next(second) == "a"
+    with pytest.raises(ValueError):
+        next(second)
+
+
+def test_call_error_fans_out_to_followers() -> None:
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def _fail() -> str:
+        started.set()
+        release.wait(2)
+        raise ValueError("upstream failed")
+
+    errors: List[BaseException] = []
+
+    def _follow() -> None:
+        try:
+            flights.call("k", lambda: "unused")
+        except BaseException as e:
+            errors.append(e)
+
+    def _lead() -> None:
+        try:
+            flights.call("k", _fail)
+        except ValueError:
+            pass
+
+    leader = threading.Thread(target=_lead, daemon=True)
+    leader.start()
+    assert started.wait(2)
+    follower = threading.Thread(target=_follow, daemon=True)
+    follower.start()
+    _wait_until(lambda: flights.stats()["flight_waiters"] == 1)
+    release.set()
+    leader.join(2)
+    follower.join(2)
+    assert len(errors) == 1 and isinstance(errors[0], ValueError)
+
+
+def test_call_result_shared_with_followers() -> None:
+    flights = SingleFlight()
+    release = threading.Event()
+    calls: List[int] = []
+
+    def _fetch() -> str:
+        calls.append(1)
+        release.wait(2)
+        return "text"
+
+    results: List[tuple] = []
+    threads = [threading.Thread(target=lambda: results.append(flights.call("k", _fetch)), daemon=True) for _ in range(3)]
+    threads[0].start()
+    _wait_until(lambda: calls == [1])
+    for thread in threads[1:]:
+        thread.start()
+    _wait_until(lambda: flights.stats()["flight_waiters"] == 2)
+    release.set()
+    for thread in threads:
+        thread.join(2)
+    assert sorted(results) == [("text", False), ("text", False), ("text", True)]
+    assert len(calls) == 1
+
+
+class _SlowRegistry:
+    def __init__(self) -> None:
+        self.calls = 0
+        self.release = threading.Event()
+
+    def chat(self, provider: str, **request: object) -> str:
+        self.calls += 1
+        n = self.calls
+        self.release.wait(2)
+        return f"text {n}"
+
+    def chat_stream(self, provider: str, **request: object) -> Iterator[str]:
+        self.calls += 1
+        n = self.calls
+        self.release.wait(2)
+        yield f"text {n}"
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_regenerate_does_not_join_in_flight_request(monkeypatch: pytest.MonkeyPatch, streaming: bool) -> None:
+    registry = _SlowRegistry()
+    monkeypatch.setattr(run_module, "get_registry", lambda: registry)
+    governor = Governor()
+    monkeypatch.setattr(run_module, "get_governor", lambda: governor)
+    monkeypatch.setattr(run_module.get_response_cache(), "get", lambda key: None)
+    monkeypatch.setattr(run_module.get_response_cache(), "put", lambda key, value: None)
+    settings = {"model_provider": "mock", "model_name": "m", "max_tokens": 64}
+
+    def _run(use_cache: bool) -> str:
+        if streaming:
+            deltas = run_module.run_module_stream(module_name="A", input_text="你好", settings=settings, use_cache=use_cache)
+            return "".join(deltas)
+        return run_module._generate("A", "你好", settings, use_cache)
+
+    results: List[str] = []
+    first = threading.Thread(target=lambda: results.append(_run(True)), daemon=True)
+    first.start()
+    _wait_until(lambda: registry.calls == 1)
+    second = threading.Thread(target=lambda: results.append(_run(False)), daemon=True)
+    second.start()
+    # “重新生成”单独发请求，而不是等在途请求的结果
+    _wait_until(lambda: registry.calls == 2)
+    registry.release.set()
+    first.join(2)
+    second.join(2)
+    assert sorted(results) == ["text 1", "text 2"]
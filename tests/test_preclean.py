@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import pytest
+
+from core.preclean import Precleaner, load_rules, preclean
+
+
+@pytest.fixture(scope="module")
+def cleaner() -> Precleaner:
+    return load_rules()
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("嗯，今天我们聊创业。", "今天我们聊创业。"),
+        ("主持人说，然后，我们开始吧。", "主持人说，我们开始吧。"),
+        ("那个，呃，我们开始", "我们开始"),
+        # 不跟停顿的“然后”“就是”是正文
+        ("然后我们就是要做这件事", "然后我们就是要做这件事"),
+    ],
+)
+def test_fillers(cleaner: Precleaner, text: str, expected: str) -> None:
+    assert cleaner.clean(text).text == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("这个这个问题", "这个问题"),
+        ("我们我们今天聊聊", "我们今天聊聊"),
+        ("他们他们他们说", "他们说"),
+        ("我们，我们今天", "我们今天"),
+        ("其实一开，其实一开始", "其实一开始"),
+        ("我们的我们的产品", "我们的产品"),
+        ("我我我觉得", "我觉得"),
+        ("I I think the the point", "I think the point"),
+    ],
+)
+def test_stutters_collapse_to_one_unit(cleaner: Precleaner, text: str, expected: str) -> None:
+    result = cleaner.clean(text)
+    assert result.text == expected
+    assert result.counts["stutters"] >= 1
+
+
+@pytest.mark.parametrize("text", ["谢谢谢谢谢谢大家", "一点一点来", "研究研究吧", "哈哈哈哈哈", "天天天天"])
+def test_reduplicated_words_are_kept(cleaner: Precleaner, text: str) -> None:
+    result = cleaner.clean(text)
+    assert result.text == text
+    assert result.counts["stutters"] == 0
+
+
+def test_terms(cleaner: Precleaner) -> None:
+    result = cleaner.clean("我们做 ai 的 b端 saas，不做 app")
+    assert result.text == "我们做 AI 的 B端 SaaS，不做 App"
+    assert result.counts["terms"] == 4
+    # 词边界：单词内部的 "ai" 不改
+    assert cleaner.clean("he said so").text == "he said so"
+
+
+def test_speaker_labels(cleaner: Precleaner) -> None:
+    text = "Host: 欢迎收听\n【嘉賓】：谢谢邀请\n主持人：好的"
+    result = cleaner.clean(text, ("主持人", "嘉宾"))
+    assert result.text == "主持人：欢迎收听\n嘉宾：谢谢邀请\n主持人：好的"
+    assert result.counts["speakers"] == 2
+    # 没填说话人时不动标签
+    assert cleaner.clean(text).text == text
+
+
+def test_duplicate_lines_and_savings(cleaner: Precleaner) -> None:
+    text = "主持人：你好\n主持人：你好\n嘉宾：嗯，你好"
+    result = cleaner.clean(text)
+    assert result.text == "主持人：你好\n嘉宾：你好"
+    assert result.counts["duplicate_lines"] == 1
+    assert result.chars_saved == len(text) - len(result.text)
+    assert result.tokens_saved > 0
+
+
+def test_preclean_memo_returns_same_result() -> None:
+    text = "这个这个问题，嗯，我们聊聊"
+    assert preclean(text) is preclean(text)
+    assert preclean(text).text == "这个问题，我们聊聊"